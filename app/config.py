@@ -21,6 +21,18 @@ class Settings:
         # Bedrock設定
         self.BEDROCK_EMBEDDINGS_MODEL_ID: str = os.getenv("BEDROCK_EMBEDDINGS_MODEL_ID", "cohere.embed-v4:0")
         self.USE_BEDROCK: bool = os.getenv("USE_BEDROCK", "true").lower() == "true"
+        # langchain_aws が使えない場合に boto3 へ固定する回路の設定（失敗回数しきい値 / 再試行間隔）
+        self.EMBED_BACKEND_FAILURE_THRESHOLD: int = int(os.getenv("EMBED_BACKEND_FAILURE_THRESHOLD", "1"))
+        self.EMBED_BACKEND_REPROBE_SECONDS: float = float(os.getenv("EMBED_BACKEND_REPROBE_SECONDS", "300"))
+        # Bedrock呼び出しのレート制限（0で無制限）・リトライ・コネクションプール
+        self.BEDROCK_MAX_RPS: float = float(os.getenv("BEDROCK_MAX_RPS", "0"))
+        self.BEDROCK_MAX_TOKENS_PER_MIN: float = float(os.getenv("BEDROCK_MAX_TOKENS_PER_MIN", "0"))
+        self.BEDROCK_MAX_RETRIES: int = int(os.getenv("BEDROCK_MAX_RETRIES", "5"))
+        self.BEDROCK_RETRY_BASE_DELAY: float = float(os.getenv("BEDROCK_RETRY_BASE_DELAY", "0.5"))
+        self.BEDROCK_RETRY_MAX_DELAY: float = float(os.getenv("BEDROCK_RETRY_MAX_DELAY", "20"))
+        self.BEDROCK_MAX_POOL_CONNECTIONS: int = int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "32"))
+        self.BEDROCK_CONNECT_TIMEOUT: float = float(os.getenv("BEDROCK_CONNECT_TIMEOUT", "5"))
+        self.BEDROCK_READ_TIMEOUT: float = float(os.getenv("BEDROCK_READ_TIMEOUT", "30"))
         
         # Cohere直API設定（Bedrock不使用時のみ必要）
         self.COHERE_API_KEY: Optional[str] = os.getenv("COHERE_API_KEY")
@@ -31,13 +43,90 @@ class Settings:
         self.VECTOR_DIR: str = os.getenv("VECTOR_DIR", "/tmp/vectorstore")
         self.INDEX_NAME: str = os.getenv("INDEX_NAME", "vendor_cohere_v4")
         self.JSON_PATH: str = os.getenv("JSON_PATH", "data/vendors.json")
+        # インデックス種別（flat / hnsw / ivf_flat / ivf_pq / sq8 / fp16 / binary）
+        self.FAISS_INDEX_TYPE: str = os.getenv("FAISS_INDEX_TYPE", "flat")
+        self.FAISS_TRAIN_SAMPLE: int = int(os.getenv("FAISS_TRAIN_SAMPLE", "100000"))
+        self.BINARY_RESCORE_FACTOR: int = int(os.getenv("BINARY_RESCORE_FACTOR", "10"))
+        # IVF系（nlist=0 は件数から自動決定）・PQ（m=0 は次元/16）・HNSW のパラメータ
+        self.IVF_NLIST: int = int(os.getenv("IVF_NLIST", "0"))
+        self.IVF_NPROBE: int = int(os.getenv("IVF_NPROBE", "16"))
+        self.PQ_M: int = int(os.getenv("PQ_M", "0"))
+        self.HNSW_M: int = int(os.getenv("HNSW_M", "32"))
+        self.HNSW_EF_CONSTRUCTION: int = int(os.getenv("HNSW_EF_CONSTRUCTION", "200"))
+        self.HNSW_EF_SEARCH: int = int(os.getenv("HNSW_EF_SEARCH", "64"))
+        # 読み込み時にインデックス・メタデータをメモリマップ（プロセス間でページキャッシュを共有）
+        self.FAISS_MMAP: bool = os.getenv("FAISS_MMAP", "true").lower() == "true"
+        # 削除・更新で無効化（トゥームストーン）された件数がこの割合を超えたらバックグラウンドで詰め直す
+        self.INDEX_COMPACT_RATIO: float = float(os.getenv("INDEX_COMPACT_RATIO", "0.2"))
+        # フィルタ付き検索で許可件数がこれ以下なら許可集合だけを全件内積、超えれば IDSelector 付きで ANN 検索
+        self.FILTER_EXHAUSTIVE_MAX: int = int(os.getenv("FILTER_EXHAUSTIVE_MAX", "4096"))
+        # 閾値のみ指定の検索（range_search）で返す最大件数
+        self.RANGE_SEARCH_MAX_RESULTS: int = int(os.getenv("RANGE_SEARCH_MAX_RESULTS", "1000"))
+        # ハイブリッド検索（ベクトル＋BM25）の Reciprocal Rank Fusion 定数（大きいほど下位の順位も効く）
+        self.RRF_K: int = int(os.getenv("RRF_K", "60"))
+        # バージョン付きインデックスの保持数と、公開ポインタ（CURRENT）の監視間隔（0 は監視しない）
+        self.INDEX_KEEP_VERSIONS: int = int(os.getenv("INDEX_KEEP_VERSIONS", "3"))
+        self.INDEX_WATCH_INTERVAL: float = float(os.getenv("INDEX_WATCH_INTERVAL", "0"))
+        # 同時に常駐させるインデックスのメモリ予算（MB、0 は無制限）。超えたら最も長く使われていないものから解放
+        self.INDEX_MEMORY_BUDGET_MB: int = int(os.getenv("INDEX_MEMORY_BUDGET_MB", "0"))
+        # ローカルにも S3 にも無かったインデックス名を探し直さない期間（秒、0 は毎回探す）
+        self.INDEX_NOT_FOUND_TTL: float = float(os.getenv("INDEX_NOT_FOUND_TTL", "30"))
         
         # 埋め込み設定
         self.COHERE_MODEL: str = "embed-multilingual-v3.0"
         self.BATCH_SIZE: int = 64
+        # 同時に投げるバッチ数とバッチ単位のリトライ（再試行を持たない Cohere 直 API 等のみ。Bedrock は BEDROCK_MAX_RETRIES）
+        self.EMBED_CONCURRENCY: int = int(os.getenv("EMBED_CONCURRENCY", "4"))
+        self.EMBED_BATCH_RETRIES: int = int(os.getenv("EMBED_BATCH_RETRIES", "2"))
+        self.EMBED_RETRY_BASE_DELAY: float = float(os.getenv("EMBED_RETRY_BASE_DELAY", "1.0"))
+        # 出力次元（Cohere v4 の output_dimension。未指定時はモデル既定）
+        self.EMBED_DIMENSION: Optional[int] = int(os.getenv("EMBED_DIMENSION")) if os.getenv("EMBED_DIMENSION") else None
+        
+        # 埋め込みキャッシュ設定（ディスク永続）
+        self.EMBED_CACHE_ENABLED: bool = os.getenv("EMBED_CACHE_ENABLED", "true").lower() == "true"
+        self.EMBED_CACHE_PATH: str = os.getenv("EMBED_CACHE_PATH", "/tmp/embed_cache/embeddings.sqlite3")
+        self.EMBED_CACHE_MAX_BYTES: int = int(os.getenv("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+        self.EMBED_CACHE_DTYPE: str = os.getenv("EMBED_CACHE_DTYPE", "float32")
+        
+        # クエリ埋め込みキャッシュ設定（インメモリ LRU/TTL）
+        self.QUERY_CACHE_ENABLED: bool = os.getenv("QUERY_CACHE_ENABLED", "true").lower() == "true"
+        self.QUERY_CACHE_MAX_ENTRIES: int = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "10000"))
+        self.QUERY_CACHE_TTL_SECONDS: float = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "3600"))
+        # 検索レスポンスキャッシュ（キーにインデックスの版を含むため再構築・更新で自動的に無効化。TTL 0 は無期限）
+        self.RESPONSE_CACHE_ENABLED: bool = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        self.RESPONSE_CACHE_MAX_ENTRIES: int = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+        self.RESPONSE_CACHE_TTL_SECONDS: float = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "0"))
+        
+        # アドミッション制御（同時実行数・待ち行列の長さ・待ち時間の上限。超えたら 503 + Retry-After）
+        # 検索系とインデックス管理系は別レーン。/health は対象外（0 は制限なし）
+        self.SEARCH_MAX_CONCURRENCY: int = int(os.getenv("SEARCH_MAX_CONCURRENCY", "32"))
+        self.SEARCH_MAX_QUEUE: int = int(os.getenv("SEARCH_MAX_QUEUE", "64"))
+        self.SEARCH_QUEUE_TIMEOUT_MS: float = float(os.getenv("SEARCH_QUEUE_TIMEOUT_MS", "2000"))
+        self.ADMIN_MAX_CONCURRENCY: int = int(os.getenv("ADMIN_MAX_CONCURRENCY", "2"))
+        self.ADMIN_MAX_QUEUE: int = int(os.getenv("ADMIN_MAX_QUEUE", "4"))
+        self.ADMIN_QUEUE_TIMEOUT_MS: float = float(os.getenv("ADMIN_QUEUE_TIMEOUT_MS", "60000"))
+        
+        # 計測: /metrics（Prometheus テキスト形式）の公開と、段階別内訳の Server-Timing ヘッダー付与
+        self.METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+        self.SERVER_TIMING_ENABLED: bool = os.getenv("SERVER_TIMING_ENABLED", "true").lower() == "true"
+        # クエリ埋め込み用スレッドプールの上限（イベントループ外で同時に走るリモート呼び出し数）
+        self.EMBED_QUERY_WORKERS: int = int(os.getenv("EMBED_QUERY_WORKERS", "32"))
+        # クエリのマイクロバッチ化（0で無効。数ms待って同時到着分を1回のBedrock呼び出しにまとめる）
+        self.QUERY_BATCH_WINDOW_MS: float = float(os.getenv("QUERY_BATCH_WINDOW_MS", "0"))
+        self.QUERY_BATCH_MAX_SIZE: int = int(os.getenv("QUERY_BATCH_MAX_SIZE", "32"))
+        
+        # 埋め込みバックエンド（bedrock / cohere / local）。未指定時は USE_BEDROCK から決定
+        self.EMBEDDER_BACKEND: str = os.getenv("EMBEDDER_BACKEND", "bedrock" if self.USE_BEDROCK else "cohere").lower()
+        if self.EMBEDDER_BACKEND in ("bedrock", "cohere"):
+            self.USE_BEDROCK = self.EMBEDDER_BACKEND == "bedrock"
+        # ローカル（決定的ハッシュ）埋め込みの次元と擬似レイテンシ
+        self.LOCAL_EMBED_DIMENSION: int = int(os.getenv("LOCAL_EMBED_DIMENSION", "1024"))
+        self.LOCAL_EMBED_LATENCY_MS: float = float(os.getenv("LOCAL_EMBED_LATENCY_MS", "0"))
         
         # 設定値の検証
-        if not self.USE_BEDROCK and not self.COHERE_API_KEY:
+        if self.EMBEDDER_BACKEND not in ("bedrock", "cohere", "local"):
+            raise ValueError(f"Unknown EMBEDDER_BACKEND: {self.EMBEDDER_BACKEND}")
+        if self.EMBEDDER_BACKEND == "cohere" and not self.COHERE_API_KEY:
             raise ValueError("COHERE_API_KEY is required when USE_BEDROCK is False")
         
         # ディレクトリが存在しない場合は作成
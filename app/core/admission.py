@@ -0,0 +1,168 @@
+"""
+アドミッション制御（同時実行数の上限＋待ち行列の長さ・待ち時間の上限による負荷遮断）
+"""
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(Exception):
+    """処理枠・待ち行列が埋まっている（HTTP 503 + Retry-After で返す）"""
+
+    def __init__(self, lane: str, reason: str, retry_after: int):
+        super().__init__(f"{lane} lane overloaded ({reason})")
+        self.lane = lane
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    レーン単位のアドミッション制御（イベントループ内で使う）
+
+    同時実行は max_concurrency まで。枠が空いていなければ最大 max_queue 件まで FIFO で待たせ、
+    queue_timeout 秒以内に枠が回ってこなければ諦める。待ち行列も埋まっていれば即座に拒否する。
+    解放された枠は待機中の先頭へ直接引き渡す（後から来たリクエストに追い越されない）。
+    max_concurrency <= 0 なら制限しない。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int, queue_timeout: float):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+        self.queue_wait_seconds = 0.0
+        # 1件あたりの処理時間の指数移動平均（Retry-After の見積もり用）
+        self._service_time = 0.0
+
+    @property
+    def queue_length(self) -> int:
+        return len(self._waiters)
+
+    def retry_after(self) -> int:
+        """待ち行列がはけるまでのおおよその秒数（最低1秒）"""
+        if self.max_concurrency <= 0:
+            return 1
+        estimate = self._service_time * (len(self._waiters) + 1) / self.max_concurrency
+        return max(1, math.ceil(estimate))
+
+    async def acquire(self) -> None:
+        """処理枠を取得（取れなければ Overloaded）"""
+        if self.max_concurrency <= 0:
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.active < self.max_concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_queue_full += 1
+            raise Overloaded(self.name, "queue full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+            elif waiter.done() and not waiter.cancelled():
+                # 期限と同時に枠を引き渡された場合は次の待機者へ回す
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            self.rejected_timeout += 1
+            raise Overloaded(self.name, "queue timeout", self.retry_after())
+        finally:
+            self.queue_wait_seconds += time.perf_counter() - started
+        # 枠は release から引き渡し済み（active はそのまま）
+        self.admitted += 1
+
+    def release(self) -> None:
+        """処理枠を返却（待機者がいれば先頭に引き渡す）"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """`async with controller.slot():` の間だけ処理枠を保持"""
+        await self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self._service_time = elapsed if not self._service_time else 0.9 * self._service_time + 0.1 * elapsed
+            self.release()
+
+    def stats(self) -> Dict[str, Any]:
+        """ヘルスチェック用の統計"""
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout": self.queue_timeout,
+            "active": self.active,
+            "queued_now": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "avg_queue_wait_ms": self.queue_wait_seconds / self.queued * 1000 if self.queued else 0.0,
+            "avg_service_ms": self._service_time * 1000,
+        }
+
+
+# グローバルコントローラー（シングルトン）
+_search_admission: Optional[AdmissionController] = None
+_admin_admission: Optional[AdmissionController] = None
+
+
+def get_search_admission() -> AdmissionController:
+    """検索系エンドポイントのレーンを取得（シングルトン）"""
+    global _search_admission
+    if _search_admission is None:
+        _search_admission = AdmissionController(
+            "search",
+            settings.SEARCH_MAX_CONCURRENCY,
+            settings.SEARCH_MAX_QUEUE,
+            settings.SEARCH_QUEUE_TIMEOUT_MS / 1000.0
+        )
+    return _search_admission
+
+
+def get_admin_admission() -> AdmissionController:
+    """インデックス管理・評価エンドポイントのレーンを取得（シングルトン）"""
+    global _admin_admission
+    if _admin_admission is None:
+        _admin_admission = AdmissionController(
+            "admin",
+            settings.ADMIN_MAX_CONCURRENCY,
+            settings.ADMIN_MAX_QUEUE,
+            settings.ADMIN_QUEUE_TIMEOUT_MS / 1000.0
+        )
+    return _admin_admission
+
+
+def admission_stats() -> Dict[str, Any]:
+    """全レーンの統計"""
+    return {"search": get_search_admission().stats(), "admin": get_admin_admission().stats()}
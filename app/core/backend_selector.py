@@ -0,0 +1,92 @@
+"""
+埋め込みバックエンド選択（langchain_aws / boto3）のサーキットブレーカー
+"""
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIMARY = "langchain_aws"
+FALLBACK = "boto3"
+
+
+class BackendSelector:
+    """使えるバックエンドを記憶し、毎回の「langchain→boto3」二重呼び出しを避ける
+
+    プライマリ（langchain_aws）が連続で failure_threshold 回失敗したら回路を開き、
+    以降は reprobe_seconds の間フォールバック（boto3）を直接使う。
+    期限が来たら1リクエストだけプライマリを再試行（half-open）し、成功すれば戻す。
+    """
+
+    def __init__(self, failure_threshold: int = 1, reprobe_seconds: float = 300.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reprobe_seconds = reprobe_seconds
+        self.consecutive_failures = 0
+        self.open_until: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.primary_calls = 0
+        self.fallback_calls = 0
+        self.probes = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def use_primary(self) -> bool:
+        """今回の呼び出しでプライマリを試すべきか"""
+        with self._lock:
+            if self.open_until is None:
+                return True
+            if time.monotonic() >= self.open_until and not self._probing:
+                self._probing = True
+                self.probes += 1
+                logger.info(f"Re-probing embedding backend {PRIMARY}")
+                return True
+            return False
+
+    def record_primary_success(self) -> None:
+        with self._lock:
+            self.primary_calls += 1
+            if self.open_until is not None:
+                logger.info(f"Embedding backend {PRIMARY} recovered, closing circuit")
+            self.consecutive_failures = 0
+            self.open_until = None
+            self._probing = False
+
+    def record_primary_failure(self, reason: str) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            self.last_error = reason
+            self._probing = False
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.open_until is None:
+                    logger.warning(f"Embedding backend {PRIMARY} unusable ({reason}), switching to {FALLBACK}")
+                self.open_until = time.monotonic() + self.reprobe_seconds
+
+    def release_probe(self) -> None:
+        """結果を判定できなかった再試行（スロットリング等）を取り消し、次の呼び出しで再び試せるようにする"""
+        with self._lock:
+            self._probing = False
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallback_calls += 1
+
+    @property
+    def active(self) -> str:
+        """現在選択中のバックエンド名"""
+        return PRIMARY if self.open_until is None else FALLBACK
+
+    def status(self) -> Dict[str, Any]:
+        """ヘルスチェック用の状態"""
+        with self._lock:
+            return {
+                "active": PRIMARY if self.open_until is None else FALLBACK,
+                "circuit_open": self.open_until is not None,
+                "reprobe_in_seconds": max(0.0, self.open_until - time.monotonic()) if self.open_until else None,
+                "consecutive_failures": self.consecutive_failures,
+                "last_error": self.last_error,
+                "primary_calls": self.primary_calls,
+                "fallback_calls": self.fallback_calls,
+                "probes": self.probes,
+            }
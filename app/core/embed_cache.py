@@ -0,0 +1,176 @@
+"""
+埋め込みキャッシュ（ディスク永続・コンテンツアドレス）
+"""
+import os
+import sqlite3
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCache:
+    """(text, model_id, input_type, dimension) のハッシュをキーとするディスクキャッシュ
+
+    ベクトルは生バイト列（float32/float16）でSQLiteに格納し、
+    合計サイズが予算を超えたら最終アクセスの古い順に削除する（LRU）。
+    """
+
+    def __init__(self, path: str, max_bytes: int, dtype: str = "float32"):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.dtype = np.dtype(dtype)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._clock = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vec BLOB NOT NULL,"
+            " nbytes INTEGER NOT NULL,"
+            " last_access INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings(last_access)")
+        self._conn.commit()
+
+        row = self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0), COALESCE(MAX(last_access), 0) FROM embeddings"
+        ).fetchone()
+        # 件数・サイズはメモリ上で追跡し、統計の取得で SQLite を走査しない
+        self._entries = int(row[0])
+        self._total_bytes = int(row[1])
+        self._clock = int(row[2])
+        logger.info(f"Opened embedding cache {path} ({self._total_bytes} bytes)")
+
+    @staticmethod
+    def make_key(text: str, model_id: str, input_type: str, dimension: Optional[int]) -> str:
+        """キャッシュキーを生成"""
+        h = hashlib.sha256()
+        for part in (model_id, input_type, str(dimension or 0), text):
+            h.update(part.encode("utf-8"))
+            h.update(b"\x1f")
+        return h.hexdigest()
+
+    def _tick(self) -> int:
+        self._clock += 1
+        return self._clock
+
+    def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        """複数キーを一括取得（見つかったものだけ返す）"""
+        found: Dict[str, np.ndarray] = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            # SQLiteの変数上限を避けるため分割
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT key, vec FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=self.dtype).astype(np.float32)
+
+            if found:
+                now = self._tick()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                    [(now, k) for k in found]
+                )
+                self._conn.commit()
+
+            hits = sum(1 for k in keys if k in found)
+            self.hits += hits
+            self.misses += len(keys) - hits
+        return found
+
+    def put_many(self, items: Dict[str, np.ndarray]) -> None:
+        """複数ベクトルを一括保存し、予算超過分をLRUで削除"""
+        if not items:
+            return
+        with self._lock:
+            now = self._tick()
+            rows = []
+            for key, vec in items.items():
+                blob = np.ascontiguousarray(vec, dtype=self.dtype).tobytes()
+                rows.append((key, blob, len(blob), now))
+
+            replaced = 0
+            replaced_bytes = 0
+            keys = [r[0] for r in rows]
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                placeholders = ",".join("?" * len(chunk))
+                count, nbytes = self._conn.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings WHERE key IN ({placeholders})", chunk
+                ).fetchone()
+                replaced += int(count)
+                replaced_bytes += int(nbytes)
+
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vec, nbytes, last_access) VALUES (?, ?, ?, ?)",
+                rows
+            )
+            self._entries += len(rows) - replaced
+            self._total_bytes += sum(r[2] for r in rows) - replaced_bytes
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self) -> None:
+        """予算を超えていれば古いエントリから削除（予算の90%まで）"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = int(self.max_bytes * 0.9)
+        cursor = self._conn.execute("SELECT key, nbytes FROM embeddings ORDER BY last_access ASC")
+        victims = []
+        freed = 0
+        for key, nbytes in cursor:
+            if self._total_bytes - freed <= target:
+                break
+            victims.append((key,))
+            freed += nbytes
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", victims)
+        self._total_bytes -= freed
+        self._entries -= len(victims)
+        self.evictions += len(victims)
+        logger.info(f"Evicted {len(victims)} embeddings from cache ({freed} bytes)")
+
+    def clear(self) -> None:
+        """キャッシュを全削除"""
+        with self._lock:
+            self._conn.execute("DELETE FROM embeddings")
+            self._conn.commit()
+            self._entries = 0
+            self._total_bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ヒット/ミス統計を取得
+
+        /health から呼ばれるため、ロックも SQLite も使わずメモリ上のカウンタだけを読む
+        （put_many・削除の実行中でも待たない。値はその時点の概算）。
+        """
+        hits, misses = self.hits, self.misses
+        total = hits + misses
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "entries": self._entries,
+            "bytes": self._total_bytes,
+            "max_bytes": self.max_bytes,
+        }
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
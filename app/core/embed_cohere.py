@@ -1,24 +1,60 @@
 """
 埋め込み処理（Bedrock/Cohere対応, Bedrockのfloat構造対応＋再帰抽出と詳細ログ＋boto3フォールバック）
+
+バックエンドは EMBEDDER_BACKEND（bedrock / cohere / local）で切り替える。
 """
 import numpy as np
 import logging
-import json
-from typing import List, Any, Optional
+import time
+import orjson
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Any, Optional, Dict, Callable, Tuple
 from app.config import settings
+from app.core.embed_cache import EmbeddingCache
+from app.core.backend_selector import BackendSelector
+from app.core.rate_limit import (
+    RateLimiter, THROTTLING_ERROR_CODES, backoff_delay, error_code, is_retryable_error
+)
+from app.core.query_batcher import QueryBatcher
+from app.core.embedders import Embedder, LocalHashEmbedder
+from app.utils.cache import LRUCache
+from app.utils.text import normalize_query_text
+from app.utils.telemetry import run_in_executor, timed
 
 logger = logging.getLogger(__name__)
 
 _embeddings_client = None
+_embedder: Optional[Embedder] = None
 _bedrock_client = None  # boto3 runtime client
+_embedding_cache: Optional[EmbeddingCache] = None
+_query_cache: Optional[LRUCache] = None
+_query_executor: Optional[ThreadPoolExecutor] = None
+_query_batcher: Optional[QueryBatcher] = None
+_backend_selector: Optional[BackendSelector] = None
+_rate_limiter: Optional[RateLimiter] = None
+_bedrock_stats: Dict[str, int] = {"calls": 0, "retries": 0, "throttles": 0, "server_errors": 0, "failures": 0}
+_stats_lock = threading.Lock()
+_client_lock = threading.Lock()
 
 
 def _get_bedrock_client():
     global _bedrock_client
     if _bedrock_client is None:
-        import boto3
-        _bedrock_client = boto3.client("bedrock-runtime", region_name=settings.AWS_REGION)
-        logger.info("Initialized boto3 bedrock-runtime client")
+        with _client_lock:
+            if _bedrock_client is None:
+                import boto3
+                from botocore.config import Config
+                # リトライはアプリ側（_invoke_bedrock_embed）で行うため botocore 側は1回のみ
+                config = Config(
+                    retries={"total_max_attempts": 1, "mode": "standard"},
+                    max_pool_connections=settings.BEDROCK_MAX_POOL_CONNECTIONS,
+                    connect_timeout=settings.BEDROCK_CONNECT_TIMEOUT,
+                    read_timeout=settings.BEDROCK_READ_TIMEOUT,
+                    tcp_keepalive=True,
+                )
+                _bedrock_client = boto3.client("bedrock-runtime", region_name=settings.AWS_REGION, config=config)
+                logger.info(f"Initialized boto3 bedrock-runtime client (pool={settings.BEDROCK_MAX_POOL_CONNECTIONS})")
     return _bedrock_client
 
 
@@ -27,9 +63,12 @@ def get_embeddings_client():
     if _embeddings_client is None:
         if settings.USE_BEDROCK:
             from langchain_aws import BedrockEmbeddings
+            model_kwargs = {"output_dimension": settings.EMBED_DIMENSION} if settings.EMBED_DIMENSION else None
             _embeddings_client = BedrockEmbeddings(
+                client=_get_bedrock_client(),
                 model_id=settings.BEDROCK_EMBEDDINGS_MODEL_ID,
-                region_name=settings.AWS_REGION
+                region_name=settings.AWS_REGION,
+                model_kwargs=model_kwargs
             )
             logger.info(f"Initialized Bedrock embeddings with model: {settings.BEDROCK_EMBEDDINGS_MODEL_ID}")
         else:
@@ -41,6 +80,34 @@ def get_embeddings_client():
     return _embeddings_client
 
 
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """埋め込みディスクキャッシュを取得（無効時はNone）"""
+    global _embedding_cache
+    if _embedding_cache is None and settings.EMBED_CACHE_ENABLED:
+        _embedding_cache = EmbeddingCache(
+            settings.EMBED_CACHE_PATH,
+            max_bytes=settings.EMBED_CACHE_MAX_BYTES,
+            dtype=settings.EMBED_CACHE_DTYPE
+        )
+    return _embedding_cache
+
+
+def get_query_cache() -> Optional[LRUCache]:
+    """クエリ埋め込みのインメモリキャッシュを取得（無効時はNone）"""
+    global _query_cache
+    if _query_cache is None and settings.QUERY_CACHE_ENABLED:
+        _query_cache = LRUCache(
+            settings.QUERY_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.QUERY_CACHE_TTL_SECONDS
+        )
+    return _query_cache
+
+
+def _resolve_model_id(model: Optional[str] = None) -> str:
+    """キャッシュキー用のモデルIDを解決"""
+    return get_embedder(model).model_id
+
+
 def l2_normalize(embeddings: np.ndarray) -> np.ndarray:
     norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
     norms = np.where(norms == 0, 1, norms)
@@ -88,123 +155,531 @@ def _find_first_float_array(obj: Any) -> Optional[Any]:
     return None
 
 
+# ===== スキーマ既知の高速パーサ =====
+
+_BINARY_TYPES = ("ubinary", "binary")
+_KNOWN_TYPES = ("float", "int8", "uint8", "ubinary", "binary")
+
+
+def _as_matrix(obj: Any, dtype: Any) -> Optional[np.ndarray]:
+    """リストを一括で ndarray に変換（数値行列でなければNone）"""
+    try:
+        arr = np.asarray(obj, dtype=dtype)
+    except (TypeError, ValueError, OverflowError):
+        return None
+    if arr.ndim == 1:
+        arr = arr.reshape(1, -1)
+    if arr.ndim != 2 or arr.shape[1] == 0:
+        return None
+    return arr
+
+
+def _convert_embedding_type(arr: np.ndarray, source_type: str, embedding_type: str) -> np.ndarray:
+    """source_type の行列を要求された embedding_type に変換"""
+    if source_type == embedding_type:
+        return arr
+    if embedding_type == "float":
+        if source_type in _BINARY_TYPES:
+            # パック済みビット → ±1
+            bits = np.unpackbits(arr.astype(np.uint8, copy=False), axis=1)
+            return bits.astype(np.float32) * 2.0 - 1.0
+        return arr.astype(np.float32)
+    if embedding_type in _BINARY_TYPES and source_type not in _BINARY_TYPES:
+        return np.packbits(arr > 0, axis=1)
+    if embedding_type in _BINARY_TYPES:
+        return arr.astype(np.uint8, copy=False)
+    raise ValueError(f"Cannot convert {source_type} embeddings to {embedding_type}")
+
+
+def _parse_known_layout(payload: Any, embedding_type: str = "float") -> Optional[np.ndarray]:
+    """Cohere v3/v4 の既知レスポンス形式から直接行列を構築"""
+    if isinstance(payload, dict):
+        emb = payload.get("embeddings")
+        if emb is None and "embedding" in payload:
+            emb = payload["embedding"]
+        if isinstance(emb, dict):
+            # embeddings_by_type: {"float": [[...]], "int8": [[...]], "ubinary": [[...]]}
+            order = (embedding_type,) + tuple(t for t in _KNOWN_TYPES if t != embedding_type)
+            for source_type in order:
+                if source_type not in emb:
+                    continue
+                dtype = {"float": np.float32, "int8": np.int8, "binary": np.int8}.get(source_type, np.uint8)
+                arr = _as_matrix(emb[source_type], dtype)
+                if arr is not None:
+                    return _convert_embedding_type(arr, source_type, embedding_type)
+            return None
+        if isinstance(emb, list):
+            # embeddings_floats: {"embeddings": [[...], ...]}
+            arr = _as_matrix(emb, np.float32)
+            return _convert_embedding_type(arr, "float", embedding_type) if arr is not None else None
+        return None
+
+    if isinstance(payload, list) and payload and not isinstance(payload[0], (dict, str)):
+        # langchain_aws の戻り値: list[float] / list[list[float]]
+        arr = _as_matrix(payload, np.float32)
+        return _convert_embedding_type(arr, "float", embedding_type) if arr is not None else None
+    return None
+
+
+def _parse_embeddings(payload: Any, embedding_type: str = "float") -> Optional[np.ndarray]:
+    """レスポンスを2次元行列に変換。既知形式で解決できなければ再帰探索にフォールバック。"""
+    arr = _parse_known_layout(payload, embedding_type)
+    if arr is not None:
+        return arr
+
+    found = _find_first_float_array(payload)
+    if found is None:
+        return None
+    arr = _as_matrix(found, np.float32)
+    if arr is None:
+        return None
+    return _convert_embedding_type(arr, "float", embedding_type)
+
+
 # ===== boto3 直叩き =====
 
-def _bedrock_embed_documents_boto3(texts: List[str], input_type: str) -> List[List[float]]:
+def get_rate_limiter() -> RateLimiter:
+    """Bedrock呼び出しのレート制限（requests/sec, tokens/min）を取得"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(
+            requests_per_second=settings.BEDROCK_MAX_RPS,
+            tokens_per_minute=settings.BEDROCK_MAX_TOKENS_PER_MIN
+        )
+    return _rate_limiter
+
+
+def _count(name: str, amount: int = 1) -> None:
+    with _stats_lock:
+        _bedrock_stats[name] += amount
+
+
+def _invoke_bedrock_embed(texts: List[str], attempts_used: int = 0) -> Any:
+    """Bedrock invoke_model を実行してJSONペイロードを返す
+
+    スロットリング/5xx/接続エラーは指数バックオフ＋ジッタで BEDROCK_MAX_RETRIES 回まで再試行。
+    1回の埋め込みの試行回数（レート制限の消費も）はここが一元管理し、上位では再試行しない。
+    attempts_used は langchain_aws で一時的エラーになった試行数で、残りの回数だけ（バックオフ後に）送る。
+    """
+    attempts = settings.BEDROCK_MAX_RETRIES + 1
+    # 予算を使い切っていても boto3 では最低1回は送る
+    for attempt in range(min(attempts_used, attempts - 1), attempts):
+        if attempt > 0:
+            delay = backoff_delay(attempt - 1, settings.BEDROCK_RETRY_BASE_DELAY, settings.BEDROCK_RETRY_MAX_DELAY)
+            _count("retries")
+            logger.warning(f"Bedrock invoke_model retry {attempt}/{attempts - 1} in {delay:.2f}s")
+            time.sleep(delay)
+        get_rate_limiter().acquire(texts)
+        _count("calls")
+        try:
+            return _invoke_bedrock_embed_once(texts)
+        except Exception as e:
+            if not is_retryable_error(e):
+                _count("failures")
+                raise
+            if error_code(e) in THROTTLING_ERROR_CODES:
+                _count("throttles")
+            else:
+                _count("server_errors")
+            if attempt + 1 >= attempts:
+                _count("failures")
+                logger.error(f"Bedrock invoke_model failed after {attempts} attempts: {e}")
+                raise
+            logger.warning(f"Bedrock invoke_model attempt {attempt + 1}/{attempts} failed: {e}")
+
+
+def _invoke_bedrock_embed_once(texts: List[str]) -> Any:
     client = _get_bedrock_client()
     body = {
         "texts": texts,
         # Cohere v4 は texts キーを要求。input_type は仕様により省略可能だが残す場合は以下行を有効化。
         # "input_type": input_type,
     }
+    if settings.EMBED_DIMENSION:
+        body["output_dimension"] = settings.EMBED_DIMENSION
     resp = client.invoke_model(
         modelId=settings.BEDROCK_EMBEDDINGS_MODEL_ID,
-        body=json.dumps(body),
+        body=orjson.dumps(body),
         accept="application/json",
         contentType="application/json",
     )
-    payload = json.loads(resp["body"].read()) if hasattr(resp.get("body"), "read") else json.loads(resp["body"])  # type: ignore
-    arr = _find_first_float_array(payload)
+    raw_body = resp["body"].read() if hasattr(resp.get("body"), "read") else resp["body"]
+    return orjson.loads(raw_body)
+
+
+def _bedrock_embed_documents_boto3(texts: List[str], input_type: str, attempts_used: int = 0) -> np.ndarray:
+    payload = _invoke_bedrock_embed(texts, attempts_used)
+    arr = _parse_embeddings(payload)
     if arr is None:
         logger.error(f"boto3 bedrock response keys: {list(payload.keys()) if isinstance(payload, dict) else type(payload)}")
         raise ValueError("boto3: Failed to locate float embeddings in response")
-    return arr  # type: ignore
+    return arr
 
 
-def _bedrock_embed_query_boto3(query: str) -> List[float]:
-    client = _get_bedrock_client()
-    body = {
-        "texts": [query],
-        # "input_type": "search_query",
-    }
-    resp = client.invoke_model(
-        modelId=settings.BEDROCK_EMBEDDINGS_MODEL_ID,
-        body=json.dumps(body),
-        accept="application/json",
-        contentType="application/json",
-    )
-    payload = json.loads(resp["body"].read()) if hasattr(resp.get("body"), "read") else json.loads(resp["body"])  # type: ignore
-    arr = _find_first_float_array(payload)
+def _bedrock_embed_query_boto3(query: str, attempts_used: int = 0) -> np.ndarray:
+    payload = _invoke_bedrock_embed([query], attempts_used)
+    arr = _parse_embeddings(payload)
     if arr is None:
         logger.error(f"boto3 bedrock query response keys: {list(payload.keys()) if isinstance(payload, dict) else type(payload)}")
         raise ValueError("boto3: Failed to locate float embedding in response")
-    if isinstance(arr, list) and len(arr) > 0 and isinstance(arr[0], (int, float)):
-        return arr  # type: ignore
-    if isinstance(arr, list) and len(arr) > 0 and isinstance(arr[0], list):
-        return arr[0]  # type: ignore
-    return arr  # type: ignore
+    return arr[0]
 
 
-def embed_texts(texts: List[str], input_type: str = "search_document", model: str = None) -> np.ndarray:
-    """Bedrock/Cohereでテキストを埋め込み。Bedrockはlangchain_aws→失敗時boto3にフォールバック。"""
-    client = get_embeddings_client()
-    embeddings: List[np.ndarray] = []
+def get_backend_selector() -> BackendSelector:
+    """langchain_aws / boto3 の選択状態を取得"""
+    global _backend_selector
+    if _backend_selector is None:
+        _backend_selector = BackendSelector(
+            failure_threshold=settings.EMBED_BACKEND_FAILURE_THRESHOLD,
+            reprobe_seconds=settings.EMBED_BACKEND_REPROBE_SECONDS
+        )
+    return _backend_selector
 
-    for i in range(0, len(texts), settings.BATCH_SIZE):
-        batch = texts[i:i + settings.BATCH_SIZE]
-        try:
-            if settings.USE_BEDROCK:
-                raw = None
-                try:
-                    raw = client.embed_documents(batch)  # langchain_aws
-                except Exception as e:
-                    logger.warning(f"langchain_aws embed_documents failed, falling back to boto3: {e}")
-
-                arr = _find_first_float_array(raw) if raw is not None else None
-                # フォールバック条件: 数値配列に解決できない/型がstr/['float']など
-                if arr is None or (isinstance(raw, list) and raw == ["float"]) or isinstance(raw, str):
-                    logger.warning("Falling back to boto3 bedrock-runtime for embeddings")
-                    arr = _bedrock_embed_documents_boto3(batch, input_type)
-
-                batch_embeddings = np.array(arr, dtype=np.float32)
-                if batch_embeddings.ndim == 1:
-                    batch_embeddings = batch_embeddings.reshape(1, -1)
-            else:
-                if model is None:
-                    model = settings.COHERE_MODEL
-                response = client.embed(texts=batch, model=model, input_type=input_type)
-                batch_embeddings = np.array(response.embeddings, dtype=np.float32)
 
-            embeddings.append(batch_embeddings)
-            logger.info(f"Embedded batch {i//settings.BATCH_SIZE + 1}")
+def _try_langchain(fn: Callable[[Any], Any], arg: Any) -> Tuple[Optional[Any], int]:
+    """
+    回路が閉じていれば langchain_aws を呼び、使える数値配列なら返す（使えなければNone）
 
-        except Exception as e:
-            logger.error(f"Failed to embed batch {i//settings.BATCH_SIZE + 1}: {e}")
-            logger.error(f"Batch sample: {batch[:2] if batch else 'empty'}")
-            raise
+    Returns:
+        (配列 or None, 再試行予算を消費した試行数)。一時的エラーで終わった試行は boto3 側の
+        BEDROCK_MAX_RETRIES の1回として数える
+    """
+    selector = get_backend_selector()
+    if not selector.use_primary():
+        return None, 0
 
-    return l2_normalize(np.vstack(embeddings))
+    try:
+        get_rate_limiter().acquire([arg] if isinstance(arg, str) else arg)
+        raw = fn(arg)
+    except Exception as e:
+        if is_retryable_error(e):
+            # スロットリング等はバックエンド不良ではないので回路は開かず、今回だけboto3（リトライ付き）へ
+            # half-open の再試行中なら判定を保留して次の呼び出しで再試行する
+            _count("throttles" if error_code(e) in THROTTLING_ERROR_CODES else "server_errors")
+            selector.release_probe()
+            return None, 1
+        selector.record_primary_failure(f"{type(e).__name__}: {e}")
+        return None, 0
 
+    arr = _parse_embeddings(raw) if raw is not None else None
+    # フォールバック条件: 数値配列に解決できない/型がstr/['float']など
+    if arr is None or (isinstance(raw, list) and raw == ["float"]) or isinstance(raw, str):
+        selector.record_primary_failure(f"unusable response: {str(raw)[:50]}")
+        return None, 0
 
-def embed_query(query: str, model: str = None) -> np.ndarray:
-    client = get_embeddings_client()
+    selector.record_primary_success()
+    return arr, 0
 
-    try:
+
+class RemoteEmbedder:
+    """Bedrock（langchain_aws→boto3）/ Cohere直API による Embedder 実装"""
+
+    def __init__(self, model: Optional[str] = None):
+        self.model = model
+
+    @property
+    def model_id(self) -> str:
         if settings.USE_BEDROCK:
-            raw = None
-            try:
-                raw = client.embed_query(query)
-            except Exception as e:
-                logger.warning(f"langchain_aws embed_query failed, falling back to boto3: {e}")
-
-            arr = _find_first_float_array(raw) if raw is not None else None
-            if arr is None or isinstance(raw, str):
-                logger.warning("Falling back to boto3 bedrock-runtime for query embedding")
-                arr = _bedrock_embed_query_boto3(query)
-
-            emb = np.array(arr, dtype=np.float32)
-            if emb.ndim == 1:
-                emb = emb.reshape(1, -1)
+            return settings.BEDROCK_EMBEDDINGS_MODEL_ID
+        return self.model or settings.COHERE_MODEL
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return settings.EMBED_DIMENSION
+
+    def embed_documents(self, texts: List[str], input_type: str = "search_document") -> np.ndarray:
+        client = get_embeddings_client()
+        if settings.USE_BEDROCK:
+            arr, attempts_used = _try_langchain(client.embed_documents, texts)
+            if arr is None:
+                get_backend_selector().record_fallback()
+                arr = _bedrock_embed_documents_boto3(texts, input_type, attempts_used=attempts_used)
+
+            embeddings = np.asarray(arr, dtype=np.float32)
+            if embeddings.ndim == 1:
+                embeddings = embeddings.reshape(1, -1)
+            return embeddings
+
+        response = client.embed(texts=texts, model=self.model or settings.COHERE_MODEL, input_type=input_type)
+        return np.array(response.embeddings, dtype=np.float32)
+
+    def embed_query(self, query: str) -> np.ndarray:
+        client = get_embeddings_client()
+        if settings.USE_BEDROCK:
+            arr, attempts_used = _try_langchain(client.embed_query, query)
+            if arr is None:
+                get_backend_selector().record_fallback()
+                arr = _bedrock_embed_query_boto3(query, attempts_used=attempts_used)
+            return np.asarray(arr, dtype=np.float32).reshape(-1)
+
+        response = client.embed(texts=[query], model=self.model or settings.COHERE_MODEL, input_type="search_query")
+        return np.array(response.embeddings[0], dtype=np.float32)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        if settings.USE_BEDROCK:
+            # Bedrock Cohere の texts リストで一括送信
+            embeddings = np.asarray(_bedrock_embed_documents_boto3(queries, "search_query"), dtype=np.float32)
+            if embeddings.ndim == 1:
+                embeddings = embeddings.reshape(1, -1)
+            return embeddings
+        return self.embed_documents(queries, input_type="search_query")
+
+
+def get_embedder(model: Optional[str] = None) -> Embedder:
+    """設定（EMBEDDER_BACKEND）に応じた Embedder を取得"""
+    global _embedder
+    if model is not None and settings.EMBEDDER_BACKEND == "cohere" and model != settings.COHERE_MODEL:
+        return RemoteEmbedder(model)
+    if _embedder is None:
+        if settings.EMBEDDER_BACKEND == "local":
+            _embedder = LocalHashEmbedder(
+                dimension=settings.LOCAL_EMBED_DIMENSION,
+                latency_ms=settings.LOCAL_EMBED_LATENCY_MS
+            )
+            logger.info(f"Using local hash embedder (dimension={settings.LOCAL_EMBED_DIMENSION})")
         else:
-            if model is None:
-                model = settings.COHERE_MODEL
-            response = client.embed(texts=[query], model=model, input_type="search_query")
-            emb = np.array(response.embeddings[0], dtype=np.float32).reshape(1, -1)
+            _embedder = RemoteEmbedder()
+    return _embedder
 
-        return l2_normalize(emb)[0]
+
+def _embed_batch(embedder: Embedder, batch: List[str], input_type: str) -> np.ndarray:
+    """1バッチ分を埋め込み（正規化前）"""
+    batch_embeddings = embedder.embed_documents(batch, input_type)
+    if batch_embeddings.shape[0] != len(batch):
+        raise ValueError(f"Expected {len(batch)} embeddings, got {batch_embeddings.shape[0]}")
+    return batch_embeddings
+
+
+def _batch_retries(embedder: Embedder) -> int:
+    """
+    バッチ単位の再試行回数
+
+    Bedrock は _invoke_bedrock_embed が再試行（BEDROCK_MAX_RETRIES）を持つため、ここで重ねると
+    試行回数が掛け算になる。バッチ単位では再試行せず、再試行を持たないバックエンドのみ EMBED_BATCH_RETRIES 回。
+    """
+    if isinstance(embedder, RemoteEmbedder) and settings.USE_BEDROCK:
+        return 0
+    return settings.EMBED_BATCH_RETRIES
+
+
+def _embed_batch_with_retry(embedder: Embedder, batch_no: int, batch: List[str], input_type: str) -> np.ndarray:
+    """バッチ単位でリトライしながら埋め込み（一時的エラーのみ、このバッチだけ再送）"""
+    attempts = _batch_retries(embedder) + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            batch_embeddings = _embed_batch(embedder, batch, input_type)
+            logger.info(f"Embedded batch {batch_no}")
+            return batch_embeddings
+        except Exception as e:
+            # ValidationException 等は同じ入力を再送しても失敗するので即座に送出
+            if attempt >= attempts or not is_retryable_error(e):
+                logger.error(f"Failed to embed batch {batch_no}: {e}")
+                logger.error(f"Batch sample: {batch[:2] if batch else 'empty'}")
+                raise
+            delay = settings.EMBED_RETRY_BASE_DELAY * (2 ** (attempt - 1))
+            logger.warning(f"Batch {batch_no} failed (attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+            time.sleep(delay)
+
+
+def _embed_batches(texts: List[str], input_type: str, model: Optional[str]) -> np.ndarray:
+    """BATCH_SIZEごとにリモート埋め込みを実行（正規化前の行列を入力順で返す）
+
+    EMBED_CONCURRENCY > 1 の場合はスレッドプールで複数バッチを同時に投げる。
+    """
+    embedder = get_embedder(model)
+    batches = [texts[i:i + settings.BATCH_SIZE] for i in range(0, len(texts), settings.BATCH_SIZE)]
+    concurrency = max(1, min(settings.EMBED_CONCURRENCY, len(batches)))
+
+    if concurrency == 1:
+        embeddings = [
+            _embed_batch_with_retry(embedder, n + 1, batch, input_type)
+            for n, batch in enumerate(batches)
+        ]
+        return np.vstack(embeddings)
+
+    logger.info(f"Embedding {len(batches)} batches with concurrency={concurrency}")
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="embed") as executor:
+        futures = [
+            executor.submit(_embed_batch_with_retry, embedder, n + 1, batch, input_type)
+            for n, batch in enumerate(batches)
+        ]
+        try:
+            # futures は投入順なので結果も入力順に並ぶ
+            embeddings = [f.result() for f in futures]
+        except Exception:
+            for f in futures:
+                f.cancel()
+            raise
+
+    return np.vstack(embeddings)
+
+
+@timed("embed_texts")
+def embed_texts(texts: List[str], input_type: str = "search_document", model: str = None) -> np.ndarray:
+    """Bedrock/Cohereでテキストを埋め込み。Bedrockはlangchain_aws→失敗時boto3にフォールバック。
+
+    ディスクキャッシュが有効な場合はキャッシュミス分のみリモートに送る。
+    """
+    cache = get_embedding_cache()
+    if cache is None or not texts:
+        return l2_normalize(_embed_batches(texts, input_type, model))
+
+    model_id = _resolve_model_id(model)
+    keys = [EmbeddingCache.make_key(t, model_id, input_type, settings.EMBED_DIMENSION) for t in texts]
+    found = cache.get_many(keys)
+
+    # 同一テキストの重複はまとめて1回だけ埋め込む
+    miss_positions = {}
+    for i, key in enumerate(keys):
+        if key not in found and key not in miss_positions:
+            miss_positions[key] = i
+
+    if miss_positions:
+        miss_texts = [texts[i] for i in miss_positions.values()]
+        miss_embeddings = _embed_batches(miss_texts, input_type, model)
+        new_items = dict(zip(miss_positions.keys(), miss_embeddings))
+        cache.put_many(new_items)
+        found.update(new_items)
+
+    logger.info(f"Embedding cache: {len(texts) - len(miss_positions)} hits, {len(miss_positions)} remote")
+    return l2_normalize(np.vstack([found[k] for k in keys]).astype(np.float32))
+
+
+def embedding_stats() -> Dict[str, Any]:
+    """
+    埋め込みレイヤの統計（ヘルスチェック用）
+
+    キャッシュは作成済みのものだけを見る（/health からディスクキャッシュを開いたりファイルを作ったりしない）。
+    """
+    cache = _embedding_cache
+    query_cache = _query_cache
+    return {
+        "embedder": settings.EMBEDDER_BACKEND,
+        "model_id": _resolve_model_id(),
+        "backend": get_backend_selector().status() if settings.EMBEDDER_BACKEND == "bedrock" else settings.EMBEDDER_BACKEND,
+        "bedrock": {**_bedrock_stats, **get_rate_limiter().stats()} if settings.EMBEDDER_BACKEND == "bedrock" else None,
+        "disk_cache": cache.stats() if cache is not None else None,
+        "query_cache": query_cache.stats() if query_cache is not None else None,
+        "query_batching": _query_batcher.stats() if _query_batcher is not None else None,
+    }
+
+
+@timed("embed_query")
+def embed_query(query: str, model: str = None) -> np.ndarray:
+    """クエリを埋め込み。正規化後のテキスト＋モデルIDでインメモリキャッシュを引く。"""
+    normalized = normalize_query_text(query)
+    cache = get_query_cache()
+    if cache is None:
+        return _embed_query_remote(normalized, model)
+
+    key = _query_cache_key(normalized, model)
+    emb = cache.get(key)
+    if emb is None:
+        emb = _embed_query_remote(normalized, model)
+        emb.setflags(write=False)
+        cache.put(key, emb)
+    return emb
+
+
+async def embed_query_async(query: str, model: str = None) -> np.ndarray:
+    """embed_query の非同期版。リモート呼び出しは専用の上限付きスレッドプールで実行し、イベントループを塞がない。"""
+    normalized = normalize_query_text(query)
+    cache = get_query_cache()
+    key = _query_cache_key(normalized, model)
+    if cache is not None:
+        emb = cache.get(key)
+        if emb is not None:
+            return emb
+
+    batcher = get_query_batcher() if model is None else None
+    if batcher is not None:
+        emb = await batcher.submit(normalized)
+    else:
+        emb = await run_in_executor(get_query_executor(), _embed_query_remote, normalized, model)
+    if cache is not None:
+        emb.setflags(write=False)
+        cache.put(key, emb)
+    return emb
+
+
+def get_query_executor() -> ThreadPoolExecutor:
+    """クエリ埋め込み専用のスレッドプールを取得（同時リモート呼び出し数の上限）"""
+    global _query_executor
+    if _query_executor is None:
+        with _client_lock:
+            if _query_executor is None:
+                _query_executor = ThreadPoolExecutor(
+                    max_workers=settings.EMBED_QUERY_WORKERS,
+                    thread_name_prefix="embed-query"
+                )
+    return _query_executor
+
+
+def get_query_batcher() -> Optional[QueryBatcher]:
+    """クエリのマイクロバッチャを取得（QUERY_BATCH_WINDOW_MS=0 なら無効）"""
+    global _query_batcher
+    if _query_batcher is None and settings.QUERY_BATCH_WINDOW_MS > 0:
+        _query_batcher = QueryBatcher(
+            _embed_queries_remote,
+            window_ms=settings.QUERY_BATCH_WINDOW_MS,
+            max_batch_size=settings.QUERY_BATCH_MAX_SIZE,
+            executor=get_query_executor()
+        )
+    return _query_batcher
+
+
+@timed("embed_queries")
+def embed_queries(queries: List[str], model: str = None) -> np.ndarray:
+    """複数クエリをまとめて埋め込み（キャッシュミス分のみ1回のリモート呼び出しで取得）"""
+    normalized = [normalize_query_text(q) for q in queries]
+    cache = get_query_cache()
+    keys = [_query_cache_key(n, model) for n in normalized]
+    found: Dict[tuple, np.ndarray] = {}
+    if cache is not None:
+        for key in keys:
+            emb = cache.get(key)
+            if emb is not None:
+                found[key] = emb
+
+    misses = list(dict.fromkeys(n for n, key in zip(normalized, keys) if key not in found))
+    for i in range(0, len(misses), settings.BATCH_SIZE):
+        chunk = misses[i:i + settings.BATCH_SIZE]
+        matrix = _embed_queries_remote(chunk, model)
+        for text, emb in zip(chunk, matrix):
+            key = _query_cache_key(text, model)
+            found[key] = emb
+            if cache is not None:
+                emb.setflags(write=False)
+                cache.put(key, emb)
+
+    return np.vstack([found[k] for k in keys])
+
+
+async def embed_queries_async(queries: List[str], model: str = None) -> np.ndarray:
+    """embed_queries の非同期版（クエリ埋め込み用スレッドプールで実行）"""
+    return await run_in_executor(get_query_executor(), embed_queries, queries, model)
+
+
+@timed("embed_remote")
+def _embed_queries_remote(queries: List[str], model: str = None) -> np.ndarray:
+    """クエリ群を1回の呼び出しで埋め込み（L2正規化済み行列）"""
+    emb = get_embedder(model).embed_queries(queries)
+    if emb.shape[0] != len(queries):
+        raise ValueError(f"Expected {len(queries)} query embeddings, got {emb.shape[0]}")
+    return l2_normalize(emb)
+
+
+def _query_cache_key(normalized: str, model: Optional[str]) -> tuple:
+    return (_resolve_model_id(model), settings.EMBED_DIMENSION, normalized)
+
+
+@timed("embed_remote")
+def _embed_query_remote(query: str, model: str = None) -> np.ndarray:
+    try:
+        emb = get_embedder(model).embed_query(query)
+        return l2_normalize(emb.reshape(1, -1))[0]
 
     except Exception as e:
         logger.error(f"Failed to embed query: {e}")
         logger.error(f"Query: {query}")
         raise
-
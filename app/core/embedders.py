@@ -0,0 +1,98 @@
+"""
+埋め込みバックエンドのインターフェースとオフライン用ローカル実装
+"""
+import time
+import hashlib
+import logging
+import numpy as np
+from functools import lru_cache
+from typing import List, Optional, Protocol, Tuple, runtime_checkable
+from app.utils.text import normalize_query_text
+
+logger = logging.getLogger(__name__)
+
+
+@runtime_checkable
+class Embedder(Protocol):
+    """埋め込みバックエンドのプロトコル
+
+    返すベクトルは正規化前の生の値（L2正規化は embed_cohere 側で一括して行う）。
+    """
+
+    @property
+    def model_id(self) -> str: ...
+
+    @property
+    def dimension(self) -> Optional[int]: ...
+
+    def embed_documents(self, texts: List[str], input_type: str = "search_document") -> np.ndarray:
+        """文書群を埋め込み、(len(texts), dim) の float32 行列を返す"""
+        ...
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """クエリ1件を埋め込み、(dim,) の float32 ベクトルを返す"""
+        ...
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        """クエリ群を1回の呼び出しで埋め込み、(len(queries), dim) の行列を返す"""
+        ...
+
+
+@lru_cache(maxsize=200_000)
+def _hash_gram(gram: str) -> int:
+    # Pythonの hash() はプロセスごとに変わるため blake2b で決定的にする
+    return int.from_bytes(hashlib.blake2b(gram.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LocalHashEmbedder:
+    """文字n-gramの特徴ハッシングによる決定的なローカル埋め込み（ネットワーク不要）
+
+    負荷試験・ベンチマーク・CI用。同じテキストは常に同じベクトルになり、
+    文字n-gramを共有するテキスト同士は内積が大きくなる。
+    """
+
+    def __init__(self, dimension: int = 1024, latency_ms: float = 0.0, ngram_range: Tuple[int, int] = (1, 3)):
+        self._dimension = dimension
+        self.latency_ms = latency_ms
+        self.ngram_range = ngram_range
+
+    @property
+    def model_id(self) -> str:
+        return f"local-hash-{self._dimension}"
+
+    @property
+    def dimension(self) -> Optional[int]:
+        return self._dimension
+
+    def _simulate_latency(self) -> None:
+        if self.latency_ms > 0:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def _embed_one(self, text: str) -> np.ndarray:
+        normalized = normalize_query_text(text).lower()
+        hashes = [
+            _hash_gram(normalized[i:i + n])
+            for n in range(self.ngram_range[0], self.ngram_range[1] + 1)
+            for i in range(len(normalized) - n + 1)
+        ]
+        vec = np.zeros(self._dimension, dtype=np.float32)
+        if not hashes:
+            return vec
+        h = np.array(hashes, dtype=np.uint64)
+        indices = (h % np.uint64(self._dimension)).astype(np.int64)
+        signs = np.where((h >> np.uint64(63)) & np.uint64(1), -1.0, 1.0).astype(np.float32)
+        np.add.at(vec, indices, signs)
+        return vec
+
+    def embed_documents(self, texts: List[str], input_type: str = "search_document") -> np.ndarray:
+        self._simulate_latency()
+        if not texts:
+            return np.zeros((0, self._dimension), dtype=np.float32)
+        return np.vstack([self._embed_one(t) for t in texts])
+
+    def embed_query(self, query: str) -> np.ndarray:
+        self._simulate_latency()
+        return self._embed_one(query)
+
+    def embed_queries(self, queries: List[str]) -> np.ndarray:
+        return self.embed_documents(queries, input_type="search_query")
@@ -3,42 +3,567 @@ FAISSベクトルストア管理
 """
 import os
 import json
+import mmap
+import hashlib
 import logging
+import tempfile
+import threading
 import numpy as np
 import faiss
-from typing import List, Dict, Any, Tuple, Optional
+from collections.abc import Sequence as SequenceABC
+from typing import List, Dict, Any, Tuple, Optional, Sequence, Union
 from pathlib import Path
 import orjson
+from app.config import settings
+from app.core.meta_store import MetaStore, Condition, filter_conditions
+from app.core.lexical import BM25Index
+from app.utils.telemetry import timed
 
 logger = logging.getLogger(__name__)
 
+INFO_FILENAME = "index_info.json"
+# meta.json の各レコードの開始バイト位置（末尾はファイルサイズ）
+META_OFFSETS_FILENAME = "meta.offsets.npy"
+# 内部位置ごとの安定ID（vendor_id 由来の63ビット整数、-1 は削除済み）
+IDS_FILENAME = "ids.npy"
+# binary インデックスの再スコア用 float32 ベクトル（読み込み時はメモリマップ）
+RESCORE_VECTORS_FILENAME = "vectors.npy"
+# フィルタ用の列指向メタデータ（meta_store.MetaStore）
+META_COLUMNS_FILENAME = "meta_columns.npz"
+# 語彙一致検索用の BM25 転置索引（lexical.BM25Index）
+LEXICAL_FILENAME = "lexical.npz"
+# index.faiss / meta.json と一緒に保存・配布する付随ファイル
+COMPANION_FILENAMES = [
+    INFO_FILENAME, META_OFFSETS_FILENAME, IDS_FILENAME, META_COLUMNS_FILENAME, LEXICAL_FILENAME, RESCORE_VECTORS_FILENAME
+]
+
+# remove_ids で位置順を保ったまま詰められる種別（それ以外は再構成して作り直す）
+FLAT_CODE_TYPES = ("flat", "sq8", "fp16", "binary")
+
+# バイナリインデックスで一次検索（Hamming）する候補数の倍率（k * factor 件を float で再スコア）
+DEFAULT_RESCORE_FACTOR = 10
+# 再スコア用ベクトルをファイルへ書き出す際に一度にコピーする行数（ヒープに載るのはこの分だけ）
+SPILL_CHUNK_ROWS = 65536
+
+
+def quantize_ubinary(embeddings: np.ndarray) -> np.ndarray:
+    """float埋め込みを符号ビットでパック（Cohere の ubinary と同じ表現, 次元/8 バイト）"""
+    return np.packbits(np.asarray(embeddings) > 0, axis=1)
+
+
+def spill_vectors(directory: str, parts: Sequence[Tuple[np.ndarray, Optional[np.ndarray]]]) -> np.ndarray:
+    """
+    float32 行列をファイルに書き出し、読み取り専用のメモリマップとして返す
+
+    parts は (元の行列, 取り出す行 or None) の並びで、順に連結する。元がメモリマップでも
+    SPILL_CHUNK_ROWS 行ずつコピーするため行列全体がヒープに載ることはない。
+    書き出したファイルはマップ後に削除する（マッピングが残る間は中身が保持され、ページキャッシュとして回収できる）。
+    """
+    n = sum(len(rows) if rows is not None else len(source) for source, rows in parts)
+    dimension = parts[0][0].shape[1]
+    if n == 0:
+        return np.empty((0, dimension), dtype=np.float32)
+    
+    os.makedirs(directory, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix=".vectors-", suffix=".npy", dir=directory)
+    os.close(fd)
+    try:
+        out = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n, dimension))
+        position = 0
+        for source, rows in parts:
+            total = len(rows) if rows is not None else len(source)
+            for start in range(0, total, SPILL_CHUNK_ROWS):
+                stop = min(start + SPILL_CHUNK_ROWS, total)
+                chunk = source[rows[start:stop]] if rows is not None else source[start:stop]
+                out[position:position + len(chunk)] = chunk
+                position += len(chunk)
+        out.flush()
+        del out
+        return np.load(path, mmap_mode='r')
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def vendor_label(vendor_id: str) -> int:
+    """vendor_id から安定した63ビットの非負整数IDを生成"""
+    digest = hashlib.blake2b(str(vendor_id).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") & 0x7FFF_FFFF_FFFF_FFFF
+
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16", "binary")
+
+
+def _factory_string(index_type: str, n: int, dimension: int) -> Tuple[str, Dict[str, Any]]:
+    """index_type から faiss.index_factory の記述子と既定の検索パラメータを決定"""
+    if index_type == "flat":
+        return "Flat", {}
+    if index_type == "sq8":
+        return "SQ8", {}
+    if index_type == "fp16":
+        return "SQfp16", {}
+    if index_type == "hnsw":
+        return f"HNSW{settings.HNSW_M},Flat", {"efSearch": settings.HNSW_EF_SEARCH}
+    
+    # IVF系: nlist 未指定時は 4√n（ただし1リストあたり最低39件の学習点を確保）
+    nlist = settings.IVF_NLIST or int(min(4 * np.sqrt(n), n // 39))
+    if nlist < 1:
+        raise ValueError(f"Too few vectors ({n}) to train an IVF index")
+    search_params = {"nprobe": min(settings.IVF_NPROBE, nlist)}
+    if index_type == "ivf_flat":
+        return f"IVF{nlist},Flat", search_params
+    
+    # PQ: サブベクトル数は次元を割り切る値（既定は1サブベクトル16次元）
+    m = settings.PQ_M or max(1, dimension // 16)
+    if dimension % m != 0:
+        raise ValueError(f"PQ_M ({m}) must divide dimension ({dimension})")
+    if n < 256:
+        raise ValueError(f"Too few vectors ({n}) to train PQ codebooks (need >= 256)")
+    return f"IVF{nlist},PQ{m}x8", search_params
+
+
+def _write_metadata(meta_path: str, offsets_path: str, metadata: Sequence[Dict[str, Any]]) -> None:
+    """1行1レコードのJSON配列として meta.json を書き、各レコードの開始位置を offsets に保存
+
+    ファイル自体は従来どおり JSON 配列として読めるため、既存の読み手とも互換。
+    レコード i は [offsets[i], offsets[i+1] - 2) のバイト範囲（区切りの ",\n" / 末尾の "\n]" を除く）。
+    """
+    records = [orjson.dumps(record) for record in metadata]
+    offsets = np.empty(len(records) + 1, dtype=np.int64)
+    position = 2
+    with open(meta_path, 'wb') as f:
+        f.write(b"[\n")
+        for i, record in enumerate(records):
+            offsets[i] = position
+            f.write(record)
+            f.write(b",\n" if i < len(records) - 1 else b"\n")
+            position += len(record) + 2
+        f.write(b"]")
+    offsets[len(records)] = position + (1 if not records else 0)
+    np.save(offsets_path, offsets)
+
+
+def _sorted_hits(
+    scores: np.ndarray,
+    indices: np.ndarray,
+    valid: Optional[np.ndarray],
+    cap: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """有効な結果をスコア降順に並べ、上位 cap 件に絞る"""
+    if valid is not None:
+        scores, indices = scores[valid], indices[valid]
+    order = np.argsort(-scores, kind="stable")[:cap]
+    return scores[order].astype('float32'), indices[order].astype('int64')
+
+
+class MappedMetadata(SequenceABC):
+    """メモリマップした meta.json から、アクセスされたレコードだけをデコードする読み取り専用シーケンス
+
+    ファイル全体をパースしないため起動が速く、ページはOSのページキャッシュとして複数プロセスで共有される。
+    """
+    
+    def __init__(self, meta_path: str, offsets_path: str):
+        self._offsets = np.load(offsets_path, mmap_mode='r')
+        with open(meta_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # 別の書き手で meta.json だけ差し替えられた場合は位置情報が使えない
+        if len(self._offsets) == 0 or int(self._offsets[-1]) != len(self._mmap) or self._mmap[:2] != b"[\n":
+            raise ValueError(f"Metadata offsets do not match {meta_path}")
+    
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("metadata index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1]) - 2
+        return orjson.loads(self._mmap[start:end])
+
 
 class FAISSStore:
     """FAISSベクトルストア管理クラス"""
     
     def __init__(self, index_path: str, meta_path: str):
+        self.set_paths(index_path, meta_path)
+        self.index = None
+        self.metadata: Sequence[Dict[str, Any]] = []
+        self.info: Dict[str, Any] = {}
+        # メモリマップで読み込んだインデックスは読み取り専用（add 等の更新不可）
+        self.mmapped = False
+        # 内部位置 → vendor_id 由来のID（-1 は削除済み）と、その逆引き（初回更新時に構築）
+        self.ids: Optional[np.ndarray] = None
+        self._positions: Optional[Dict[int, int]] = None
+        self._selector: Optional[Tuple[Any, Any]] = None
+        # フィルタ用の列指向メタデータ（metadata と同じ位置順）
+        self.columns: Optional[MetaStore] = None
+        # 語彙一致検索用の転置索引（metadata と同じ位置順。未構築なら None）
+        self.lexical: Optional[BM25Index] = None
+        # binary インデックスの再スコア用 float ベクトル（位置順。旧形式・binary 以外は None）
+        self.rescore_vectors: Optional[np.ndarray] = None
+        self.filter_plans = {"exhaustive": 0, "selector": 0, "empty": 0}
+        self.version = 0
+        self._compacting = False
+        # 検索・更新・コンパクションの入れ替えを直列化（検索→メタデータ取得をまとめて囲む場合も使う）
+        self.lock = threading.RLock()
+    
+    def set_paths(self, index_path: str, meta_path: str) -> None:
+        """保存・読み込み先を設定（付随ファイルは同じディレクトリ）"""
         self.index_path = index_path
         self.meta_path = meta_path
-        self.index = None
-        self.metadata = []
+        self.info_path = os.path.join(os.path.dirname(index_path), INFO_FILENAME)
+        self.offsets_path = os.path.join(os.path.dirname(meta_path), META_OFFSETS_FILENAME)
+        self.ids_path = os.path.join(os.path.dirname(index_path), IDS_FILENAME)
+        self.vectors_path = os.path.join(os.path.dirname(index_path), RESCORE_VECTORS_FILENAME)
+        self.columns_path = os.path.join(os.path.dirname(meta_path), META_COLUMNS_FILENAME)
+        self.lexical_path = os.path.join(os.path.dirname(meta_path), LEXICAL_FILENAME)
+    
+    @property
+    def index_type(self) -> str:
+        """構築済みインデックスの種類（旧形式は flat）"""
+        return self.info.get("index_type", "flat")
     
-    def build_index(self, embeddings: np.ndarray) -> None:
-        """FAISSインデックスを構築"""
-        dimension = embeddings.shape[1]
+    def build_index(self, embeddings: np.ndarray, index_type: Optional[str] = None) -> None:
+        """
+        FAISSインデックスを構築
+        
+        Args:
+            embeddings: L2正規化済み埋め込み行列
+            index_type: INDEX_TYPES のいずれか。未指定時は FAISS_INDEX_TYPE
+        """
+        index_type = index_type or settings.FAISS_INDEX_TYPE
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unknown index type: {index_type} (choose from {', '.join(INDEX_TYPES)})")
+        n, dimension = embeddings.shape
+        rescore_vectors = None
+        
+        if index_type == "binary":
+            if dimension % 8 != 0:
+                raise ValueError(f"Binary index requires dimension divisible by 8, got {dimension}")
+            # Hamming 一次検索用のバイナリインデックス（float の 1/32 のメモリ）
+            self.index = faiss.IndexBinaryFlat(dimension)
+            self.index.add(quantize_ubinary(embeddings))
+            # 候補の再スコアは元の float ベクトルで行う（ファイルに書き出してメモリマップし、候補の行だけ参照）
+            rescore_vectors = spill_vectors(os.path.dirname(self.index_path), [(embeddings, None)])
+            search_params = {"rescore_factor": settings.BINARY_RESCORE_FACTOR}
+            factory = "BFlat"
+        else:
+            embeddings = np.ascontiguousarray(embeddings, dtype='float32')
+            factory, search_params = _factory_string(index_type, n, dimension)
+            self.index = faiss.index_factory(dimension, factory, faiss.METRIC_INNER_PRODUCT)
+            if index_type == "hnsw":
+                faiss.downcast_index(self.index).hnsw.efConstruction = settings.HNSW_EF_CONSTRUCTION
+            
+            # 学習が必要な種別（IVF/PQ/SQ）はサンプルで学習
+            if not self.index.is_trained:
+                self._train(embeddings)
+            
+            # ベクトルを追加
+            self.index.add(embeddings)
         
-        # IndexFlatIP（内積）を使用
-        self.index = faiss.IndexFlatIP(dimension)
+        self.mmapped = False
+        self.ids = None
+        self.columns = None
+        self.lexical = None
+        self.rescore_vectors = rescore_vectors
+        self._positions = None
+        self._invalidate_caches()
+        self.info = {
+            "index_type": index_type,
+            "factory": factory,
+            "dimension": dimension,
+            "ntotal": int(self.index.ntotal),
+            "search_params": search_params,
+        }
+        logger.info(f"Built FAISS {index_type} index ({factory}) with {self.index.ntotal} vectors, dimension {dimension}")
+    
+    def _train(self, embeddings: np.ndarray) -> None:
+        """最大 FAISS_TRAIN_SAMPLE 件のランダムサンプルで学習"""
+        n = embeddings.shape[0]
+        sample_size = min(n, settings.FAISS_TRAIN_SAMPLE)
+        if sample_size < n:
+            rng = np.random.default_rng(0)
+            sample = embeddings[np.sort(rng.choice(n, sample_size, replace=False))]
+        else:
+            sample = embeddings
+        logger.info(f"Training index on {sample_size} vectors")
+        self.index.train(sample)
+    
+    def _search_parameters(self, overrides: Optional[Dict[str, Any]] = None, selector: Optional[Any] = None) -> Optional[Any]:
+        """
+        保存済み検索パラメータ（nprobe / efSearch）にリクエスト指定値を上書きして SearchParameters を作成
+        
+        selector 未指定時は削除済み位置を除外するセレクタを使う（指定する場合は削除済みを除いておくこと）。
+        """
+        params = dict(self.info.get("search_params", {}))
+        for key, value in (overrides or {}).items():
+            if value is not None:
+                params[key] = value
         
-        # ベクトルを追加
-        self.index.add(embeddings.astype('float32'))
+        # 削除済み（トゥームストーン）の位置は検索対象から除外
+        if selector is None:
+            selector = self._tombstone_selector()
+        selector_kwargs = {"sel": selector} if selector is not None else {}
         
-        logger.info(f"Built FAISS index with {self.index.ntotal} vectors, dimension {dimension}")
+        if self.index_type in ("ivf_flat", "ivf_pq") and "nprobe" in params:
+            return faiss.SearchParametersIVF(nprobe=int(params["nprobe"]), **selector_kwargs)
+        if self.index_type == "hnsw" and "efSearch" in params:
+            return faiss.SearchParametersHNSW(efSearch=int(params["efSearch"]), **selector_kwargs)
+        if selector_kwargs:
+            return faiss.SearchParameters(**selector_kwargs)
+        return None
+    
+    def _tombstone_selector(self) -> Optional[Any]:
+        """削除済み位置を除外する IDSelector（削除がなければ None）"""
+        if self._selector is None:
+            deleted = np.flatnonzero(self.ids < 0).astype(np.int64) if self.ids is not None else np.array([], dtype=np.int64)
+            if len(deleted) > 0:
+                # IDSelectorNot は内側のセレクタを参照で持つため両方保持する
+                batch = faiss.IDSelectorBatch(deleted)
+                self._selector = (faiss.IDSelectorNot(batch), batch)
+            else:
+                self._selector = (None, None)
+        return self._selector[0]
+    
+    def _invalidate_caches(self) -> None:
+        """位置に依存するキャッシュ（削除済みセレクタ）を破棄"""
+        self._selector = None
+    
+    def _ensure_columns(self) -> MetaStore:
+        """列指向メタデータを用意（保存済みの列が無い旧形式はメタデータから構築）"""
+        if self.columns is None or self.columns.size != len(self.metadata):
+            self.columns = MetaStore.from_records(self.metadata)
+        return self.columns
+    
+    @timed("filter")
+    def _allowed_positions(self, conditions: Sequence[Condition]) -> np.ndarray:
+        """フィルタ条件を満たし、削除されていない位置"""
+        columns = self._ensure_columns()
+        live = self.ids >= 0 if self.ids is not None and len(self.ids) == self.index.ntotal else None
+        allowed = columns.allowed(conditions, live)
+        return allowed[allowed < self.index.ntotal]
+    
+    @property
+    def tombstones(self) -> int:
+        """削除済みでまだ詰められていない件数"""
+        return int(np.count_nonzero(self.ids < 0)) if self.ids is not None else 0
+    
+    @property
+    def live_count(self) -> int:
+        """検索対象の件数（index.ntotal から削除済みを除いた数）"""
+        return int(self.index.ntotal) - self.tombstones if self.index is not None else 0
     
     def add_metadata(self, metadata: List[Dict[str, Any]]) -> None:
         """メタデータを追加"""
         self.metadata = metadata
+        self.ids = None
+        self._positions = None
+        self._invalidate_caches()
+        self._ensure_ids()
+        # 範囲属性（人月単価・従業員数帯）はここで数値に解析
+        self.columns = MetaStore.from_records(metadata)
         logger.info(f"Added {len(metadata)} metadata entries")
     
+    def build_lexical(self, texts: Sequence[str]) -> None:
+        """埋め込みに使ったテキスト（build_text_from_vendor）から語彙一致検索用の転置索引を構築"""
+        if self.index is not None and len(texts) != self.index.ntotal:
+            raise ValueError("texts must match the number of indexed vectors")
+        self.lexical = BM25Index.from_texts(texts)
+        logger.info(f"Built lexical index with {self.lexical.size} documents, {len(self.lexical.terms)} terms")
+    
+    def _ensure_ids(self) -> None:
+        """vendor_id 由来のIDと逆引きを用意（旧形式のインデックスはメタデータから導出）"""
+        ntotal = self.index.ntotal if self.index is not None else len(self.metadata)
+        if self.ids is None or len(self.ids) != ntotal:
+            if len(self.metadata) == ntotal:
+                labels = [vendor_label(m.get("vendor_id") or str(i)) for i, m in enumerate(self.metadata)]
+            else:
+                labels = [vendor_label(str(i)) for i in range(ntotal)]
+            self.ids = np.array(labels, dtype=np.int64).reshape(-1)
+            self._invalidate_caches()
+        if self._positions is None:
+            self._positions = {int(label): i for i, label in enumerate(self.ids) if label >= 0}
+    
+    def _ensure_writable(self) -> None:
+        """更新前にメモリマップ（読み取り専用）のインデックス・メタデータを通常のオブジェクトに読み替え"""
+        if self.index is None:
+            raise ValueError("Index not built yet")
+        if self.mmapped:
+            logger.info("Re-reading memory-mapped index into memory for updates")
+            self.index = self._read_index(False)
+        if not isinstance(self.metadata, list):
+            self.metadata = list(self.metadata)
+        self._ensure_ids()
+    
+    def upsert(
+        self,
+        vendor_ids: Sequence[str],
+        embeddings: np.ndarray,
+        metadata: Optional[Sequence[Dict[str, Any]]] = None,
+        texts: Optional[Sequence[str]] = None
+    ) -> Dict[str, int]:
+        """
+        vendor_id 単位でベクトルを追加・更新（全体の再構築なし）
+        
+        既存の vendor_id は旧エントリを削除済みにして末尾に追加し直す。
+        
+        Args:
+            vendor_ids: ベンダーID
+            embeddings: L2正規化済み埋め込み行列（vendor_ids と同じ行数）
+            metadata: 各ベンダーのメタデータ（未指定時は vendor_id のみ）
+            texts: 語彙一致検索用のテキスト（未指定時は語彙一致検索にヒットしない）
+        
+        Returns:
+            {"inserted": 新規件数, "updated": 更新件数}
+        """
+        embeddings = np.asarray(embeddings, dtype='float32')
+        if embeddings.ndim != 2 or len(vendor_ids) != embeddings.shape[0]:
+            raise ValueError("vendor_ids and embeddings must have the same number of rows")
+        if metadata is not None and len(metadata) != len(vendor_ids):
+            raise ValueError("vendor_ids and metadata must have the same length")
+        if texts is not None and len(texts) != len(vendor_ids):
+            raise ValueError("vendor_ids and texts must have the same length")
+        
+        # 同じリクエスト内の重複は後勝ち
+        latest = {vendor_label(vendor_id): row for row, vendor_id in enumerate(vendor_ids)}
+        rows = sorted(latest.values())
+        labels = np.array([vendor_label(vendor_ids[row]) for row in rows], dtype=np.int64)
+        vectors = np.ascontiguousarray(embeddings[rows])
+        records = [dict(metadata[row]) if metadata is not None else {"vendor_id": str(vendor_ids[row])} for row in rows]
+        
+        with self.lock:
+            self._ensure_writable()
+            if vectors.shape[1] != self.index.d:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index dimension {self.index.d}")
+            
+            replaced = [self._positions.pop(int(label)) for label in labels if int(label) in self._positions]
+            if replaced:
+                self.ids[replaced] = -1
+            
+            start = self.index.ntotal
+            self.index.add(quantize_ubinary(vectors) if self.index_type == "binary" else vectors)
+            if self.rescore_vectors is not None:
+                # 既存分はメモリマップのまま新しいファイルへコピーして追記（ヒープに全体を載せない）
+                self.rescore_vectors = spill_vectors(
+                    os.path.dirname(self.index_path), [(self.rescore_vectors, None), (vectors, None)]
+                )
+            self.ids = np.concatenate([self.ids, labels])
+            self.metadata.extend(records)
+            if self.columns is not None:
+                self.columns.append(records)
+            if self.lexical is not None:
+                self.lexical.append([texts[row] if texts is not None else "" for row in rows])
+            for offset, label in enumerate(labels):
+                self._positions[int(label)] = start + offset
+            self._after_update()
+        
+        logger.info(f"Upserted {len(rows)} vectors ({len(replaced)} updated), {self.tombstones} tombstones")
+        return {"inserted": len(rows) - len(replaced), "updated": len(replaced)}
+    
+    def delete(self, vendor_ids: Sequence[str]) -> int:
+        """vendor_id 単位で削除（トゥームストーン化し、検索から即時に除外）。削除件数を返す"""
+        with self.lock:
+            self._ensure_writable()
+            removed = [self._positions.pop(label) for label in map(vendor_label, vendor_ids) if label in self._positions]
+            if removed:
+                self.ids[removed] = -1
+                self._after_update()
+        
+        logger.info(f"Deleted {len(removed)} vectors, {self.tombstones} tombstones")
+        return len(removed)
+    
+    def _after_update(self) -> None:
+        self.version += 1
+        self._invalidate_caches()
+        self.info["ntotal"] = int(self.index.ntotal)
+        self._maybe_schedule_compaction()
+    
+    def _maybe_schedule_compaction(self) -> None:
+        """トゥームストーンが INDEX_COMPACT_RATIO を超えたらバックグラウンドで詰め直す"""
+        tombstones = self.tombstones
+        if self._compacting or tombstones == 0 or tombstones < settings.INDEX_COMPACT_RATIO * len(self.ids):
+            return
+        self._compacting = True
+        threading.Thread(target=self._compact_in_background, name="faiss-compaction", daemon=True).start()
+    
+    def _compact_in_background(self) -> None:
+        try:
+            self.compact()
+        except Exception as e:
+            logger.error(f"Index compaction failed: {e}")
+        finally:
+            self._compacting = False
+    
+    def compact(self) -> int:
+        """
+        削除済みエントリを物理的に取り除き、位置を詰め直す
+        
+        複製に対して作業し、その間に更新がなければ入れ替える（検索は止めない）。
+        flat 系は remove_ids、HNSW/IVF は生きているベクトルを再構成して作り直す（ivf_pq は近似値の再エンコード）。
+        
+        Returns:
+            取り除いた件数（途中で更新が入った場合は 0）
+        """
+        with self.lock:
+            if self.index is None or self.tombstones == 0:
+                return 0
+            self._ensure_writable()
+            version = self.version
+            live = np.flatnonzero(self.ids >= 0)
+            deleted = np.flatnonzero(self.ids < 0).astype(np.int64)
+            if self.index_type == "binary":
+                index = faiss.clone_binary_index(self.index)
+            else:
+                index = faiss.clone_index(self.index)
+            ids = self.ids[live]
+            metadata = [self.metadata[i] for i in live]
+            columns = self.columns.take(live) if self.columns is not None else None
+            # 再スコア用ベクトルは置き換えられるだけで書き換わらないので、参照だけ取ってロック外で詰める
+            source_vectors = self.rescore_vectors
+            lexical = self.lexical.take(live) if self.lexical is not None else None
+        
+        rescore_vectors = None
+        if source_vectors is not None:
+            rescore_vectors = spill_vectors(os.path.dirname(self.index_path), [(source_vectors, live)])
+        
+        if self.index_type in FLAT_CODE_TYPES:
+            index.remove_ids(faiss.IDSelectorBatch(deleted))
+        else:
+            is_ivf = self.index_type in ("ivf_flat", "ivf_pq")
+            if is_ivf:
+                faiss.extract_index_ivf(index).make_direct_map()
+            vectors = index.reconstruct_n(0, index.ntotal)[live]
+            # IVF は学習済みの量子化器を保ったまま、HNSW はグラフごと作り直す
+            index.reset()
+            index.add(vectors)
+            if is_ivf:
+                faiss.extract_index_ivf(index).make_direct_map(False)
+        
+        with self.lock:
+            if self.version != version:
+                logger.info("Index changed during compaction, deferring to the next update")
+                return 0
+            self.index = index
+            self.ids = ids
+            self.metadata = metadata
+            self.columns = columns
+            self.rescore_vectors = rescore_vectors
+            self.lexical = lexical
+            self._positions = None
+            self._invalidate_caches()
+            self._ensure_ids()
+            self.info["ntotal"] = int(index.ntotal)
+            self.version += 1
+        
+        logger.info(f"Compacted index: removed {len(deleted)} tombstones, {index.ntotal} vectors remain")
+        return len(deleted)
+    
     def save(self) -> None:
         """インデックスとメタデータを保存"""
         if self.index is None:
@@ -47,38 +572,136 @@ class FAISSStore:
         # ディレクトリ作成
         os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
         
-        # FAISSインデックス保存
-        faiss.write_index(self.index, self.index_path)
-        
-        # メタデータ保存
-        with open(self.meta_path, 'wb') as f:
-            f.write(orjson.dumps(self.metadata))
+        with self.lock:
+            # FAISSインデックス保存
+            if self.index_type == "binary":
+                faiss.write_index_binary(self.index, self.index_path)
+            else:
+                faiss.write_index(self.index, self.index_path)
+            
+            # メタデータ保存（1行1レコード＋位置情報）
+            _write_metadata(self.meta_path, self.offsets_path, self.metadata)
+            
+            # vendor_id 由来のID（削除済みは -1）
+            if self.ids is not None:
+                np.save(self.ids_path, self.ids)
+            
+            # フィルタ用の列指向メタデータ
+            self._ensure_columns().save(self.columns_path)
+            
+            # 語彙一致検索用の転置索引（無ければ古いファイルを残さない）
+            if self.lexical is not None:
+                self.lexical.save(self.lexical_path)
+            elif os.path.exists(self.lexical_path):
+                os.remove(self.lexical_path)
+            
+            # binary の再スコア用 float ベクトル。読み込み中のメモリマップと同じファイルに上書きしないよう
+            # 一時ファイルに書いてから差し替える
+            if self.rescore_vectors is not None:
+                tmp_path = self.vectors_path + ".tmp"
+                with open(tmp_path, 'wb') as f:
+                    np.save(f, self.rescore_vectors)
+                os.replace(tmp_path, self.vectors_path)
+            elif os.path.exists(self.vectors_path):
+                os.remove(self.vectors_path)
+            
+            # インデックス種別・検索パラメータ保存
+            with open(self.info_path, 'wb') as f:
+                f.write(orjson.dumps(self.info))
         
         logger.info(f"Saved index to {self.index_path} and metadata to {self.meta_path}")
     
-    def load(self) -> None:
-        """インデックスとメタデータを読み込み"""
+    def load(self, mmap_mode: Optional[bool] = None) -> None:
+        """
+        インデックスとメタデータを読み込み
+        
+        Args:
+            mmap_mode: メモリマップで読み込むか（未指定時は FAISS_MMAP）
+        """
+        mmap_mode = settings.FAISS_MMAP if mmap_mode is None else mmap_mode
         if not os.path.exists(self.index_path):
             raise FileNotFoundError(f"Index file not found: {self.index_path}")
         
         if not os.path.exists(self.meta_path):
             raise FileNotFoundError(f"Metadata file not found: {self.meta_path}")
         
+        # インデックス種別（旧形式は info なし = flat）
+        self.info = {}
+        if os.path.exists(self.info_path):
+            with open(self.info_path, 'rb') as f:
+                self.info = orjson.loads(f.read())
+        
         # FAISSインデックス読み込み
-        self.index = faiss.read_index(self.index_path)
+        self.index = self._read_index(mmap_mode)
         
         # メタデータ読み込み
-        with open(self.meta_path, 'rb') as f:
-            self.metadata = orjson.loads(f.read())
+        self.metadata = self._read_metadata(mmap_mode)
+        
+        # vendor_id 由来のID（旧形式は初回更新時にメタデータから導出）
+        self.ids = np.load(self.ids_path) if os.path.exists(self.ids_path) else None
+        self._positions = None
+        self._invalidate_caches()
+        
+        # 列指向メタデータ（無い・件数が合わない場合は初回フィルタ時にメタデータから構築）
+        self.columns = MetaStore.load(self.columns_path) if os.path.exists(self.columns_path) else None
+        
+        # 語彙一致検索用の転置索引（件数が合わなければ使わない）
+        self.lexical = BM25Index.load(self.lexical_path) if os.path.exists(self.lexical_path) else None
+        if self.lexical is not None and self.lexical.size != self.index.ntotal:
+            logger.warning(f"Lexical index size {self.lexical.size} does not match index ({self.index.ntotal}), ignoring")
+            self.lexical = None
         
-        logger.info(f"Loaded index with {self.index.ntotal} vectors and {len(self.metadata)} metadata entries")
+        # binary の再スコア用 float ベクトル。FAISS_MMAP に関わらず常にメモリマップし、
+        # 候補の行だけをページインする（ヒープに読むと Flat より多くのメモリを使うため）
+        self.rescore_vectors = None
+        if self.index_type == "binary":
+            if os.path.exists(self.vectors_path):
+                self.rescore_vectors = np.load(self.vectors_path, mmap_mode='r')
+                if self.rescore_vectors.shape != (self.index.ntotal, self.index.d):
+                    logger.warning(f"Rescore vectors {self.rescore_vectors.shape} do not match index, ignoring")
+                    self.rescore_vectors = None
+            if self.rescore_vectors is None:
+                logger.warning("Binary index has no float vectors, rescoring with sign vectors")
+        
+        logger.info(
+            f"Loaded index with {self.index.ntotal} vectors and {len(self.metadata)} metadata entries"
+            f" (mmap={self.mmapped})"
+        )
+    
+    def _read_index(self, mmap_mode: bool) -> Any:
+        """インデックスを読み込み。mmap 指定時はコードを複製せずファイルを直接参照する"""
+        reader = faiss.read_index_binary if self.index_type == "binary" else faiss.read_index
+        self.mmapped = False
+        if mmap_mode:
+            # IO_FLAG_MMAP_IFC はフラットなコード配列もゼロコピーで参照する（古いFAISSは IO_FLAG_MMAP）
+            flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            try:
+                index = reader(self.index_path, flags)
+                self.mmapped = True
+                return index
+            except RuntimeError as e:
+                logger.warning(f"Memory-mapped index load failed, falling back to regular read: {e}")
+        return reader(self.index_path)
+    
+    def _read_metadata(self, mmap_mode: bool) -> Sequence[Dict[str, Any]]:
+        """メタデータを読み込み。位置情報があればメモリマップして遅延デコード"""
+        if mmap_mode and os.path.exists(self.offsets_path):
+            try:
+                return MappedMetadata(self.meta_path, self.offsets_path)
+            except (ValueError, OSError) as e:
+                logger.warning(f"Memory-mapped metadata load failed, falling back to full parse: {e}")
+        with open(self.meta_path, 'rb') as f:
+            return orjson.loads(f.read())
     
     def search(
         self, 
         query_embedding: np.ndarray, 
         k: int = 10,
-        threshold: Optional[float] = None
-    ) -> Tuple[np.ndarray, np.ndarray]:
+        threshold: Optional[float] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        return_vectors: bool = False
+    ) -> Union[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
         """
         ベクトル検索を実行
         
@@ -86,35 +709,373 @@ class FAISSStore:
             query_embedding: クエリ埋め込みベクトル
             k: 検索結果数
             threshold: スコア閾値
+            search_params: 保存済みパラメータの上書き（nprobe / efSearch）
+            filters: メタデータフィルタ（listed / type を検索前に適用）
+            return_vectors: 候補の格納ベクトルも返すか（MMR 用）
         
         Returns:
-            (scores, indices): スコアとインデックスのタプル
+            (scores, indices): スコアとインデックスのタプル。return_vectors 時は (scores, indices, vectors)
+        """
+        # 格納ベクトルは検索と同じロック区間で取り出す（間にコンパクションが入ると位置がずれる）
+        with self.lock:
+            scores, indices = self.search_batch(
+                query_embedding.reshape(1, -1), k, [threshold], search_params, [filters]
+            )[0]
+            vectors = self.vectors(indices) if return_vectors else None
+        logger.info(f"Search returned {len(scores)} results")
+        if return_vectors:
+            return scores, indices, vectors
+        return scores, indices
+    
+    @timed("faiss_search")
+    def search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        k: Union[int, Sequence[int]] = 10,
+        thresholds: Optional[Sequence[Optional[float]]] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[Sequence[Optional[Dict[str, Any]]]] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        複数クエリを1回の index.search でまとめて検索
+        
+        フィルタはビットマップで許可位置を求めて検索に押し下げる。同じフィルタのクエリは
+        まとめて1回で検索し、許可位置が FILTER_EXHAUSTIVE_MAX 件以下なら全件の内積、
+        それより多ければ IDSelector 付きで ANN 検索する。
+        
+        Args:
+            query_embeddings: クエリ埋め込み行列 (m, d)
+            k: 検索結果数（全クエリ共通 or クエリごと）
+            thresholds: クエリごとのスコア閾値（None は閾値なし）
+            search_params: 保存済みパラメータの上書き（nprobe / efSearch）
+            filters: クエリごとのメタデータフィルタ（None はフィルタなし）
+        
+        Returns:
+            クエリごとの (scores, indices) のリスト
         """
         if self.index is None:
             raise ValueError("Index not loaded")
         
-        # 検索実行
-        scores, indices = self.index.search(
-            query_embedding.reshape(1, -1).astype('float32'), 
-            k
-        )
+        queries = np.ascontiguousarray(query_embeddings, dtype='float32')
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        m = queries.shape[0]
+        ks = [k] * m if isinstance(k, int) else list(k)
+        thresholds = list(thresholds) if thresholds is not None else [None] * m
+        filters = list(filters) if filters is not None else [None] * m
+        if len(ks) != m or len(thresholds) != m or len(filters) != m:
+            raise ValueError("k, thresholds and filters must match the number of queries")
+        k_max = max(ks) if ks else 0
+        if m == 0 or k_max <= 0:
+            return [(np.array([], dtype='float32'), np.array([], dtype='int64')) for _ in range(m)]
         
-        scores = scores[0]  # バッチサイズ1なので最初の要素
-        indices = indices[0]
+        # 同じフィルタ条件のクエリをまとめる
+        groups: Dict[Tuple[Condition, ...], List[int]] = {}
+        for row, row_filters in enumerate(filters):
+            groups.setdefault(filter_conditions(row_filters), []).append(row)
         
-        # 閾値フィルタリング
-        if threshold is not None:
-            valid_mask = scores >= threshold
-            scores = scores[valid_mask]
-            indices = indices[valid_mask]
+        all_scores = np.full((m, k_max), -np.inf, dtype='float32')
+        all_indices = np.full((m, k_max), -1, dtype='int64')
+        with self.lock:
+            for conditions, rows in groups.items():
+                scores, indices = self._search_group(queries[rows], k_max, search_params, conditions)
+                all_scores[rows, :scores.shape[1]] = scores
+                all_indices[rows, :indices.shape[1]] = indices
         
-        logger.info(f"Search returned {len(scores)} results")
+        results = []
+        for row in range(m):
+            scores = all_scores[row, :ks[row]]
+            indices = all_indices[row, :ks[row]]
+            
+            # 件数不足時の -1 を除外
+            valid = indices >= 0
+            
+            # 閾値フィルタリング
+            if thresholds[row] is not None:
+                valid &= scores >= thresholds[row]
+            results.append((scores[valid], indices[valid]))
+        
+        return results
+    
+    @timed("lexical_search")
+    def lexical_search(
+        self,
+        query: str,
+        k: int = 10,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 による語彙一致検索（クエリ埋め込み不要）
+        
+        Args:
+            query: クエリ文字列
+            k: 検索結果数
+            filters: メタデータフィルタ（削除済みとあわせて許可位置に絞る）
+        
+        Returns:
+            (scores, indices): BM25 スコア降順（一致する語が無い文書は含めない）
+        """
+        if self.lexical is None:
+            raise ValueError("Lexical index not built")
+        with self.lock:
+            conditions = filter_conditions(filters)
+            if conditions:
+                allowed = self._allowed_positions(conditions)
+            elif self.tombstones:
+                allowed = np.flatnonzero(self.ids >= 0)
+            else:
+                allowed = None
+            scores, indices = self.lexical.search(query, k, allowed)
+        logger.info(f"Lexical search returned {len(scores)} results")
+        return scores, indices
+    
+    def range_search(
+        self,
+        query_embedding: np.ndarray,
+        threshold: float,
+        max_results: Optional[int] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[Dict[str, Any]] = None,
+        return_vectors: bool = False
+    ) -> Union[Tuple[np.ndarray, np.ndarray], Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        スコアが閾値以上のベクトルをすべて返す（k を決めずに検索）
+        
+        Args:
+            query_embedding: クエリ埋め込みベクトル
+            threshold: スコア閾値（以上を返す）
+            max_results: 返す件数の上限（未指定時は RANGE_SEARCH_MAX_RESULTS）
+            search_params: 保存済みパラメータの上書き（nprobe / efSearch）
+            filters: メタデータフィルタ
+            return_vectors: 候補の格納ベクトルも返すか（MMR 用）
+        
+        Returns:
+            (scores, indices): スコア降順。return_vectors 時は (scores, indices, vectors)
+        """
+        with self.lock:
+            scores, indices = self.range_search_batch(
+                query_embedding.reshape(1, -1), threshold, max_results, search_params, [filters]
+            )[0]
+            vectors = self.vectors(indices) if return_vectors else None
+        logger.info(f"Range search returned {len(scores)} results above {threshold}")
+        if return_vectors:
+            return scores, indices, vectors
         return scores, indices
     
+    @timed("faiss_search")
+    def range_search_batch(
+        self,
+        query_embeddings: np.ndarray,
+        threshold: float,
+        max_results: Optional[int] = None,
+        search_params: Optional[Dict[str, Any]] = None,
+        filters: Optional[Sequence[Optional[Dict[str, Any]]]] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        複数クエリの閾値検索（faiss の range_search で1回走査）
+        
+        binary は Hamming では閾値を表せないため、上限件数の2段階検索結果を閾値でカットする。
+        
+        Returns:
+            クエリごとの (scores, indices)（スコア降順、max_results 件で打ち切り）
+        """
+        if self.index is None:
+            raise ValueError("Index not loaded")
+        
+        queries = np.ascontiguousarray(query_embeddings, dtype='float32')
+        if queries.ndim == 1:
+            queries = queries.reshape(1, -1)
+        m = queries.shape[0]
+        cap = max_results or settings.RANGE_SEARCH_MAX_RESULTS
+        filters = list(filters) if filters is not None else [None] * m
+        if len(filters) != m:
+            raise ValueError("filters must match the number of queries")
+        
+        groups: Dict[Tuple[Condition, ...], List[int]] = {}
+        for row, row_filters in enumerate(filters):
+            groups.setdefault(filter_conditions(row_filters), []).append(row)
+        
+        results: List[Tuple[np.ndarray, np.ndarray]] = [None] * m
+        with self.lock:
+            for conditions, rows in groups.items():
+                group_results = self._range_search_group(queries[rows], threshold, cap, search_params, conditions)
+                for row, result in zip(rows, group_results):
+                    results[row] = result
+        return results
+    
+    def _range_search_group(
+        self,
+        queries: np.ndarray,
+        threshold: float,
+        cap: int,
+        search_params: Optional[Dict[str, Any]],
+        conditions: Tuple[Condition, ...]
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """同じフィルタ条件のクエリ群の閾値検索（実行計画は _search_group と同じ）"""
+        empty = (np.array([], dtype='float32'), np.array([], dtype='int64'))
+        selector = None
+        if conditions:
+            allowed = self._allowed_positions(conditions)
+            if len(allowed) == 0:
+                self.filter_plans["empty"] += 1
+                return [empty for _ in range(len(queries))]
+            if len(allowed) <= settings.FILTER_EXHAUSTIVE_MAX:
+                self.filter_plans["exhaustive"] += 1
+                scores = queries @ self._subset_vectors(allowed).T
+                return [_sorted_hits(row, allowed, row >= threshold, cap) for row in scores]
+            self.filter_plans["selector"] += 1
+            selector = faiss.IDSelectorBatch(allowed)
+        
+        if self.index_type == "binary":
+            all_scores, all_indices = self._search_binary(queries, min(cap, self.index.ntotal), selector)
+            return [
+                _sorted_hits(scores, indices, (indices >= 0) & (scores >= threshold), cap)
+                for scores, indices in zip(all_scores, all_indices)
+            ]
+        
+        # range_search の内積は「radius より大きい」ため、閾値ちょうども含むよう僅かに下げる
+        radius = float(np.nextafter(np.float32(threshold), np.float32(-np.inf)))
+        lims, all_scores, all_indices = self.index.range_search(
+            queries, radius, params=self._search_parameters(search_params, selector)
+        )
+        return [
+            _sorted_hits(all_scores[lims[r]:lims[r + 1]], all_indices[lims[r]:lims[r + 1]], None, cap)
+            for r in range(len(queries))
+        ]
+    
+    def _search_group(
+        self,
+        queries: np.ndarray,
+        k: int,
+        search_params: Optional[Dict[str, Any]],
+        conditions: Tuple[Condition, ...]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """同じフィルタ条件のクエリ群を検索（実行計画: フィルタなし / 全件内積 / セレクタ付きANN）"""
+        if not conditions:
+            return self._search_index(queries, k, search_params)
+        
+        allowed = self._allowed_positions(conditions)
+        if len(allowed) == 0:
+            self.filter_plans["empty"] += 1
+            return np.empty((len(queries), 0), dtype='float32'), np.empty((len(queries), 0), dtype='int64')
+        if len(allowed) <= settings.FILTER_EXHAUSTIVE_MAX:
+            # 許可集合が小さければ、そのベクトルだけを厳密に内積計算（ANN の取りこぼしなし）
+            self.filter_plans["exhaustive"] += 1
+            return self._search_subset(queries, k, allowed)
+        
+        self.filter_plans["selector"] += 1
+        selector = faiss.IDSelectorBatch(allowed)
+        return self._search_index(queries, k, search_params, selector)
+    
+    def _search_index(
+        self,
+        queries: np.ndarray,
+        k: int,
+        search_params: Optional[Dict[str, Any]] = None,
+        selector: Optional[Any] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if self.index_type == "binary":
+            return self._search_binary(queries, k, selector)
+        return self.index.search(queries, k, params=self._search_parameters(search_params, selector))
+    
+    def _subset_vectors(self, positions: np.ndarray) -> np.ndarray:
+        """指定位置のベクトルを再構成（binary は保存済みの float、無ければ ±1/√d。IVF は初回に direct map を作成）"""
+        if self.index_type == "binary":
+            if self.rescore_vectors is not None:
+                return np.asarray(self.rescore_vectors[np.asarray(positions, dtype=np.int64)], dtype=np.float32)
+            return self._binary_signs(positions)
+        if self.index_type in ("ivf_flat", "ivf_pq"):
+            ivf = faiss.extract_index_ivf(self.index)
+            if not ivf.direct_map.type:
+                ivf.make_direct_map()
+        return self.index.reconstruct_batch(positions)
+    
+    def vectors(self, indices: np.ndarray) -> np.ndarray:
+        """
+        検索結果の位置に対応する格納ベクトル（検索順に並んだ (len(indices), d) の float32）
+
+        候補のみを1回の reconstruct_batch でまとめて取り出す。PQ / SQ は量子化後の近似値、
+        binary は保存済みの float ベクトル（旧形式は ±1/√d の符号ベクトル）。
+        位置はコンパクションで変わるため、呼び出し側は検索と同じ store.lock の区間内で呼ぶこと
+        （IVF の direct map 作成もインデックスを書き換えるためロック内で行う）。
+        """
+        positions = np.asarray(indices, dtype=np.int64)
+        if len(positions) == 0:
+            return np.empty((0, self.index.d), dtype=np.float32)
+        with self.lock:
+            return np.ascontiguousarray(self._subset_vectors(positions), dtype=np.float32)
+    
+    def _search_subset(self, queries: np.ndarray, k: int, positions: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """指定位置のベクトルのみを再構成して全件内積で検索"""
+        scores = queries @ self._subset_vectors(positions).T
+        k = min(k, len(positions))
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(top_scores, order, axis=1), positions[np.take_along_axis(top, order, axis=1)]
+    
+    def _binary_signs(self, positions: np.ndarray) -> np.ndarray:
+        """バイナリコードを ±1/√d の float ベクトルに展開"""
+        codes = np.vstack([self.index.reconstruct(int(i)) for i in positions])
+        signs = np.unpackbits(codes, axis=1).astype(np.float32) * 2.0 - 1.0
+        return signs / np.sqrt(signs.shape[1])
+    
+    def _search_binary(self, queries: np.ndarray, k: int, selector: Optional[Any] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Hamming 距離で候補を絞り、候補の float ベクトルとクエリの内積で再スコアする2段階検索（結果は -1 埋めの (m, k)）
+
+        再スコアは保存済みの float ベクトルによる厳密なコサイン類似度のため、スコア・閾値は flat と同じ尺度になる。
+        """
+        factor = self.info.get("search_params", {}).get("rescore_factor", DEFAULT_RESCORE_FACTOR)
+        n_candidates = min(self.index.ntotal, k * factor)
+        m = queries.shape[0]
+        out_scores = np.full((m, k), -np.inf, dtype='float32')
+        out_indices = np.full((m, k), -1, dtype='int64')
+        
+        # 1段階目: Hamming 距離（全クエリまとめて）
+        _, all_candidates = self.index.search(
+            quantize_ubinary(queries), n_candidates, params=self._search_parameters(selector=selector)
+        )
+        
+        for row in range(m):
+            candidates = all_candidates[row]
+            candidates = candidates[candidates >= 0]
+            if len(candidates) == 0:
+                continue
+            
+            # 2段階目: 候補の float ベクトル（旧形式は ±1/√d の符号ベクトル）とクエリの内積で再スコア
+            rescored = self._subset_vectors(candidates) @ queries[row]
+            
+            order = np.argsort(-rescored)[:k]
+            out_scores[row, :len(order)] = rescored[order]
+            out_indices[row, :len(order)] = candidates[order]
+        
+        return out_scores, out_indices
+    
+    def companion_paths(self) -> List[str]:
+        """index/meta 以外に一緒に配布すべきファイル（存在するもののみ）"""
+        index_dir = os.path.dirname(self.index_path)
+        paths = [os.path.join(index_dir, name) for name in COMPANION_FILENAMES]
+        return [p for p in paths if os.path.exists(p)]
+    
     def get_metadata_by_indices(self, indices: np.ndarray) -> List[Dict[str, Any]]:
         """インデックスに対応するメタデータを取得"""
         return [self.metadata[i] for i in indices if i < len(self.metadata)]
     
+    @property
+    def nbytes(self) -> int:
+        """常駐に必要なおおよそのメモリ量（保存済みファイルのサイズ＋列データ）"""
+        paths = (self.index_path, self.meta_path, self.offsets_path, self.ids_path)
+        total = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+        if self.columns is not None:
+            total += self.columns.nbytes
+        if self.lexical is not None:
+            total += self.lexical.nbytes
+        # 再スコア用ベクトルは常にメモリマップ（ページキャッシュ、候補の行のみ）なので数えない
+        if self.rescore_vectors is not None and not isinstance(self.rescore_vectors, np.memmap):
+            total += self.rescore_vectors.nbytes
+        return total
+    
     def is_loaded(self) -> bool:
         """インデックスが読み込まれているかチェック"""
         return self.index is not None and len(self.metadata) > 0
@@ -0,0 +1,502 @@
+"""
+バージョン付きインデックスの公開とホットスワップ
+"""
+import os
+import re
+import time
+import shutil
+import tempfile
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.core.faiss_store import FAISSStore, COMPANION_FILENAMES
+from app.core.s3_store import S3Store
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+VERSIONS_DIRNAME = "versions"
+CURRENT_FILENAME = "CURRENT"
+STAGING_PREFIX = ".staging-"
+# CURRENT が無い旧形式（{index_name}/index.faiss 直下）の版名
+LEGACY_VERSION = "legacy"
+# 見つからなかったインデックス名を覚えておく上限件数（任意の名前で溜め込まない）
+NOT_FOUND_CACHE_MAX = 1024
+# ディレクトリ名として安全なインデックス名
+INDEX_NAME_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.-]{0,127}$")
+
+
+def new_version() -> str:
+    """時刻順に並ぶ版名を生成"""
+    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def version_paths(index_dir: str, version: str) -> Tuple[str, str]:
+    """版ディレクトリ内の index.faiss / meta.json のパス"""
+    version_dir = index_dir if version == LEGACY_VERSION else os.path.join(index_dir, VERSIONS_DIRNAME, version)
+    return os.path.join(version_dir, "index.faiss"), os.path.join(version_dir, "meta.json")
+
+
+def validate_index_name(index_name: str) -> str:
+    """VECTOR_DIR の外を指せないインデックス名か確認"""
+    if not INDEX_NAME_RE.match(index_name) or ".." in index_name:
+        raise ValueError(f"Invalid index name: {index_name!r}")
+    return index_name
+
+
+def read_current_version(index_dir: str) -> Optional[str]:
+    """公開中の版名（CURRENT が無ければ旧形式、どちらも無ければ None）"""
+    current_path = os.path.join(index_dir, CURRENT_FILENAME)
+    if os.path.exists(current_path):
+        with open(current_path) as f:
+            return f.read().strip() or None
+    if os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return LEGACY_VERSION
+    return None
+
+
+def publish_store(store: FAISSStore, index_dir: str, protected: Optional[Set[str]] = None) -> str:
+    """
+    ストアを新しい版として保存し、アトミックに公開する
+
+    1. versions/.staging-{版} に保存
+    2. ディレクトリを versions/{版} へ rename（読み手が書きかけのファイルを見ることはない）
+    3. CURRENT を一時ファイル＋os.replace で差し替え
+
+    Returns:
+        公開した版名（store のパスは公開後の版ディレクトリを指す）
+    """
+    version, staging_dir = _staging_dir(index_dir)
+    store.set_paths(os.path.join(staging_dir, "index.faiss"), os.path.join(staging_dir, "meta.json"))
+    store.save()
+
+    _commit_version(index_dir, staging_dir, version)
+    store.set_paths(*version_paths(index_dir, version))
+
+    prune_versions(index_dir, keep=settings.INDEX_KEEP_VERSIONS, protected=(protected or set()) | {version})
+    return version
+
+
+def _staging_dir(index_dir: str) -> Tuple[str, str]:
+    version = new_version()
+    staging_dir = os.path.join(index_dir, VERSIONS_DIRNAME, STAGING_PREFIX + version)
+    os.makedirs(staging_dir, exist_ok=True)
+    return version, staging_dir
+
+
+def _commit_version(index_dir: str, staging_dir: str, version: str) -> None:
+    """書き終えたステージングを版ディレクトリへ rename し、CURRENT を差し替える"""
+    os.rename(staging_dir, os.path.join(index_dir, VERSIONS_DIRNAME, version))
+
+    current_path = os.path.join(index_dir, CURRENT_FILENAME)
+    tmp_path = f"{current_path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, current_path)
+    logger.info(f"Published index version {version} in {index_dir}")
+
+
+def fetch_from_s3(index_dir: str, index_name: str) -> Optional[str]:
+    """
+    S3 のインデックスを新しい版としてダウンロードして公開（S3 未設定・未登録なら None）
+    """
+    if not settings.S3_BUCKET_NAME:
+        return None
+    s3_store = S3Store(settings.S3_BUCKET_NAME, settings.S3_PREFIX, settings.AWS_REGION)
+    # 未登録の名前で {index_name}/versions が空のまま残らないよう、ダウンロードは VECTOR_DIR 直下の
+    # 一時ディレクトリに行い、成功してから版ディレクトリを作って rename する
+    base_dir = os.path.dirname(os.path.abspath(index_dir))
+    os.makedirs(base_dir, exist_ok=True)
+    download_dir = tempfile.mkdtemp(prefix=f"{STAGING_PREFIX}{index_name}-", dir=base_dir)
+    try:
+        downloaded = s3_store.download_index(
+            index_name,
+            os.path.join(download_dir, "index.faiss"),
+            os.path.join(download_dir, "meta.json"),
+            extra_filenames=list(COMPANION_FILENAMES)
+        )
+        if not downloaded:
+            return None
+        version = new_version()
+        os.makedirs(os.path.join(index_dir, VERSIONS_DIRNAME), exist_ok=True)
+        _commit_version(index_dir, download_dir, version)
+        return version
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+
+
+def prune_versions(index_dir: str, keep: int, protected: Set[str]) -> List[str]:
+    """新しい順に keep 版を残して古い版を削除（protected の版は残す）"""
+    versions_dir = os.path.join(index_dir, VERSIONS_DIRNAME)
+    if not os.path.isdir(versions_dir):
+        return []
+    versions = sorted((v for v in os.listdir(versions_dir) if not v.startswith(".")), reverse=True)
+    removed = []
+    for version in versions[max(keep, 1):]:
+        if version in protected:
+            continue
+        # mmap 中のファイルを消しても既存のマッピングは有効（Linux）
+        shutil.rmtree(os.path.join(versions_dir, version), ignore_errors=True)
+        removed.append(version)
+    if removed:
+        logger.info(f"Pruned old index versions: {', '.join(removed)}")
+    return removed
+
+
+class StoreHandle:
+    """参照カウント付きのストア参照（with で取得・解放）"""
+
+    def __init__(self, store: FAISSStore, version: str, manager: "IndexManager"):
+        self.store = store
+        self.version = version
+        self.refs = 0
+        self.loaded_at = datetime.now(timezone.utc).isoformat()
+        self._manager = manager
+
+    def __enter__(self) -> FAISSStore:
+        return self.store
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._manager.release(self)
+
+
+class IndexManager:
+    """
+    公開中の版を参照カウント付きで提供し、新しい版へ無停止で切り替える
+
+    新しい版はロック外で読み込んでから入れ替えるため、切り替え中も検索は止まらない。
+    実行中のリクエストは取得済みのハンドル（旧版）で完了し、以降のリクエストが新しい版を使う。
+    """
+
+    def __init__(self, base_dir: str, index_name: str):
+        self.index_dir = os.path.join(base_dir, index_name)
+        self.index_name = index_name
+        self._current: Optional[StoreHandle] = None
+        self._retired: List[StoreHandle] = []
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.reloads = 0
+        self.loads = 0
+        self.evictions = 0
+        self.acquires = 0
+        self.last_used = 0.0
+
+    def acquire(self) -> StoreHandle:
+        """公開中の版のハンドルを取得（未読み込みなら読み込み）。with を抜けると解放"""
+        while True:
+            handle = self.try_acquire()
+            if handle is not None:
+                return handle
+            self.reload()
+
+    def try_acquire(self) -> Optional[StoreHandle]:
+        """常駐中なら公開中の版のハンドルを取得（未読み込みなら None。読み込み・ファイルアクセスはしない）"""
+        with self._lock:
+            if self._current is None:
+                return None
+            self._current.refs += 1
+            self.acquires += 1
+            self.last_used = time.time()
+            return self._current
+
+    def release(self, handle: StoreHandle) -> None:
+        with self._lock:
+            handle.refs -= 1
+            if handle is not self._current and handle.refs <= 0 and handle in self._retired:
+                self._retired.remove(handle)
+                logger.info(f"Released index version {handle.version} of {self.index_name}")
+
+    def current_store(self) -> FAISSStore:
+        """公開中のストア（参照カウントなし。更新系の処理用）"""
+        with self.acquire() as store:
+            return store
+
+    @property
+    def version(self) -> Optional[str]:
+        return self._current.version if self._current else None
+
+    @property
+    def loaded(self) -> bool:
+        return self._current is not None
+
+    @property
+    def nbytes(self) -> int:
+        """常駐中の版（と実行中のリクエストが保持する旧版）のおおよそのメモリ量"""
+        with self._lock:
+            handles = ([self._current] if self._current else []) + self._retired
+            return sum(h.store.nbytes for h in {id(h.store): h for h in handles}.values())
+
+    def unload(self) -> bool:
+        """実行中のリクエストが無ければ常駐中の版を解放（次の acquire で再読み込み）"""
+        with self._lock:
+            if self._current is None or self._current.refs > 0:
+                return False
+            logger.info(f"Unloaded index {self.index_name} version {self._current.version}")
+            self._current = None
+            self.evictions += 1
+            return True
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        CURRENT が指す版が変わっていれば読み込んで切り替える
+
+        Returns:
+            切り替えたか
+
+        Raises:
+            FileNotFoundError: ローカルにも S3 にも公開済みの版が無い場合
+        """
+        with self._reload_lock:
+            version = read_current_version(self.index_dir)
+            if version is None and self._current is None:
+                # ローカルに無ければ S3 から取得（初回のみ）
+                version = fetch_from_s3(self.index_dir, self.index_name)
+            if version is None:
+                raise FileNotFoundError(f"Index not found: {self.index_dir}")
+            if not force and self._current is not None and self._current.version == version:
+                return False
+
+            store = FAISSStore(*version_paths(self.index_dir, version))
+            store.load()
+            self.loads += 1
+            self._swap(StoreHandle(store, version, self))
+            return True
+
+    def adopt(self, store: FAISSStore) -> str:
+        """メモリ上のストアを新しい版として公開し、再読み込みせずにそのまま切り替える"""
+        with self._reload_lock:
+            version = publish_store(store, self.index_dir, protected=self._versions_in_use())
+            self._swap(StoreHandle(store, version, self))
+            return version
+
+    def _swap(self, handle: StoreHandle) -> None:
+        with self._lock:
+            previous = self._current
+            self._current = handle
+            if previous is not None and previous.store is not handle.store and previous.refs > 0:
+                self._retired.append(previous)
+            self.reloads += 1
+        logger.info(
+            f"Serving index {self.index_name} version {handle.version} "
+            f"({handle.store.index.ntotal} vectors, previous={previous.version if previous else None})"
+        )
+
+    def _versions_in_use(self) -> Set[str]:
+        with self._lock:
+            handles = ([self._current] if self._current else []) + self._retired
+            return {h.version for h in handles}
+
+    def status(self) -> Dict[str, Any]:
+        """ヘルスチェック用の状態"""
+        with self._lock:
+            current = self._current
+            return {
+                "index_name": self.index_name,
+                "version": current.version if current else None,
+                "loaded_at": current.loaded_at if current else None,
+                # 削除済み（未コンパクション）を除いた件数。upsert/delete のレスポンスと同じ値
+                "ntotal": current.store.live_count if current else 0,
+                "tombstones": current.store.tombstones if current else 0,
+                "in_flight": current.refs if current else 0,
+                "retired_in_flight": sum(h.refs for h in self._retired),
+                "reloads": self.reloads,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "acquires": self.acquires,
+                "last_used": self.last_used or None,
+            }
+
+
+class IndexRegistry:
+    """
+    インデックス名ごとの IndexManager を束ね、メモリ予算内で LRU 常駐させる
+
+    インデックスは初回の検索時に VECTOR_DIR（無ければ S3）から遅延読み込みする。
+    常駐量の合計が予算を超えたら、最も長く使われていないインデックスから解放する
+    （実行中のリクエストがあるものと、今使おうとしているものは解放しない）。
+    ローカルにも S3 にも無かった名前は not_found_ttl 秒の間は探し直さずに FileNotFoundError を返す。
+    """
+
+    def __init__(self, base_dir: str, memory_budget_bytes: int = 0, not_found_ttl: float = 0.0):
+        self.base_dir = base_dir
+        self.memory_budget_bytes = memory_budget_bytes
+        self.not_found_ttl = not_found_ttl
+        self._managers: "OrderedDict[str, IndexManager]" = OrderedDict()
+        # 見つからなかった名前 → 期限（time.monotonic）
+        self._not_found: "OrderedDict[str, float]" = OrderedDict()
+        self.not_found_hits = 0
+        self._lock = threading.Lock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def manager(self, index_name: str) -> IndexManager:
+        """インデックス名のマネージャー（未登録なら作成。読み込みはしない）"""
+        validate_index_name(index_name)
+        with self._lock:
+            manager = self._managers.get(index_name)
+            if manager is None:
+                manager = self._managers[index_name] = IndexManager(self.base_dir, index_name)
+            return manager
+
+    def acquire(self, index_name: str) -> StoreHandle:
+        """インデックスのハンドルを取得し、予算超過分を LRU で解放"""
+        self._check_not_found(index_name)
+        manager = self.manager(index_name)
+        try:
+            handle = manager.acquire()
+        except FileNotFoundError:
+            # 存在しない名前のマネージャーを溜め込まず、しばらくは探し直さない
+            with self._lock:
+                if not manager.loaded and self._managers.get(index_name) is manager:
+                    del self._managers[index_name]
+                self._remember_not_found(index_name)
+            raise
+        self._touch(index_name)
+        return handle
+
+    def _check_not_found(self, index_name: str) -> None:
+        """最近見つからなかった名前なら S3 やディスクを見に行かずに FileNotFoundError"""
+        with self._lock:
+            expires = self._not_found.get(index_name)
+            if expires is None:
+                return
+            manager = self._managers.get(index_name)
+            if time.monotonic() < expires and (manager is None or not manager.loaded):
+                self.not_found_hits += 1
+                raise FileNotFoundError(f"Index not found: {index_name} (cached)")
+            del self._not_found[index_name]
+
+    def _remember_not_found(self, index_name: str) -> None:
+        if self.not_found_ttl <= 0:
+            return
+        now = time.monotonic()
+        self._not_found.pop(index_name, None)
+        self._not_found[index_name] = now + self.not_found_ttl
+        # 期限切れと上限超過分を古い順に捨てる
+        while self._not_found:
+            name, expires = next(iter(self._not_found.items()))
+            if expires > now and len(self._not_found) <= NOT_FOUND_CACHE_MAX:
+                break
+            del self._not_found[name]
+
+    def try_acquire(self, index_name: str) -> Optional[StoreHandle]:
+        """
+        常駐中のインデックスのハンドルを取得（未読み込みなら None）
+
+        イベントループ上から呼ぶ高速経路。None の場合は読み込みを伴う acquire をスレッドで呼ぶ。
+        """
+        validate_index_name(index_name)
+        with self._lock:
+            manager = self._managers.get(index_name)
+        handle = manager.try_acquire() if manager is not None else None
+        if handle is not None:
+            self._touch(index_name)
+        return handle
+
+    def adopt(self, index_name: str, store: FAISSStore) -> str:
+        """メモリ上のストアを公開して常駐させる"""
+        version = self.manager(index_name).adopt(store)
+        with self._lock:
+            self._not_found.pop(index_name, None)
+        self._touch(index_name)
+        return version
+
+    def _touch(self, index_name: str) -> None:
+        with self._lock:
+            if index_name in self._managers:
+                self._managers.move_to_end(index_name)
+        self._enforce_budget(keep=index_name)
+
+    @property
+    def resident_bytes(self) -> int:
+        with self._lock:
+            managers = list(self._managers.values())
+        return sum(m.nbytes for m in managers if m.loaded)
+
+    def _enforce_budget(self, keep: str) -> None:
+        if self.memory_budget_bytes <= 0:
+            return
+        with self._lock:
+            candidates = [(name, m) for name, m in self._managers.items() if name != keep and m.loaded]
+        resident = self.resident_bytes
+        # 古い順に解放（実行中のリクエストがあるものは飛ばす）
+        for name, manager in candidates:
+            if resident <= self.memory_budget_bytes:
+                break
+            size = manager.nbytes
+            if manager.unload():
+                resident -= size
+                logger.info(f"Evicted index {name} ({size} bytes) to stay within memory budget")
+        if resident > self.memory_budget_bytes:
+            logger.warning(f"Resident indexes ({resident} bytes) exceed memory budget ({self.memory_budget_bytes} bytes)")
+
+    def start_watcher(self, interval: float) -> None:
+        """常駐中のインデックスの CURRENT を interval 秒ごとに確認し、別プロセスが公開した版へ追従する"""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="index-watcher", daemon=True)
+        self._watcher.start()
+        logger.info(f"Watching {self.base_dir} for new index versions every {interval}s")
+
+    def stop_watcher(self) -> None:
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def _watch(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            with self._lock:
+                managers = [m for m in self._managers.values() if m.loaded]
+            for manager in managers:
+                try:
+                    manager.reload()
+                except FileNotFoundError:
+                    pass
+                except Exception as e:
+                    logger.error(f"Index reload failed for {manager.index_name}: {e}")
+
+    def status(self) -> Dict[str, Any]:
+        """ヘルスチェック用の状態（インデックスごとの統計を含む）"""
+        with self._lock:
+            managers = list(self._managers.values())
+        indexes = {}
+        for manager in managers:
+            stats = manager.status()
+            stats["loaded"] = manager.loaded
+            stats["nbytes"] = manager.nbytes
+            indexes[manager.index_name] = stats
+        return {
+            "memory_budget_bytes": self.memory_budget_bytes,
+            "resident_bytes": sum(s["nbytes"] for s in indexes.values() if s["loaded"]),
+            "watching": self._watcher is not None,
+            "not_found_cached": len(self._not_found),
+            "not_found_hits": self.not_found_hits,
+            "indexes": indexes,
+        }
+
+
+# グローバルレジストリ（シングルトン）
+_index_registry: Optional[IndexRegistry] = None
+
+
+def get_index_registry() -> IndexRegistry:
+    """インデックスレジストリを取得（シングルトン）"""
+    global _index_registry
+    if _index_registry is None:
+        _index_registry = IndexRegistry(
+            settings.VECTOR_DIR,
+            settings.INDEX_MEMORY_BUDGET_MB * 1024 * 1024,
+            not_found_ttl=settings.INDEX_NOT_FOUND_TTL
+        )
+    return _index_registry
+
+
+def get_index_manager(index_name: Optional[str] = None) -> IndexManager:
+    """インデックスのマネージャーを取得（未指定時は INDEX_NAME）"""
+    return get_index_registry().manager(index_name or settings.INDEX_NAME)
@@ -0,0 +1,209 @@
+"""
+文字n-gram の転置索引による BM25 検索（ネットワーク不要の語彙一致検索）とランク融合
+"""
+import math
+import logging
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+from app.utils.text import normalize_query_text
+
+logger = logging.getLogger(__name__)
+
+# 日本語は分かち書きせず文字 bi-gram / tri-gram で索引する
+NGRAM_SIZES = (2, 3)
+
+# BM25 のパラメータ
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    NFKC 正規化・小文字化したテキストを文字 bi-gram / tri-gram に分割
+
+    空白をまたぐ n-gram は作らない。1文字だけの語はそのまま1トークンにする。
+    """
+    grams = []
+    for word in normalize_query_text(text).lower().split(" "):
+        if len(word) == 1:
+            grams.append(word)
+            continue
+        for n in NGRAM_SIZES:
+            grams.extend(word[i:i + n] for i in range(len(word) - n + 1))
+    return grams
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[np.ndarray],
+    limit: int,
+    rrf_k: int = 60
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数の順位リストを Reciprocal Rank Fusion で統合
+
+    各リストで順位 r（1始まり）の候補に 1 / (rrf_k + r) を加算し、合計の降順に並べる。
+    スコアの尺度が異なる検索（コサイン類似度と BM25）を正規化なしで統合できる。
+
+    Returns:
+        (scores, indices): RRF スコア降順、最大 limit 件
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, idx in enumerate(ranking, start=1):
+            idx = int(idx)
+            if idx >= 0:
+                fused[idx] = fused.get(idx, 0.0) + 1.0 / (rrf_k + rank)
+    if not fused:
+        return np.array([], dtype=np.float32), np.array([], dtype=np.int64)
+    indices = np.fromiter(fused.keys(), dtype=np.int64, count=len(fused))
+    scores = np.fromiter(fused.values(), dtype=np.float64, count=len(fused))
+    # 同点は位置の昇順（安定ソート）
+    order = np.lexsort((indices, -scores))[:limit]
+    return scores[order].astype(np.float32), indices[order]
+
+
+class BM25Index:
+    """
+    文字 n-gram の BM25 転置索引
+
+    文書ごとの (語ID, 出現数) を CSR 形式（doc_ptr / term_ids / tfs）で保持し、末尾への追加と
+    位置の詰め直しを配列の連結・抽出で行う。検索用の語ごとのポスティングリストは
+    初回検索時に語IDの安定ソートで構築する（更新のたびに破棄）。
+    """
+
+    def __init__(self):
+        self.terms: List[str] = []
+        self._vocab: Dict[str, int] = {}
+        self.doc_ptr = np.zeros(1, dtype=np.int64)
+        self.term_ids = np.empty(0, dtype=np.int32)
+        self.tfs = np.empty(0, dtype=np.int32)
+        self._postings: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self._doc_norm: Optional[np.ndarray] = None
+
+    @property
+    def size(self) -> int:
+        return len(self.doc_ptr) - 1
+
+    @classmethod
+    def from_texts(cls, texts: Sequence[str]) -> "BM25Index":
+        index = cls()
+        index.append(texts)
+        return index
+
+    def append(self, texts: Sequence[str]) -> None:
+        """末尾に文書を追加"""
+        term_ids: List[int] = []
+        tfs: List[int] = []
+        lengths = np.zeros(len(texts), dtype=np.int64)
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text or ""))
+            for gram, count in counts.items():
+                term_id = self._vocab.get(gram)
+                if term_id is None:
+                    term_id = self._vocab[gram] = len(self.terms)
+                    self.terms.append(gram)
+                term_ids.append(term_id)
+                tfs.append(count)
+            lengths[i] = len(counts)
+        self.doc_ptr = np.concatenate([self.doc_ptr, self.doc_ptr[-1] + np.cumsum(lengths)])
+        self.term_ids = np.concatenate([self.term_ids, np.array(term_ids, dtype=np.int32)])
+        self.tfs = np.concatenate([self.tfs, np.array(tfs, dtype=np.int32)])
+        self._postings = None
+        self._doc_norm = None
+
+    def take(self, positions: np.ndarray) -> "BM25Index":
+        """指定位置の文書のみを残した新しい索引（語彙はそのまま共有）"""
+        index = BM25Index()
+        index.terms = list(self.terms)
+        index._vocab = dict(self._vocab)
+        starts, ends = self.doc_ptr[positions], self.doc_ptr[np.asarray(positions) + 1]
+        lengths = ends - starts
+        index.doc_ptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        entries = np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)]) if len(positions) else np.empty(0, dtype=np.int64)
+        index.term_ids = self.term_ids[entries.astype(np.int64)]
+        index.tfs = self.tfs[entries.astype(np.int64)]
+        return index
+
+    def _ensure_postings(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """語ごとのポスティングリスト（term_ptr, 文書位置, 出現数）と文書長の正規化項"""
+        if self._postings is None:
+            docs = np.repeat(np.arange(self.size, dtype=np.int64), np.diff(self.doc_ptr))
+            order = np.argsort(self.term_ids, kind="stable")
+            term_ptr = np.searchsorted(self.term_ids[order], np.arange(len(self.terms) + 1))
+            self._postings = (term_ptr, docs[order], self.tfs[order].astype(np.float32))
+
+            # 文書長 = トークン数
+            doc_len = np.zeros(self.size, dtype=np.float32)
+            np.add.at(doc_len, docs, self.tfs.astype(np.float32))
+            avgdl = float(doc_len.mean()) if self.size and doc_len.mean() > 0 else 1.0
+            self._doc_norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len / avgdl)
+        return self._postings
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        BM25 スコアの上位 k 件
+
+        Args:
+            query: クエリ文字列（文書と同じ n-gram に分割）
+            k: 件数
+            allowed: 対象にする位置（削除済み・フィルタ除外を除いたもの。None は全件）
+
+        Returns:
+            (scores, indices): スコア降順（一致する語が無い文書は含めない）
+        """
+        empty = (np.array([], dtype=np.float32), np.array([], dtype=np.int64))
+        if self.size == 0 or k <= 0:
+            return empty
+        term_ptr, post_docs, post_tfs = self._ensure_postings()
+        query_terms = [self._vocab[g] for g in set(tokenize(query)) if g in self._vocab]
+        if not query_terms:
+            return empty
+
+        n = self.size
+        scores = np.zeros(n, dtype=np.float32)
+        for term_id in query_terms:
+            start, end = term_ptr[term_id], term_ptr[term_id + 1]
+            docs, tf = post_docs[start:end], post_tfs[start:end]
+            df = end - start
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            # 1語の中で文書は重複しないため、そのまま加算できる
+            scores[docs] += idf * tf * (BM25_K1 + 1) / (tf + self._doc_norm[docs])
+
+        if allowed is not None:
+            mask = np.zeros(n, dtype=bool)
+            mask[allowed[allowed < n]] = True
+            scores[~mask] = 0.0
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            top = np.argpartition(-scores[candidates], k - 1)[:k]
+            candidates = candidates[top]
+        order = np.lexsort((candidates, -scores[candidates]))
+        return scores[candidates[order]], candidates[order].astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = self.doc_ptr.nbytes + self.term_ids.nbytes + self.tfs.nbytes
+        return arrays + sum(len(t.encode("utf-8")) for t in self.terms)
+
+    def save(self, path: str) -> None:
+        """npz（pickle なし）として保存"""
+        with open(path, 'wb') as f:
+            np.savez(
+                f,
+                terms=np.array(self.terms, dtype=str),
+                doc_ptr=self.doc_ptr,
+                term_ids=self.term_ids,
+                tfs=self.tfs
+            )
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        index = cls()
+        with np.load(path) as data:
+            index.terms = [str(t) for t in data["terms"]]
+            index.doc_ptr = data["doc_ptr"].astype(np.int64)
+            index.term_ids = data["term_ids"].astype(np.int32)
+            index.tfs = data["tfs"].astype(np.int32)
+        index._vocab = {t: i for i, t in enumerate(index.terms)}
+        return index
@@ -0,0 +1,236 @@
+"""
+列指向の型付きメタデータストア（フィルタ用の属性索引）
+"""
+import re
+import logging
+import unicodedata
+import numpy as np
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 辞書エンコードするカテゴリ属性（値は取り込み時の文字列のまま）
+CATEGORICAL_FIELDS = ("listed", "type", "deployment", "employees_band", "man_month_jpy")
+
+# (属性, 演算子, 値)。演算子は eq / in / range
+Condition = Tuple[str, str, Any]
+
+# 範囲値の欠損（下限なし / 上限なし / 解析不能）
+MISSING = -1
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+
+
+def _parse_range(value: Any, scale: Callable[[str, List[float]], float]) -> Tuple[int, int]:
+    """「200-300」「300程度」「1000以上」などの表記を (min, max) の整数に解析（欠損は MISSING）"""
+    text = unicodedata.normalize("NFKC", str(value)).replace(",", "").strip()
+    numbers = [float(n) for n in _NUMBER_RE.findall(text)]
+    if not numbers:
+        return MISSING, MISSING
+    factor = scale(text, numbers)
+    values = [int(round(n * factor)) for n in numbers[:2]]
+
+    if len(values) == 2:
+        return min(values), max(values)
+    v = values[0]
+    if "以上" in text or "超" in text or text.endswith(("+", "~", "〜")):
+        return v, MISSING
+    if "以下" in text or "未満" in text or text.startswith(("~", "〜")):
+        return MISSING, v
+    # 「300程度」「500近辺」など単一値は幅なしの範囲
+    return v, v
+
+
+def _man_month_scale(text: str, numbers: List[float]) -> float:
+    if "万" in text:
+        return 10_000
+    if "円" in text:
+        return 1
+    # 単位なしの小さな値は万円表記とみなす（例: "200-300"）
+    return 10_000 if max(numbers) < 10_000 else 1
+
+
+def parse_man_month_jpy(value: Any) -> Tuple[int, int]:
+    """人月単価の表記を円単位の (min, max) に解析"""
+    return _parse_range(value, _man_month_scale)
+
+
+def parse_employees_band(value: Any) -> Tuple[int, int]:
+    """従業員数帯（例: "51-200", "1000名以上"）を (min, max) に解析"""
+    return _parse_range(value, lambda text, numbers: 1)
+
+
+# 取り込み時に数値範囲へ解析する属性
+RANGE_PARSERS: Dict[str, Callable[[Any], Tuple[int, int]]] = {
+    "man_month_jpy": parse_man_month_jpy,
+    "employees_band": parse_employees_band,
+}
+
+
+def filter_conditions(filters: Optional[Dict[str, Any]]) -> Tuple[Condition, ...]:
+    """
+    リクエストの filters を検索に押し下げる条件に変換
+
+    - 文字列などのスカラー: 等価（例: {"listed": "上場"}）
+    - リスト: IN（例: {"type": ["SaaS", "スクラッチ"]}）
+    - {"min", "max"}: 範囲の重なり（man_month_jpy は円、employees_band は人数）
+
+    従来どおり未知のキーと偽値の条件は無視する。
+    """
+    if not filters:
+        return ()
+    conditions = []
+    for field in CATEGORICAL_FIELDS:
+        value = filters.get(field)
+        if not value:
+            continue
+        if isinstance(value, dict):
+            if field not in RANGE_PARSERS:
+                raise ValueError(f"Range filter is not supported for '{field}'")
+            bounds = tuple(None if value.get(key) is None else int(value[key]) for key in ("min", "max"))
+            conditions.append((field, "range", bounds))
+        elif isinstance(value, (list, tuple, set)):
+            conditions.append((field, "in", tuple(sorted(str(v) for v in value))))
+        else:
+            conditions.append((field, "eq", str(value)))
+    return tuple(conditions)
+
+
+class MetaStore:
+    """
+    フィルタ対象属性の列指向ストア
+
+    カテゴリ属性は値の辞書＋int32 のコード列（-1 は値なし）、範囲属性は int64 の min/max 列で保持し、
+    値ごとのポスティングリスト（該当位置の配列）を遅延構築する。等価・IN・範囲条件をベクトル演算で評価する。
+    """
+
+    def __init__(self):
+        self.size = 0
+        self.categories: Dict[str, List[str]] = {field: [] for field in CATEGORICAL_FIELDS}
+        self.codes: Dict[str, np.ndarray] = {field: np.empty(0, dtype=np.int32) for field in CATEGORICAL_FIELDS}
+        self.ranges: Dict[str, Tuple[np.ndarray, np.ndarray]] = {
+            field: (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)) for field in RANGE_PARSERS
+        }
+        self._lookup: Dict[str, Dict[str, int]] = {field: {} for field in CATEGORICAL_FIELDS}
+        self._postings: Dict[str, List[np.ndarray]] = {}
+
+    @classmethod
+    def from_records(cls, records: Sequence[Dict[str, Any]]) -> "MetaStore":
+        """メタデータのレコード列から構築（範囲属性はここで数値に解析）"""
+        store = cls()
+        store.append(records)
+        return store
+
+    def append(self, records: Sequence[Dict[str, Any]]) -> None:
+        """末尾にレコードを追加"""
+        n = len(records)
+        for field in CATEGORICAL_FIELDS:
+            lookup = self._lookup[field]
+            categories = self.categories[field]
+            codes = np.full(n, -1, dtype=np.int32)
+            for i, record in enumerate(records):
+                value = record.get(field)
+                if value is None:
+                    continue
+                value = str(value)
+                code = lookup.get(value)
+                if code is None:
+                    code = lookup[value] = len(categories)
+                    categories.append(value)
+                codes[i] = code
+            self.codes[field] = np.concatenate([self.codes[field], codes])
+
+        for field, parser in RANGE_PARSERS.items():
+            parsed = np.array(
+                [parser(r[field]) if r.get(field) is not None else (MISSING, MISSING) for r in records],
+                dtype=np.int64
+            ).reshape(n, 2)
+            lows, highs = self.ranges[field]
+            self.ranges[field] = (np.concatenate([lows, parsed[:, 0]]), np.concatenate([highs, parsed[:, 1]]))
+
+        self.size += n
+        self._postings = {}
+
+    def take(self, positions: np.ndarray) -> "MetaStore":
+        """指定位置のみを残した新しいストア（辞書はそのまま共有）"""
+        store = MetaStore()
+        store.size = len(positions)
+        store.categories = {field: list(values) for field, values in self.categories.items()}
+        store._lookup = {field: dict(lookup) for field, lookup in self._lookup.items()}
+        store.codes = {field: codes[positions] for field, codes in self.codes.items()}
+        store.ranges = {field: (lows[positions], highs[positions]) for field, (lows, highs) in self.ranges.items()}
+        return store
+
+    def postings(self, field: str, value: str) -> np.ndarray:
+        """field == value の位置（昇順）"""
+        code = self._lookup[field].get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        if field not in self._postings:
+            # コードで安定ソートし、コードごとの区間をポスティングリストにする
+            codes = self.codes[field]
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(self.categories[field]) + 1))
+            self._postings[field] = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.categories[field]))]
+        return self._postings[field][code]
+
+    def mask(self, conditions: Sequence[Condition], live: Optional[np.ndarray] = None) -> np.ndarray:
+        """全条件を満たす位置の bool マスク"""
+        mask = np.ones(self.size, dtype=bool) if live is None else live[:self.size].copy()
+        for field, op, value in conditions:
+            if op == "range":
+                mask &= self._range_mask(field, *value)
+                continue
+            values = (value,) if op == "eq" else value
+            matched = np.zeros(self.size, dtype=bool)
+            for v in values:
+                matched[self.postings(field, v)] = True
+            mask &= matched
+        return mask
+
+    def _range_mask(self, field: str, low: Optional[int], high: Optional[int]) -> np.ndarray:
+        """[low, high] と重なる範囲を持つ位置（値なしは除外、片側欠損は開区間扱い）"""
+        lows, highs = self.ranges[field]
+        matched = (lows != MISSING) | (highs != MISSING)
+        if low is not None:
+            matched &= (highs == MISSING) | (highs >= low)
+        if high is not None:
+            matched &= (lows == MISSING) | (lows <= high)
+        return matched
+
+    def allowed(self, conditions: Sequence[Condition], live: Optional[np.ndarray] = None) -> np.ndarray:
+        """全条件を満たす位置の一覧（昇順）"""
+        return np.flatnonzero(self.mask(conditions, live)).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        """列データのおおよそのメモリ使用量"""
+        arrays = sum(codes.nbytes for codes in self.codes.values())
+        arrays += sum(lows.nbytes + highs.nbytes for lows, highs in self.ranges.values())
+        return arrays + sum(len(v.encode("utf-8")) for values in self.categories.values() for v in values)
+
+    def save(self, path: str) -> None:
+        """npz（pickle なし）として保存"""
+        arrays: Dict[str, np.ndarray] = {"size": np.array([self.size], dtype=np.int64)}
+        for field in CATEGORICAL_FIELDS:
+            arrays[f"codes__{field}"] = self.codes[field]
+            arrays[f"categories__{field}"] = np.array(self.categories[field], dtype=str)
+        for field, (lows, highs) in self.ranges.items():
+            arrays[f"min__{field}"] = lows
+            arrays[f"max__{field}"] = highs
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: str) -> "MetaStore":
+        """save で保存したストアを読み込み（メタデータ本体のデコード不要）"""
+        store = cls()
+        with np.load(path) as data:
+            store.size = int(data["size"][0])
+            for field in CATEGORICAL_FIELDS:
+                store.codes[field] = data[f"codes__{field}"].astype(np.int32)
+                store.categories[field] = [str(v) for v in data[f"categories__{field}"]]
+                store._lookup[field] = {v: i for i, v in enumerate(store.categories[field])}
+            for field in RANGE_PARSERS:
+                store.ranges[field] = (data[f"min__{field}"].astype(np.int64), data[f"max__{field}"].astype(np.int64))
+        return store
@@ -0,0 +1,103 @@
+"""
+クエリ埋め込みのマイクロバッチ化（同時到着クエリを1回のリモート呼び出しにまとめる）
+"""
+import asyncio
+import logging
+import numpy as np
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.utils.telemetry import call_with_timings, current_timings, merge_timings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBatcher:
+    """短い時間窓に到着したクエリを集約して一括埋め込みし、結果を各リクエストへ返す"""
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], np.ndarray],
+        window_ms: float,
+        max_batch_size: int,
+        executor: Optional[Executor] = None
+    ):
+        self.embed_fn = embed_fn
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.executor = executor
+        self.batches = 0
+        self.items = 0
+        self.remote_texts = 0
+        self.max_observed = 0
+        # (テキスト, 結果の Future, 登録したリクエストの段階別内訳)
+        self._pending: List[Tuple[str, asyncio.Future, Optional[Dict[str, float]]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    async def submit(self, text: str) -> np.ndarray:
+        """クエリを登録し、バッチ処理後の埋め込みベクトルを待つ"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # イベントループが変わった場合（テスト等）は状態をリセット
+            self._loop = loop
+            self._pending = []
+            self._timer = None
+
+        future = loop.create_future()
+        self._pending.append((text, future, current_timings()))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        items, self._pending = self._pending, []
+        self._loop.create_task(self._run(items))
+
+    async def _run(self, items: List[Tuple[str, asyncio.Future, Optional[Dict[str, float]]]]) -> None:
+        # 同一テキストは1回だけ送る
+        unique_texts = list(dict.fromkeys(text for text, _, _ in items))
+        self.batches += 1
+        self.items += len(items)
+        self.remote_texts += len(unique_texts)
+        self.max_observed = max(self.max_observed, len(items))
+
+        # リモート呼び出し内の段階（embed_remote 等）は相乗りした全リクエストの内訳に入れる
+        batch_timings: Dict[str, float] = {}
+        try:
+            loop = asyncio.get_running_loop()
+            matrix = await loop.run_in_executor(self.executor, call_with_timings, batch_timings, self.embed_fn, unique_texts)
+        except Exception as e:
+            logger.error(f"Batched query embedding failed for {len(unique_texts)} texts: {e}")
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            for timings in {id(t): t for _, _, t in items if t is not None}.values():
+                merge_timings(timings, batch_timings)
+
+        rows = {text: matrix[i] for i, text in enumerate(unique_texts)}
+        for text, future, _ in items:
+            if not future.done():
+                future.set_result(rows[text])
+
+        logger.debug(f"Embedded {len(unique_texts)} queries in one call for {len(items)} requests")
+
+    def stats(self) -> Dict[str, Any]:
+        """バッチ化の統計を取得"""
+        return {
+            "batches": self.batches,
+            "requests": self.items,
+            "remote_texts": self.remote_texts,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_observed,
+        }
@@ -0,0 +1,119 @@
+"""
+クライアント側レート制限（トークンバケット）とリトライ判定
+"""
+import time
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+# スロットリング / 一時的なサーバ側エラーとして扱うエラーコード
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "ServiceUnavailableException",
+    "ModelNotReadyException",
+    "InternalServerException",
+    "ServiceQuotaExceededException",
+    "RequestTimeout",
+    "RequestTimeoutException",
+}
+THROTTLING_ERROR_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+
+
+class TokenBucket:
+    """スレッドセーフなトークンバケット（rate: 毎秒補充量, capacity: 最大バースト）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float = 1.0) -> float:
+        """amount 分のトークンを取得するまで待機し、待った秒数を返す"""
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                shortfall = (amount - self._tokens) / self.rate
+            time.sleep(shortfall)
+            waited += shortfall
+
+
+class RateLimiter:
+    """リクエスト数/秒 と トークン数/分 の2本のバケットで送信を制御"""
+
+    def __init__(self, requests_per_second: float = 0, tokens_per_minute: float = 0):
+        self.request_bucket = TokenBucket(requests_per_second, max(1.0, requests_per_second)) if requests_per_second > 0 else None
+        self.token_bucket = TokenBucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute > 0 else None
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self, texts: List[str]) -> None:
+        """1リクエスト分（テキスト群の推定トークン数込み）の送信枠を取得"""
+        waited = 0.0
+        if self.request_bucket is not None:
+            waited += self.request_bucket.acquire(1)
+        if self.token_bucket is not None:
+            waited += self.token_bucket.acquire(sum(estimate_tokens(t) for t in texts))
+        if waited > 0:
+            with self._lock:
+                self.waits += 1
+                self.wait_seconds += waited
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate_limited_requests": self.waits,
+            "rate_limit_wait_seconds": round(self.wait_seconds, 3),
+        }
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数の概算（非ASCII文字は1文字1トークン、ASCIIは4文字1トークン）"""
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return max(1, non_ascii + (len(text) - non_ascii) // 4)
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """botocore ClientError からエラーコードを取り出す"""
+    response = getattr(error, "response", None)
+    if isinstance(response, dict):
+        return response.get("Error", {}).get("Code")
+    return None
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """スロットリング・5xx・接続系の一時的エラーか判定"""
+    code = error_code(error)
+    if code in RETRYABLE_ERROR_CODES:
+        return True
+    response = getattr(error, "response", None)
+    status = None
+    if isinstance(response, dict):
+        status = response.get("ResponseMetadata", {}).get("HTTPStatusCode")
+    else:
+        # Cohere SDK の ApiError 等は status_code 属性を持つ
+        status = getattr(error, "status_code", None)
+    if isinstance(status, int) and (status == 429 or status >= 500):
+        return True
+    # 接続断・タイムアウト（botocoreを直接importせず名前で判定）
+    return type(error).__name__ in {
+        "EndpointConnectionError", "ConnectionClosedError", "ReadTimeoutError",
+        "ConnectTimeoutError", "ConnectionError",
+    }
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """指数バックオフ＋フルジッタの待機秒数（attempt は0始まり）"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
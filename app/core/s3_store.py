@@ -3,10 +3,11 @@ S3ストレージ管理
 """
 import os
 import logging
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 from pathlib import Path
 import boto3
 from botocore.exceptions import ClientError, NoCredentialsError
+from app.utils.telemetry import timed
 
 logger = logging.getLogger(__name__)
 
@@ -31,7 +32,14 @@ class S3Store:
                 logger.error(f"Failed to initialize S3 client: {e}")
                 self.client = None
     
-    def upload_index(self, index_name: str, local_index_path: str, local_meta_path: str) -> bool:
+    @timed("s3_upload")
+    def upload_index(
+        self,
+        index_name: str,
+        local_index_path: str,
+        local_meta_path: str,
+        extra_paths: Optional[List[str]] = None
+    ) -> bool:
         """
         インデックスとメタデータをS3にアップロード
         
@@ -39,6 +47,7 @@ class S3Store:
             index_name: インデックス名
             local_index_path: ローカルインデックスファイルパス
             local_meta_path: ローカルメタデータファイルパス
+            extra_paths: 同じプレフィックスに置く付随ファイル（index_info.json 等）
         
         Returns:
             アップロード成功フラグ
@@ -66,6 +75,12 @@ class S3Store:
             self.client.upload_file(local_meta_path, self.bucket_name, s3_meta_key)
             logger.info(f"[S3] Uploaded meta.json → s3://{self.bucket_name}/{s3_meta_key}")
             
+            # 付随ファイルアップロード
+            for path in extra_paths or []:
+                s3_key = f"{self.prefix}/{index_name}/{os.path.basename(path)}"
+                self.client.upload_file(path, self.bucket_name, s3_key)
+                logger.info(f"[S3] Uploaded {os.path.basename(path)} → s3://{self.bucket_name}/{s3_key}")
+            
             saved_s3 = True
             
         except ClientError as e:
@@ -76,7 +91,14 @@ class S3Store:
         logger.info(f"[S3] Final saved_s3={saved_s3}")
         return saved_s3
     
-    def download_index(self, index_name: str, local_index_path: str, local_meta_path: str) -> bool:
+    @timed("s3_download")
+    def download_index(
+        self,
+        index_name: str,
+        local_index_path: str,
+        local_meta_path: str,
+        extra_filenames: Optional[List[str]] = None
+    ) -> bool:
         """
         インデックスとメタデータをS3からダウンロード
         
@@ -84,6 +106,7 @@ class S3Store:
             index_name: インデックス名
             local_index_path: ローカルインデックスファイルパス
             local_meta_path: ローカルメタデータファイルパス
+            extra_filenames: 付随ファイル名（存在しなければスキップ）
         
         Returns:
             ダウンロード成功フラグ
@@ -108,6 +131,18 @@ class S3Store:
             self.client.download_file(self.bucket_name, s3_meta_key, local_meta_path)
             logger.info(f"Downloaded metadata from s3://{self.bucket_name}/{s3_meta_key}")
             
+            # 付随ファイルダウンロード（旧形式のインデックスには存在しない）
+            local_dir = os.path.dirname(local_index_path)
+            for filename in extra_filenames or []:
+                s3_key = f"{self.prefix}/{index_name}/{filename}"
+                try:
+                    self.client.download_file(self.bucket_name, s3_key, os.path.join(local_dir, filename))
+                    logger.info(f"Downloaded {filename} from s3://{self.bucket_name}/{s3_key}")
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in ('404', 'NoSuchKey'):
+                        raise
+                    logger.info(f"Optional file {filename} not found in S3, skipping")
+            
             return True
             
         except ClientError as e:
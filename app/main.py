@@ -1,13 +1,19 @@
 """
 FastAPIメインアプリケーション
 """
+import time
 import logging
-from fastapi import FastAPI
-from fastapi.responses import ORJSONResponse
+from typing import Any, Optional
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from app.schemas import HealthResponse
 from app.routers import indexer, query, eval
 from app.config import settings
+from app.core.embed_cohere import embedding_stats
+from app.core.index_manager import get_index_registry
+from app.core.admission import AdmissionController, Overloaded, admission_stats, get_admin_admission, get_search_admission
+from app.utils import telemetry
 
 # ログ設定
 logging.basicConfig(
@@ -16,14 +22,79 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class TimedORJSONResponse(ORJSONResponse):
+    """レスポンスのシリアライズ時間を serialize 段階として記録する ORJSONResponse"""
+
+    def render(self, content: Any) -> bytes:
+        with telemetry.stage("serialize"):
+            return super().render(content)
+
+
 # FastAPIアプリケーション作成
 app = FastAPI(
     title="RAG Search API",
     description="Cohere + FAISS ベースのベンダー検索API",
     version="1.0.0",
-    default_response_class=ORJSONResponse
+    default_response_class=TimedORJSONResponse
 )
 
+# アドミッション制御のレーン（/health・/docs 等は対象外で常に即応答）
+SEARCH_PATHS = ("/search", "/api/v1/search", "/api/v1/query")
+ADMIN_PATH_PREFIXES = ("/api/v1/index", "/api/v1/eval")
+
+
+def admission_lane(path: str) -> Optional[AdmissionController]:
+    """パスに対応するレーン（対象外は None）"""
+    if path in SEARCH_PATHS or path.startswith("/api/v1/query/"):
+        return get_search_admission()
+    if path.startswith(ADMIN_PATH_PREFIXES):
+        return get_admin_admission()
+    return None
+
+
+# CORS より内側で登録し、503 にも CORS ヘッダーが付くようにする
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    """同時実行数の上限を超えたリクエストを待たせ、待ち行列・待ち時間の上限を超えたら 503 で即座に返す"""
+    lane = admission_lane(request.url.path)
+    if lane is None or request.method == "OPTIONS":
+        return await call_next(request)
+    started = time.perf_counter()
+    try:
+        async with lane.slot():
+            telemetry.record("queue", time.perf_counter() - started)
+            return await call_next(request)
+    except Overloaded as e:
+        logger.warning(f"Rejected {request.url.path}: {e}")
+        return ORJSONResponse(
+            status_code=503,
+            content={"detail": f"Server is busy ({e.reason}). Please retry later."},
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+# アドミッション制御より外側（待ち時間も含めて計測）、CORS より内側
+@app.middleware("http")
+async def request_telemetry(request: Request, call_next):
+    """リクエスト全体の所要時間・件数を記録し、段階別の内訳を Server-Timing ヘッダーで返す"""
+    timings = telemetry.start_request()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        elapsed = time.perf_counter() - started
+        if settings.METRICS_ENABLED:
+            # パスパラメータを持つルートは無いためパスをそのままラベルにし、未定義のパスはまとめて種類を抑える
+            path = request.url.path if request.scope.get("route") is not None else "unmatched"
+            telemetry.REQUEST_SECONDS.observe(elapsed, request.method, path)
+            telemetry.REQUESTS.inc(request.method, path, str(status))
+    if settings.SERVER_TIMING_ENABLED:
+        response.headers["Server-Timing"] = telemetry.server_timing(timings, elapsed)
+    return response
+
 # CORS設定
 origins = [
     "https://main.d30qmyqyqcxjp3.amplifyapp.com",
@@ -44,6 +115,19 @@ app.include_router(indexer.router, prefix="/api/v1", tags=["index"])
 app.include_router(query.router, prefix="/api/v1", tags=["search"])
 app.include_router(eval.router, prefix="/api/v1", tags=["evaluation"])
 
+
+@app.on_event("startup")
+async def start_index_watcher():
+    """別プロセスが公開した版へ追従する監視を開始（INDEX_WATCH_INTERVAL > 0 の場合）"""
+    if settings.INDEX_WATCH_INTERVAL > 0:
+        get_index_registry().start_watcher(settings.INDEX_WATCH_INTERVAL)
+
+
+@app.on_event("shutdown")
+async def stop_index_watcher():
+    get_index_registry().stop_watcher()
+
+
 # デバッグ用: 登録されたルートを確認
 @app.get("/debug/routes")
 async def debug_routes():
@@ -59,7 +143,7 @@ async def debug_routes():
 
 # ルートレベルの検索エンドポイント（フロントエンド互換用）
 from app.schemas import QueryRequest, QueryResponse
-from app.routers.query import search_vendors
+from app.routers.query import search_vendors, get_response_cache
 
 @app.post("/search", response_model=QueryResponse)
 async def root_search(request: QueryRequest):
@@ -72,10 +156,29 @@ async def root_search(request: QueryRequest):
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
     """ヘルスチェックエンドポイント"""
+    response_cache = get_response_cache()
     return HealthResponse(
         status="healthy",
-        message="RAG Search API is running"
+        message="RAG Search API is running",
+        embedding=embedding_stats(),
+        index=get_index_registry().status(),
+        response_cache=response_cache.stats() if response_cache else None,
+        admission=admission_stats()
+    )
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus テキスト形式のメトリクス（段階別・リクエスト別のレイテンシ、アドミッション・キャッシュの統計）"""
+    if not settings.METRICS_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    response_cache = get_response_cache()
+    body = (
+        telemetry.get_metrics_registry().render()
+        + telemetry.render_stats("rag_admission", admission_stats(), label="lane")
+        + telemetry.render_stats("rag_response_cache", response_cache.stats() if response_cache else None)
     )
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
 
 
 @app.get("/")
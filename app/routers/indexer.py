@@ -2,20 +2,53 @@
 インデックス作成エンドポイント
 """
 import logging
+from typing import Optional, Tuple
 from fastapi import APIRouter, HTTPException, Depends
-from app.schemas import IndexRequest, IndexResponse
+from fastapi.concurrency import run_in_threadpool
+from app.schemas import IndexRequest, IndexResponse, UpsertRequest, DeleteRequest, UpdateIndexResponse, ReloadResponse
 from app.core.ingest import load_vendors_data, process_vendors_data
 from app.core.embed_cohere import embed_texts
 from app.core.faiss_store import FAISSStore, create_store_paths
+from app.core.index_manager import get_index_manager, get_index_registry, validate_index_name
 from app.core.s3_store import S3Store
 from app.config import settings
 from app.deps import get_s3_client, get_s3_bucket_name, get_s3_prefix
+from app.routers.query import get_store
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 
+def upload_store_to_s3(index_name: str, store: FAISSStore) -> bool:
+    """保存済みのインデックス一式をS3へアップロード"""
+    s3_client = get_s3_client()
+    s3_bucket = get_s3_bucket_name()
+    s3_prefix = get_s3_prefix()
+    
+    if not (s3_client and s3_bucket):
+        logger.warning("S3 not configured, skipping upload")
+        return False
+    
+    s3_store = S3Store(s3_bucket, s3_prefix)
+    saved_s3 = s3_store.upload_index(index_name, store.index_path, store.meta_path, extra_paths=store.companion_paths())
+    if saved_s3:
+        logger.info(f"Uploaded index to S3: {s3_bucket}/{s3_prefix}/{index_name}")
+    else:
+        logger.warning("Failed to upload index to S3")
+    return saved_s3
+
+
+def _persist_update(index_name: str, store: FAISSStore, save_local: bool, save_to_s3: bool) -> Tuple[bool, bool]:
+    """差分更新後のストアを新しい版として公開（S3 は公開したファイルをアップロード）"""
+    saved_local = False
+    if save_local or save_to_s3:
+        get_index_registry().adopt(index_name, store)
+        saved_local = True
+    saved_s3 = upload_store_to_s3(index_name, store) if save_to_s3 else False
+    return saved_local, saved_s3
+
+
 @router.post("/index", response_model=IndexResponse)
 async def create_index(request: IndexRequest):
     """
@@ -30,6 +63,10 @@ async def create_index(request: IndexRequest):
     try:
         # パラメータ設定
         index_name = request.index_name or settings.INDEX_NAME
+        try:
+            validate_index_name(index_name)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         json_path = request.json_path or settings.JSON_PATH
         save_to_s3 = request.save_to_s3
         
@@ -47,35 +84,28 @@ async def create_index(request: IndexRequest):
         
         # 3. 埋め込み生成
         logger.info(f"Generating embeddings for {len(texts)} texts")
-        embeddings = embed_texts(texts, input_type="search_document")
+        # ブロッキングな埋め込みはスレッドで実行し、/health などを塞がない
+        embeddings = await run_in_threadpool(embed_texts, texts, input_type="search_document")
         
         # 4. FAISSインデックス構築
         index_path, meta_path = create_store_paths(settings.VECTOR_DIR, index_name)
         store = FAISSStore(index_path, meta_path)
-        store.build_index(embeddings)
+        try:
+            store.build_index(embeddings, index_type=request.index_type)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
         store.add_metadata(metadata)
+        # 語彙一致検索用の転置索引（埋め込みと同じテキスト）
+        store.build_lexical(texts)
         
-        # 5. ローカル保存
-        store.save()
+        # 5. ローカル保存（新しい版として公開し、無停止で切り替え）
+        # 保存・S3 転送はブロッキングなのでスレッドで実行し、検索リクエストを塞がない
+        version = await run_in_threadpool(get_index_registry().adopt, index_name, store)
         saved_local = True
-        logger.info(f"Saved index locally: {index_path}")
+        logger.info(f"Saved index locally: {store.index_path} (version {version})")
         
         # 6. S3保存（オプション）
-        saved_s3 = False
-        if save_to_s3:
-            s3_client = get_s3_client()
-            s3_bucket = get_s3_bucket_name()
-            s3_prefix = get_s3_prefix()
-            
-            if s3_client and s3_bucket:
-                s3_store = S3Store(s3_bucket, s3_prefix)
-                saved_s3 = s3_store.upload_index(index_name, index_path, meta_path)
-                if saved_s3:
-                    logger.info(f"Uploaded index to S3: {s3_bucket}/{s3_prefix}/{index_name}")
-                else:
-                    logger.warning("Failed to upload index to S3")
-            else:
-                logger.warning("S3 not configured, skipping upload")
+        saved_s3 = await run_in_threadpool(upload_store_to_s3, index_name, store) if save_to_s3 else False
         
         return IndexResponse(
             indexed=len(texts),
@@ -90,3 +120,100 @@ async def create_index(request: IndexRequest):
         logger.error(f"Index creation failed: {e}")
         raise HTTPException(status_code=500, detail=f"Index creation failed: {str(e)}")
 
+
+@router.post("/index/upsert", response_model=UpdateIndexResponse)
+async def upsert_vendors(request: UpsertRequest):
+    """
+    稼働中のインデックスにベンダーを追加・更新（全体の再構築なし）
+    
+    埋め込みは対象ベンダー分のみ生成し、vendor_id 単位で差し替える。
+    """
+    try:
+        index_name = request.index_name or settings.INDEX_NAME
+        store = await get_store(index_name)
+        
+        texts, metadata = process_vendors_data(request.vendors)
+        if not texts:
+            raise HTTPException(status_code=400, detail="No valid texts generated")
+        if any(not meta.get("vendor_id") for meta in metadata):
+            raise HTTPException(status_code=400, detail="vendor_id is required for every vendor")
+        
+        logger.info(f"Upserting {len(texts)} vendors")
+        embeddings = await run_in_threadpool(embed_texts, texts, input_type="search_document")
+        try:
+            counts = store.upsert([meta["vendor_id"] for meta in metadata], embeddings, metadata, texts=texts)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        
+        saved_local, saved_s3 = await run_in_threadpool(
+            _persist_update, index_name, store, request.save_local, request.save_to_s3
+        )
+        
+        return UpdateIndexResponse(
+            inserted=counts["inserted"],
+            updated=counts["updated"],
+            ntotal=store.live_count,
+            tombstones=store.tombstones,
+            saved_local=saved_local,
+            saved_s3=saved_s3
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Upsert failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Upsert failed: {str(e)}")
+
+
+@router.post("/index/delete", response_model=UpdateIndexResponse)
+async def delete_vendors(request: DeleteRequest):
+    """稼働中のインデックスからベンダーを削除（検索からは即時に除外、物理削除はバックグラウンド）"""
+    try:
+        index_name = request.index_name or settings.INDEX_NAME
+        store = await get_store(index_name)
+        
+        deleted = store.delete(request.vendor_ids)
+        if deleted:
+            saved_local, saved_s3 = await run_in_threadpool(
+                _persist_update, index_name, store, request.save_local, request.save_to_s3
+            )
+        else:
+            saved_local, saved_s3 = False, False
+        
+        return UpdateIndexResponse(
+            deleted=deleted,
+            ntotal=store.live_count,
+            tombstones=store.tombstones,
+            saved_local=saved_local,
+            saved_s3=saved_s3
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Delete failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Delete failed: {str(e)}")
+
+
+@router.post("/index/reload", response_model=ReloadResponse)
+async def reload_index(index_name: Optional[str] = None):
+    """
+    公開中の版（CURRENT）を読み込み直して切り替える
+
+    別プロセス（create_index.py など）が公開した版を、再起動せずに反映する。
+    実行中の検索は旧版で完了する。
+    """
+    try:
+        manager = get_index_manager(index_name)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        reloaded = await run_in_threadpool(manager.reload)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Index not found. Please create index first.")
+    except Exception as e:
+        logger.error(f"Index reload failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Index reload failed: {str(e)}")
+    
+    status = manager.status()
+    return ReloadResponse(reloaded=reloaded, version=status["version"], ntotal=status["ntotal"])
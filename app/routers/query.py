@@ -3,60 +3,162 @@
 """
 import logging
 import numpy as np
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 from fastapi import APIRouter, HTTPException
-from app.schemas import QueryRequest, QueryResponse, SearchResult
-from app.core.embed_cohere import embed_query
-from app.core.faiss_store import FAISSStore, create_store_paths
+from fastapi.concurrency import run_in_threadpool
+from app.schemas import QueryRequest, QueryResponse, SearchResult, BatchQueryRequest, BatchQueryResponse
+from app.core.embed_cohere import embed_query_async, embed_queries_async
+from app.core.faiss_store import FAISSStore
+from app.core.index_manager import StoreHandle, get_index_registry
+from app.core.lexical import reciprocal_rank_fusion
+from app.core.meta_store import filter_conditions
 from app.utils.mmr import apply_mmr_filtering
+from app.utils.cache import LRUCache
+from app.utils.text import normalize_query_text
+from app.utils.telemetry import stage
 from app.config import settings
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-# グローバルストア（シングルトン）
-_store: Optional[FAISSStore] = None
-
-
-def get_store() -> FAISSStore:
-    """FAISSストアを取得（シングルトン）"""
-    global _store
-    if _store is None:
-        index_path, meta_path = create_store_paths(settings.VECTOR_DIR, settings.INDEX_NAME)
-        _store = FAISSStore(index_path, meta_path)
-        try:
-            _store.load()
-            logger.info("Loaded FAISS store")
-        except FileNotFoundError:
-            logger.error(f"Index not found: {index_path}")
-            raise HTTPException(status_code=404, detail="Index not found. Please create index first.")
-        except Exception as e:
-            logger.error(f"Failed to load store: {e}")
-            raise HTTPException(status_code=500, detail=f"Failed to load index: {str(e)}")
-    return _store
-
-
-def apply_filters(results: List[SearchResult], filters: Optional[Dict[str, Any]]) -> List[SearchResult]:
-    """メタデータフィルタを適用"""
-    if not filters:
-        return results
+# 検索レスポンスキャッシュ（シングルトン）
+_response_cache: Optional[LRUCache] = None
+
+
+async def get_store_handle(index_name: Optional[str] = None) -> StoreHandle:
+    """
+    検索用のストアハンドルを取得（未指定時は INDEX_NAME。未読み込みなら VECTOR_DIR / S3 から読み込み）
+
+    `with await get_store_handle() as store:` の間は取得時の版が保持され、
+    途中で新しい版に切り替わってもそのリクエストは旧版で完了する。
+    常駐中ならその場で取得し、初回の読み込み（mmap・メタデータ・S3 取得）はスレッドで実行して
+    イベントループ（/health や他の検索の受け付け）を塞がない。
+    """
+    name = index_name or settings.INDEX_NAME
+    registry = get_index_registry()
+    try:
+        handle = registry.try_acquire(name)
+        if handle is None:
+            handle = await run_in_threadpool(registry.acquire, name)
+        return handle
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except FileNotFoundError:
+        logger.error(f"Index not found: {name}")
+        raise HTTPException(status_code=404, detail="Index not found. Please create index first.")
+    except Exception as e:
+        logger.error(f"Failed to load store: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to load index: {str(e)}")
+
+
+async def get_store(index_name: Optional[str] = None) -> FAISSStore:
+    """公開中のFAISSストアを取得（更新系の処理用。版の保持はしない）"""
+    with await get_store_handle(index_name) as store:
+        return store
+
+
+def get_response_cache() -> Optional[LRUCache]:
+    """検索レスポンスのキャッシュを取得（無効時はNone）"""
+    global _response_cache
+    if _response_cache is None and settings.RESPONSE_CACHE_ENABLED:
+        _response_cache = LRUCache(
+            settings.RESPONSE_CACHE_MAX_ENTRIES,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_SECONDS
+        )
+    return _response_cache
+
+
+def response_cache_key(request: QueryRequest, handle: StoreHandle) -> Tuple:
+    """
+    レスポンスキャッシュのキー
+
+    クエリは表記揺れを正規化し、フィルタは押し下げ用の条件（順序・偽値・未知キーを正規化済み）に変換する。
+    公開中の版と差分更新のたびに増える store.version を含むため、再構築・upsert/delete 後は別キーになる。
+    """
+    return (
+        request.index_name or settings.INDEX_NAME,
+        request.mode,
+        handle.version,
+        handle.store.version,
+        normalize_query_text(request.q),
+        request.k,
+        request.threshold,
+        request.mmr_lambda,
+        filter_conditions(request.filters),
+        request.nprobe,
+        request.ef_search,
+    )
+
+
+def validate_filters(filters: Optional[Dict[str, Any]]) -> None:
+    """押し下げできないフィルタ（範囲指定が不正など）を400で返す"""
+    try:
+        filter_conditions(filters)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid filters: {str(e)}")
+
+
+def build_search_results(store: FAISSStore, scores: np.ndarray, indices: np.ndarray) -> List[SearchResult]:
+    """検索スコアとインデックスからメタデータ付きの検索結果を構築"""
+    metadata = store.get_metadata_by_indices(indices)
     
-    filtered_results = []
-    for result in results:
-        meta = result.meta
-        
-        # listed フィルタ
-        if filters.get("listed") and meta.get("listed") != filters["listed"]:
-            continue
-        
-        # type フィルタ
-        if filters.get("type") and meta.get("type") != filters["type"]:
-            continue
-        
-        filtered_results.append(result)
+    results = []
+    for i, (score, idx) in enumerate(zip(scores, indices)):
+        if i < len(metadata):
+            result = SearchResult(
+                vendor_id=metadata[i].get("vendor_id", ""),
+                name=metadata[i].get("name", ""),
+                score=float(score),
+                meta=metadata[i]
+            )
+            results.append(result)
+    return results
+
+
+def uses_lexical(store: FAISSStore, request: QueryRequest) -> bool:
+    """BM25 の順位を使う検索か（スコアは BM25 / RRF スコアで、コサイン類似度ではない）"""
+    return request.mode != "vector" and store.lexical is not None
+
+
+def search_candidates(
+    store: FAISSStore,
+    request: QueryRequest,
+    query_embedding: Optional[np.ndarray]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    検索方式（mode）に応じた候補の (scores, indices)
+
+    k 指定時は MMR 用に k * 2 件、threshold のみ指定時はベクトル側を閾値検索にする。
+    hybrid はベクトル検索と BM25 の順位を RRF で統合する（スコアは RRF スコア）。
+    埋め込みが無い場合は BM25 のみ、転置索引が無い場合はベクトル検索のみ。
+    """
+    n_candidates = request.k * 2 if request.k is not None else settings.RANGE_SEARCH_MAX_RESULTS
+    rankings = []
+    if query_embedding is not None:
+        search_params = {"nprobe": request.nprobe, "efSearch": request.ef_search}
+        if request.k is None:
+            # threshold のみ指定: 閾値以上を全件（上限 RANGE_SEARCH_MAX_RESULTS）
+            rankings.append(store.range_search(
+                query_embedding,
+                threshold=request.threshold,
+                search_params=search_params,
+                filters=request.filters
+            ))
+        else:
+            rankings.append(store.search(
+                query_embedding,
+                k=n_candidates,
+                threshold=request.threshold,
+                search_params=search_params,
+                filters=request.filters  # フィルタは検索に押し下げ
+            ))
+    if uses_lexical(store, request):
+        rankings.append(store.lexical_search(request.q, k=n_candidates, filters=request.filters))
     
-    return filtered_results
+    if len(rankings) == 1:
+        return rankings[0]
+    return reciprocal_rank_fusion([indices for _, indices in rankings], n_candidates, settings.RRF_K)
 
 
 @router.post("/query", response_model=QueryResponse)
@@ -65,63 +167,87 @@ async def search_vendors(request: QueryRequest):
     ベンダー検索を実行
     """
     try:
-        # ストア取得
-        store = get_store()
-        
-        # クエリ埋め込み
-        logger.info(f"Embedding query: {request.q[:50]}...")
-        query_embedding = embed_query(request.q)
-        
-        # FAISS検索
-        scores, indices = store.search(
-            query_embedding, 
-            k=request.k * 2,  # MMR用に多めに取得
-            threshold=request.threshold
-        )
-        
-        if len(scores) == 0:
-            return QueryResponse(results=[])
-        
-        # メタデータ取得
-        metadata = store.get_metadata_by_indices(indices)
+        # ストア取得（このリクエストの間は取得時の版を使う）
+        validate_filters(request.filters)
+        handle = await get_store_handle(request.index_name)
+        with handle as store:
+            # レスポンスキャッシュ（ヒット時は埋め込み・検索・MMR をすべて省略）
+            cache = get_response_cache()
+            cache_key = response_cache_key(request, handle) if cache is not None else None
+            if cache_key is not None:
+                with stage("cache"):
+                    cached = cache.get(cache_key)
+                if cached is not None:
+                    logger.info(f"Response cache hit: {request.q[:50]}")
+                    return cached
+            
+            if request.mode == "lexical" and store.lexical is None:
+                raise HTTPException(status_code=400, detail="Lexical index not built. Please recreate index.")
+            
+            # クエリ埋め込み（lexical は不要。hybrid は失敗時に語彙一致のみで応答）
+            query_embedding = None
+            if request.mode != "lexical":
+                logger.info(f"Embedding query: {request.q[:50]}...")
+                try:
+                    with stage("embed"):
+                        query_embedding = await embed_query_async(request.q)
+                except Exception as e:
+                    if request.mode != "hybrid" or store.lexical is None:
+                        raise
+                    logger.warning(f"Query embedding failed, falling back to lexical search: {e}")
+                    # 語彙一致のみの結果は hybrid のキーでキャッシュしない（復旧後も縮退した結果を返し続けるため）
+                    cache_key = None
+
+            # 検索（位置→メタデータの解決までをコンパクションの入れ替えと排他）
+            # MMR 時は候補の格納ベクトルも同じロック内でまとめて取り出す
+            use_mmr = request.mmr_lambda is not None
+            lexical_scores = uses_lexical(store, request)
+            with store.lock:
+                scores, indices = search_candidates(store, request, query_embedding)
+
+                if len(scores) == 0:
+                    response = QueryResponse(results=[])
+                    if cache_key is not None:
+                        cache.put(cache_key, response)
+                    return response
+
+                # 検索結果構築
+                with stage("metadata"):
+                    results = build_search_results(store, scores, indices)
+                    candidate_vectors = store.vectors(indices[:len(results)]) if use_mmr else None
         
-        # 検索結果構築
-        results = []
-        for i, (score, idx) in enumerate(zip(scores, indices)):
-            if i < len(metadata):
-                result = SearchResult(
-                    vendor_id=metadata[i].get("vendor_id", ""),
-                    name=metadata[i].get("name", ""),
-                    score=float(score),
-                    meta=metadata[i]
-                )
-                results.append(result)
+        k = request.k or len(results)
         
-        # MMR適用（オプション）
-        if request.mmr_lambda is not None and len(results) > 1:
+        # MMR適用（オプション）: 候補文書の埋め込み同士の類似度で多様化
+        if use_mmr and len(results) > 1:
             logger.info(f"Applying MMR with lambda={request.mmr_lambda}")
             
             candidate_scores = np.array([r.score for r in results])
+            if lexical_scores and candidate_scores.max() > 0:
+                # BM25 / RRF スコアは類似度と尺度が違うため、最大値を1に揃えてから多様性と比べる
+                # （転置索引の無い hybrid はベクトル検索のみでスコアはコサインのまま）
+                candidate_scores = candidate_scores / candidate_scores.max()
             candidate_indices = np.array([i for i in range(len(results))])
             
             reranked_scores, reranked_indices = apply_mmr_filtering(
                 query_embedding,
-                query_embedding.reshape(1, -1).repeat(len(results), axis=0),
+                candidate_vectors,
                 candidate_scores,
                 candidate_indices,
                 request.mmr_lambda,
-                request.k
+                k
             )
             
             reranked_results = [results[i] for i in reranked_indices]
-            results = reranked_results[:request.k]
+            results = reranked_results[:k]
         
-        # フィルタ適用
-        results = apply_filters(results, request.filters)
-        results = results[:request.k]
+        results = results[:k]
         
         logger.info(f"Search returned {len(results)} results")
-        return QueryResponse(results=results)
+        response = QueryResponse(results=results)
+        if cache_key is not None:
+            cache.put(cache_key, response)
+        return response
         
     except HTTPException:
         raise
@@ -137,4 +263,46 @@ async def search_alias(request: QueryRequest):
     /api/v1/search エイリアス (互換用)
     実体は /api/v1/query と同じ処理
     """
-    return await search_vendors(request)
\ No newline at end of file
+    return await search_vendors(request)
+
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+async def search_vendors_batch(request: BatchQueryRequest):
+    """
+    複数クエリを一括検索
+    
+    全クエリを1回のリモート呼び出しで埋め込み、1回の index.search で検索する。
+    """
+    try:
+        for item in request.queries:
+            validate_filters(item.filters or request.filters)
+
+        with await get_store_handle(request.index_name) as store:
+            # クエリ埋め込み（キャッシュミス分のみ一括）
+            texts = [item.q for item in request.queries]
+            logger.info(f"Embedding {len(texts)} batch queries")
+            with stage("embed"):
+                query_embeddings = await embed_queries_async(texts)
+
+            # FAISS一括検索（フィルタは検索に押し下げ、同じフィルタのクエリはまとめて検索）
+            ks = [item.k or request.k for item in request.queries]
+            thresholds = [item.threshold if item.threshold is not None else request.threshold for item in request.queries]
+            with store.lock:
+                hits = store.search_batch(
+                    query_embeddings,
+                    k=ks,
+                    thresholds=thresholds,
+                    search_params={"nprobe": request.nprobe, "efSearch": request.ef_search},
+                    filters=[item.filters or request.filters for item in request.queries]
+                )
+                with stage("metadata"):
+                    responses = [QueryResponse(results=build_search_results(store, scores, indices)) for scores, indices in hits]
+        
+        logger.info(f"Batch search returned results for {len(responses)} queries")
+        return BatchQueryResponse(results=responses)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Batch search failed: {e}")
+        raise HTTPException(status_code=500, detail=f"Batch search failed: {str(e)}")
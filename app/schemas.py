@@ -1,8 +1,8 @@
 """
 Pydanticスキーマ定義
 """
-from typing import List, Optional, Dict, Any, Union
-from pydantic import BaseModel, Field
+from typing import List, Optional, Dict, Any, Union, Literal
+from pydantic import BaseModel, Field, model_validator
 
 
 # インデックス作成リクエスト
@@ -10,6 +10,7 @@ class IndexRequest(BaseModel):
     index_name: Optional[str] = None
     json_path: Optional[str] = None
     save_to_s3: bool = False
+    index_type: Optional[str] = Field(None, description="インデックス種別（flat / hnsw / ivf_flat / ivf_pq / sq8 / fp16 / binary）。未指定時は FAISS_INDEX_TYPE")
 
 
 # インデックス作成レスポンス
@@ -20,13 +21,79 @@ class IndexResponse(BaseModel):
     saved_s3: bool
 
 
+# 差分更新リクエスト（vendor_id 単位の追加・更新）
+class UpsertRequest(BaseModel):
+    vendors: List[Dict[str, Any]] = Field(..., min_length=1, max_length=1000, description="追加・更新するベンダー（vendors.json と同じ形式、vendor_id 必須）")
+    save_local: bool = Field(True, description="更新後にローカルへ保存するか")
+    save_to_s3: bool = False
+    index_name: Optional[str] = Field(None, description="更新対象のインデックス名（未指定時は INDEX_NAME）")
+
+
+# 差分削除リクエスト
+class DeleteRequest(BaseModel):
+    vendor_ids: List[str] = Field(..., min_length=1, max_length=1000, description="削除するベンダーID")
+    save_local: bool = Field(True, description="更新後にローカルへ保存するか")
+    save_to_s3: bool = False
+    index_name: Optional[str] = Field(None, description="更新対象のインデックス名（未指定時は INDEX_NAME）")
+
+
+# 差分更新レスポンス
+class UpdateIndexResponse(BaseModel):
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    ntotal: int
+    tombstones: int
+    saved_local: bool
+    saved_s3: bool
+
+
+class ReloadResponse(BaseModel):
+    reloaded: bool
+    version: Optional[str] = None
+    ntotal: int
+
+
 # 検索リクエスト
 class QueryRequest(BaseModel):
     q: str = Field(..., description="検索クエリ")
-    k: int = Field(10, ge=1, le=100, description="検索結果数")
+    k: Optional[int] = Field(None, ge=1, le=100, description="検索結果数（未指定時は10。threshold のみ指定時は閾値以上を全件）")
     threshold: Optional[float] = Field(None, ge=0.0, le=1.0, description="スコア閾値")
     mmr_lambda: Optional[float] = Field(None, ge=0.0, le=1.0, description="MMR重み")
     filters: Optional[Dict[str, Any]] = Field(None, description="メタデータフィルタ")
+    nprobe: Optional[int] = Field(None, ge=1, description="IVF系インデックスの探索リスト数（保存値を上書き）")
+    ef_search: Optional[int] = Field(None, ge=1, description="HNSWの探索幅（保存値を上書き）")
+    index_name: Optional[str] = Field(None, description="検索対象のインデックス名（未指定時は INDEX_NAME）")
+    mode: Literal["vector", "lexical", "hybrid"] = Field(
+        "vector",
+        description="検索方式（vector: 埋め込み / lexical: BM25（埋め込み不要、threshold は無視） / hybrid: 両者を RRF で統合）"
+    )
+
+    @model_validator(mode="after")
+    def default_k(self):
+        # k も threshold も無い場合は従来どおり上位10件
+        if self.k is None and self.threshold is None:
+            self.k = 10
+        return self
+
+
+# バッチ検索の1クエリ分（未指定項目はバッチ共通値を使用）
+class BatchQueryItem(BaseModel):
+    q: str = Field(..., description="検索クエリ")
+    k: Optional[int] = Field(None, ge=1, le=100, description="検索結果数")
+    threshold: Optional[float] = Field(None, ge=0.0, le=1.0, description="スコア閾値")
+    filters: Optional[Dict[str, Any]] = Field(None, description="メタデータフィルタ")
+
+
+# バッチ検索リクエスト
+class BatchQueryRequest(BaseModel):
+    queries: List[BatchQueryItem] = Field(..., min_length=1, max_length=1000, description="検索クエリ一覧")
+    k: int = Field(10, ge=1, le=100, description="検索結果数（共通）")
+    threshold: Optional[float] = Field(None, ge=0.0, le=1.0, description="スコア閾値（共通）")
+    filters: Optional[Dict[str, Any]] = Field(None, description="メタデータフィルタ（共通）")
+    nprobe: Optional[int] = Field(None, ge=1, description="IVF系インデックスの探索リスト数（保存値を上書き）")
+    ef_search: Optional[int] = Field(None, ge=1, description="HNSWの探索幅（保存値を上書き）")
+    index_name: Optional[str] = Field(None, description="検索対象のインデックス名（未指定時は INDEX_NAME）")
 
 
 # 検索結果アイテム
@@ -42,6 +109,11 @@ class QueryResponse(BaseModel):
     results: List[SearchResult]
 
 
+# バッチ検索レスポンス（queries と同じ順序）
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]
+
+
 # 評価リクエスト
 class EvalRequest(BaseModel):
     queries_path: str = "data/queries.eval.jsonl"
@@ -70,4 +142,8 @@ class EvalResponse(BaseModel):
 class HealthResponse(BaseModel):
     status: str
     message: str
+    embedding: Optional[Dict[str, Any]] = None
+    index: Optional[Dict[str, Any]] = None
+    response_cache: Optional[Dict[str, Any]] = None
+    admission: Optional[Dict[str, Any]] = None
 
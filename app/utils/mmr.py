@@ -2,12 +2,14 @@
 Maximal Marginal Relevance (MMR) 実装
 """
 import numpy as np
-from typing import List, Tuple, Optional
+from typing import Tuple
 import logging
+from app.utils.telemetry import timed
 
 logger = logging.getLogger(__name__)
 
 
+@timed("mmr")
 def mmr_rerank(
     query_embedding: np.ndarray,
     candidate_embeddings: np.ndarray,
@@ -38,66 +40,98 @@ def mmr_rerank(
     if n_candidates == 0:
         return np.array([]), np.array([])
     
-    # 結果格納用
-    selected_indices = []
-    selected_scores = []
-    remaining_indices = list(range(n_candidates))
+    candidate_scores = np.asarray(candidate_scores)
+    selected = _mmr_select(
+        np.asarray(candidate_embeddings, dtype=np.float32)[None],
+        candidate_scores[None],
+        lambda_param,
+        min(k, n_candidates)
+    )[0]
     
-    # 最初のアイテムは最高スコアのものを選択
-    if n_candidates > 0:
-        first_idx = np.argmax(candidate_scores)
-        selected_indices.append(first_idx)
-        selected_scores.append(candidate_scores[first_idx])
-        remaining_indices.remove(first_idx)
+    logger.info(f"MMR reranked {len(selected)} items with lambda={lambda_param}")
     
-    # 残りのアイテムをMMRで選択
-    while len(selected_indices) < min(k, n_candidates) and remaining_indices:
-        best_score = -np.inf
-        best_idx = None
-        
-        for idx in remaining_indices:
-            # 関連性スコア（クエリとの類似度）
-            relevance_score = candidate_scores[idx]
-            
-            # 多様性スコア（既選択アイテムとの最大類似度）
-            diversity_score = 0.0
-            if selected_indices:
-                # 既選択アイテムとの類似度を計算
-                similarities = []
-                for selected_idx in selected_indices:
-                    # コサイン類似度を計算
-                    similarity = np.dot(
-                        candidate_embeddings[idx], 
-                        candidate_embeddings[selected_idx]
-                    )
-                    similarities.append(similarity)
-                
-                # 最大類似度を多様性スコアとして使用
-                diversity_score = max(similarities)
-            
-            # MMRスコア計算
-            mmr_score = lambda_param * relevance_score - (1 - lambda_param) * diversity_score
-            
-            if mmr_score > best_score:
-                best_score = mmr_score
-                best_idx = idx
-        
-        if best_idx is not None:
-            selected_indices.append(best_idx)
-            selected_scores.append(candidate_scores[best_idx])
-            remaining_indices.remove(best_idx)
-        else:
-            break
+    return candidate_scores[selected], np.asarray(candidate_indices)[selected]
+
+
+@timed("mmr")
+def mmr_rerank_batch(
+    candidate_embeddings: np.ndarray,
+    candidate_scores: np.ndarray,
+    candidate_indices: np.ndarray,
+    lambda_param: float,
+    k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    複数クエリの候補をまとめてMMRで再ランク
     
-    # 結果を配列に変換
-    reranked_scores = np.array(selected_scores)
-    reranked_indices = np.array([candidate_indices[i] for i in selected_indices])
+    Args:
+        candidate_embeddings: 候補埋め込み (m, n, d)
+        candidate_scores: 候補スコア (m, n)。候補が n 件に満たないクエリは -inf で埋める
+        candidate_indices: 候補インデックス (m, n)
+        lambda_param: MMR重みパラメータ（0-1）
+        k: クエリごとの結果数
     
-    logger.info(f"MMR reranked {len(selected_indices)} items with lambda={lambda_param}")
+    Returns:
+        (reranked_scores, reranked_indices): (m, min(k, n))。候補が尽きた位置はスコア -inf、インデックス -1
+    """
+    if lambda_param <= 0 or lambda_param >= 1:
+        logger.warning(f"Invalid lambda parameter: {lambda_param}, using default 0.5")
+        lambda_param = 0.5
+    
+    candidate_scores = np.asarray(candidate_scores, dtype=np.float32)
+    candidate_indices = np.asarray(candidate_indices)
+    m, n = candidate_scores.shape
+    if n == 0:
+        return np.empty((m, 0), dtype=np.float32), np.empty((m, 0), dtype=np.int64)
     
+    selected = _mmr_select(
+        np.asarray(candidate_embeddings, dtype=np.float32), candidate_scores, lambda_param, min(k, n)
+    )
+    valid = selected >= 0
+    safe = np.where(valid, selected, 0)
+    reranked_scores = np.where(valid, np.take_along_axis(candidate_scores, safe, axis=1), -np.inf)
+    reranked_indices = np.where(valid, np.take_along_axis(candidate_indices, safe, axis=1), -1)
     return reranked_scores, reranked_indices
 
 
+def _mmr_select(embeddings: np.ndarray, scores: np.ndarray, lambda_param: float, k: int) -> np.ndarray:
+    """
+    MMRの選択順（候補内の位置）を返す。(m, n, d) / (m, n) → (m, k)、選べなかった位置は -1
+
+    候補間の類似度（Gram行列）を最初に1回だけ計算し、既選択集合との最大類似度を
+    ステップごとに np.maximum で更新するため、各ステップはベクトル化された argmax 1回になる。
+    """
+    m, n = scores.shape
+    gram = np.matmul(embeddings, embeddings.transpose(0, 2, 1))
+    # 関連性項（選択済み・無効な候補は -inf）
+    relevance = lambda_param * scores.astype(np.float64)
+    relevance[~np.isfinite(relevance)] = -np.inf
+    max_similarity = np.zeros((m, n), dtype=np.float64)
+    mmr_scores = np.empty((m, n), dtype=np.float64)
+    rows = np.arange(m)
+    selected = np.full((m, k), -1, dtype=np.int64)
+    
+    for step in range(k):
+        if step == 0:
+            # 最初のアイテムは最高スコア（既選択なしのため多様性項なし）
+            np.copyto(mmr_scores, relevance)
+        else:
+            np.multiply(max_similarity, 1 - lambda_param, out=mmr_scores)
+            np.subtract(relevance, mmr_scores, out=mmr_scores)
+        best = np.argmax(mmr_scores, axis=1)
+        has_candidate = relevance[rows, best] > -np.inf
+        if not has_candidate.any():
+            break
+        selected[has_candidate, step] = best[has_candidate]
+        relevance[rows[has_candidate], best[has_candidate]] = -np.inf
+        if step == 0:
+            max_similarity[:] = gram[rows, best]
+        else:
+            np.maximum(max_similarity, gram[rows, best], out=max_similarity)
+    
+    return selected
+
+
 def apply_mmr_filtering(
     query_embedding: np.ndarray,
     candidate_embeddings: np.ndarray,
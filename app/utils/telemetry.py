@@ -0,0 +1,257 @@
+"""
+処理段階ごとのレイテンシ計測（Prometheus テキスト形式のメトリクスと Server-Timing ヘッダー用の内訳）
+"""
+import time
+import asyncio
+import bisect
+import threading
+import functools
+import logging
+import contextvars
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 既定のバケット境界（秒）。語彙一致検索などサブミリ秒の段階も区別できるよう 0.5ms から
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """ラベルごとの単調増加カウンタ"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for labels, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    """ラベルごとのレイテンシ分布（累積バケット・合計・件数）"""
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # ラベル → [バケットごとの件数（非累積、末尾は +Inf）, 合計, 件数]
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        # value <= 境界 となる最初のバケット（どれにも入らなければ +Inf）
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][slot] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry is not None else 0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        with self._lock:
+            for labels, (counts, total, n) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = _format_labels(names, labels + (_format_value(bound),))
+                    lines.append(f"{self.name}_bucket{le} {cumulative}")
+                label_str = _format_labels(self.labelnames, labels)
+                lines.append(f"{self.name}_sum{label_str} {_format_value(total)}")
+                lines.append(f"{self.name}_count{label_str} {n}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスの登録と Prometheus テキスト形式（0.0.4）での出力"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Histogram:
+        metric = Histogram(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# グローバルレジストリ（シングルトン）
+_registry = MetricsRegistry()
+
+STAGE_SECONDS = _registry.histogram(
+    "rag_stage_duration_seconds", "Latency of each processing stage", ("stage",)
+)
+STAGE_ERRORS = _registry.counter(
+    "rag_stage_errors_total", "Processing stages that raised an exception", ("stage",)
+)
+REQUEST_SECONDS = _registry.histogram(
+    "rag_http_request_duration_seconds", "End-to-end HTTP request latency", ("method", "path")
+)
+REQUESTS = _registry.counter(
+    "rag_http_requests_total", "HTTP requests by status code", ("method", "path", "status")
+)
+
+# リクエストごとの段階別の所要時間（秒）。middleware が start_request で用意する
+_request_timings: ContextVar[Optional[Dict[str, float]]] = ContextVar("request_timings", default=None)
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    """メトリクスレジストリを取得"""
+    return _registry
+
+
+def start_request() -> Dict[str, float]:
+    """現在のリクエスト（コンテキスト）の段階別内訳の記録を開始"""
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+
+def current_timings() -> Optional[Dict[str, float]]:
+    """現在のリクエストの段階別内訳（リクエスト外なら None）"""
+    return _request_timings.get()
+
+
+def merge_timings(target: Optional[Dict[str, float]], source: Dict[str, float]) -> None:
+    """別のコンテキストで記録した内訳をリクエストの内訳に合算（ヒストグラムには記録済み）"""
+    if target is None:
+        return
+    for name, seconds in source.items():
+        target[name] = target.get(name, 0.0) + seconds
+
+
+def call_with_timings(timings: Dict[str, float], fn: Callable, *args: Any) -> Any:
+    """timings を段階の記録先にして fn を呼ぶ（複数リクエストで共有する処理の内訳を集める）"""
+    context = contextvars.copy_context()
+    context.run(_request_timings.set, timings)
+    return context.run(fn, *args)
+
+
+async def run_in_executor(executor: Optional[Executor], fn: Callable, *args: Any) -> Any:
+    """
+    現在のコンテキストをコピーしてスレッドプールで実行
+
+    loop.run_in_executor はコンテキスト変数を引き継がないため、そのままではスレッド内の段階
+    （embed_remote 等）がリクエストの内訳・Server-Timing に入らない。
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, contextvars.copy_context().run, fn, *args)
+
+
+def record(stage_name: str, seconds: float) -> None:
+    """段階の所要時間をヒストグラムと現在のリクエストの内訳に記録（同じ段階は合算）"""
+    STAGE_SECONDS.observe(seconds, stage_name)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage_name] = timings.get(stage_name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """`with stage("embed"):` の間の所要時間を記録（例外時はエラーも数える）"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.inc(name)
+        raise
+    finally:
+        record(name, time.perf_counter() - started)
+
+
+def timed(name: str) -> Callable[[Callable], Callable]:
+    """関数全体を stage(name) で計測するデコレータ（同期関数用）"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(timings: Dict[str, float], total: Optional[float] = None) -> str:
+    """段階別内訳を Server-Timing ヘッダーの値に整形（ミリ秒）"""
+    entries = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(entries)
+
+
+def render_stats(prefix: str, stats: Optional[Dict[str, Any]], label: Optional[str] = None) -> str:
+    """
+    /health 用の統計 dict を gauge として出力
+
+    label 指定時は1段目のキーをそのラベル値とみなす（例: admission_stats() の lane）。
+    数値以外（文字列・None・入れ子）は出力しない。
+    """
+    rows: Dict[str, List[str]] = {}
+    groups = stats.items() if label else [(None, stats)]
+    for group, values in groups:
+        for key, value in (values or {}).items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            labels = _format_labels((label,), (group,)) if label else ""
+            rows.setdefault(f"{prefix}_{key}", []).append(f"{prefix}_{key}{labels} {_format_value(value)}")
+    lines: List[str] = []
+    for name, samples in rows.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.extend(samples)
+    return "\n".join(lines) + "\n" if lines else ""
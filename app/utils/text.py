@@ -0,0 +1,15 @@
+"""
+テキスト正規化ユーティリティ
+"""
+import unicodedata
+
+
+def normalize_query_text(text: str) -> str:
+    """
+    クエリ文字列を正規化
+
+    NFKCで全角英数字・記号を半角に、半角カナを全角に揃え、
+    全角スペースを含む空白の連続を1つの半角スペースにまとめる。
+    """
+    normalized = unicodedata.normalize("NFKC", text)
+    return " ".join(normalized.split())
@@ -17,6 +17,7 @@ try:
     from app.core.ingest import load_vendors_data, process_vendors_data
     from app.core.embed_cohere import embed_texts
     from app.core.faiss_store import FAISSStore, create_store_paths
+    from app.core.index_manager import publish_store
     from app.core.s3_store import S3Store
     from app.config import settings
 except ImportError:
@@ -24,6 +25,7 @@ except ImportError:
     from core.ingest import load_vendors_data, process_vendors_data
     from core.embed_cohere import embed_texts
     from core.faiss_store import FAISSStore, create_store_paths
+    from core.index_manager import publish_store
     from core.s3_store import S3Store
     from config import settings
 
@@ -65,14 +67,17 @@ def main():
         store = FAISSStore(index_path, meta_path)
         store.build_index(embeddings)
         store.add_metadata(metadata)
-        store.save()
+        # 語彙一致検索用の転置索引（埋め込みと同じテキスト）
+        store.build_lexical(texts)
+        # 版ディレクトリに保存して CURRENT を差し替え（稼働中のAPIは reload / 監視で切り替え）
+        version = publish_store(store, os.path.dirname(index_path))
         
-        logger.info(f"Saved index locally: {index_path}")
+        logger.info(f"Saved index locally: {store.index_path} (version {version})")
         
         # 5. S3アップロード
         logger.info("Uploading to S3...")
         s3_store = S3Store(settings.S3_BUCKET_NAME, settings.S3_PREFIX)
-        success = s3_store.upload_index(settings.INDEX_NAME, index_path, meta_path)
+        success = s3_store.upload_index(settings.INDEX_NAME, store.index_path, store.meta_path, extra_paths=store.companion_paths())
         
         if success:
             logger.info("✅ Index successfully uploaded to S3")
@@ -0,0 +1,93 @@
+"""
+アドミッション制御テスト
+"""
+import asyncio
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from app.core.admission import AdmissionController, Overloaded
+from app import main
+
+
+def test_admission_limits_concurrency_and_sheds_load():
+    """同時実行数の上限・待ち行列の上限・待ち時間の期限を確認"""
+
+    async def run():
+        controller = AdmissionController("search", max_concurrency=2, max_queue=1, queue_timeout=0.05)
+        running = []
+        release = asyncio.Event()
+
+        async def work(i):
+            async with controller.slot():
+                running.append(i)
+                await release.wait()
+
+        # 2件は即時実行、1件は待ち行列、4件目は即座に拒否
+        tasks = [asyncio.create_task(work(i)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert running == [0, 1]
+        assert controller.queue_length == 1
+        with pytest.raises(Overloaded) as exc:
+            await controller.acquire()
+        assert exc.value.reason == "queue full"
+        assert exc.value.retry_after >= 1
+
+        # 枠が空けば待機中の先頭に引き渡される
+        release.set()
+        await asyncio.gather(*tasks)
+        assert running == [0, 1, 2]
+        assert controller.active == 0
+
+        # 待ち時間の期限切れ
+        await controller.acquire()
+        await controller.acquire()
+        with pytest.raises(Overloaded) as exc:
+            await controller.acquire()
+        assert exc.value.reason == "queue timeout"
+        assert controller.queue_length == 0
+        controller.release()
+        controller.release()
+        return controller.stats()
+
+    stats = asyncio.run(run())
+    assert stats["active"] == 0
+    assert stats["rejected_queue_full"] == 1
+    assert stats["rejected_timeout"] == 1
+    assert stats["admitted"] == 5
+
+
+def test_admission_cancelled_waiter_releases_slot():
+    """待機中にキャンセルされたリクエストが枠を消費しないことを確認"""
+
+    async def run():
+        controller = AdmissionController("search", max_concurrency=1, max_queue=4, queue_timeout=1.0)
+        await controller.acquire()
+        waiter = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        controller.release()
+        assert controller.active == 0
+        await asyncio.wait_for(controller.acquire(), timeout=0.1)
+
+    asyncio.run(run())
+
+
+def test_admission_middleware_lanes():
+    """検索レーンが満杯でも /health は応答し、検索は 503 + Retry-After を返すことを確認"""
+    saturated = AdmissionController("search", max_concurrency=1, max_queue=0, queue_timeout=0.01)
+    saturated.active = 1
+
+    assert main.admission_lane("/api/v1/query/batch") is main.get_search_admission()
+    assert main.admission_lane("/api/v1/index/upsert") is main.get_admin_admission()
+    assert main.admission_lane("/health") is None
+
+    with patch.object(main, "get_search_admission", return_value=saturated):
+        client = TestClient(main.app)
+        response = client.post("/api/v1/query", json={"q": "テスト"})
+        assert response.status_code == 503
+        assert int(response.headers["Retry-After"]) >= 1
+
+        health = client.get("/health")
+        assert health.status_code == 200
@@ -0,0 +1,60 @@
+"""
+埋め込みバックエンド選択（サーキットブレーカー）テスト
+"""
+import time
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
+from app.core.backend_selector import BackendSelector
+from app.core import embed_cohere
+
+
+def test_backend_selector_sticky_fallback():
+    """langchain_aws が使えない場合にboto3へ固定され、再試行で復帰することを確認"""
+    selector = BackendSelector(failure_threshold=1, reprobe_seconds=0.05)
+    mock_client = Mock()
+    mock_client.embed_query.return_value = ["float"]
+
+    with patch.object(embed_cohere.settings, "USE_BEDROCK", True), \
+         patch.object(embed_cohere, "_embedder", embed_cohere.RemoteEmbedder()), \
+         patch.object(embed_cohere, "_backend_selector", selector), \
+         patch.object(embed_cohere, "get_embeddings_client", return_value=mock_client), \
+         patch.object(embed_cohere, "_bedrock_embed_query_boto3", return_value=[0.6, 0.8]) as mock_boto3:
+        for _ in range(3):
+            embed_cohere._embed_query_remote("テスト")
+
+        # 2回目以降は langchain_aws を呼ばずに boto3 を直接使う
+        assert mock_client.embed_query.call_count == 1
+        assert mock_boto3.call_count == 3
+        assert selector.status()["active"] == "boto3"
+
+        # 再試行間隔経過後の1回だけプライマリを試し、成功したら戻す
+        time.sleep(0.06)
+        mock_client.embed_query.return_value = [0.6, 0.8]
+        embed_cohere._embed_query_remote("テスト")
+        assert mock_client.embed_query.call_count == 2
+        assert selector.status()["active"] == "langchain_aws"
+
+
+def test_backend_selector_reprobe_after_retryable_error():
+    """half-open の再試行がスロットリングで終わっても、次の呼び出しで再びプライマリを試すことを確認"""
+    selector = BackendSelector(failure_threshold=1, reprobe_seconds=0.0)
+    selector.record_primary_failure("unusable response")
+    throttle = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+    mock_client = Mock()
+    mock_client.embed_query.side_effect = [throttle, [0.6, 0.8]]
+
+    with patch.object(embed_cohere.settings, "USE_BEDROCK", True), \
+         patch.object(embed_cohere, "_embedder", embed_cohere.RemoteEmbedder()), \
+         patch.object(embed_cohere, "_backend_selector", selector), \
+         patch.object(embed_cohere, "get_embeddings_client", return_value=mock_client), \
+         patch.object(embed_cohere, "_bedrock_embed_query_boto3", return_value=[0.6, 0.8]) as mock_boto3:
+        embed_cohere._embed_query_remote("テスト")
+        assert mock_boto3.call_count == 1
+        assert selector.status()["active"] == "boto3"
+
+        # スロットリングは失敗として数えず、回路も開いたまま再試行できる
+        embed_cohere._embed_query_remote("テスト")
+        assert mock_client.embed_query.call_count == 2
+        assert mock_boto3.call_count == 1
+        assert selector.status()["active"] == "langchain_aws"
+        assert selector.status()["probes"] == 2
@@ -0,0 +1,29 @@
+"""
+非同期クエリ埋め込みテスト
+"""
+import numpy as np
+import time
+import asyncio
+from unittest.mock import patch
+from app.core import embed_cohere
+from app.utils.cache import LRUCache
+
+
+def test_embed_query_async_runs_concurrently():
+    """非同期クエリ埋め込みがイベントループを塞がず並行実行されることを確認"""
+
+    def slow_remote(query, model=None):
+        time.sleep(0.1)
+        return np.array([1.0, 0.0], dtype=np.float32)
+
+    async def run():
+        return await asyncio.gather(*[embed_cohere.embed_query_async(f"クエリ{i}") for i in range(5)])
+
+    with patch.object(embed_cohere, "_query_cache", LRUCache(max_entries=10)), \
+         patch.object(embed_cohere, "_embed_query_remote", side_effect=slow_remote):
+        start = time.perf_counter()
+        results = asyncio.run(run())
+        elapsed = time.perf_counter() - start
+
+    assert len(results) == 5
+    assert elapsed < 0.4
@@ -0,0 +1,59 @@
+"""
+並列バッチ埋め込みテスト
+"""
+import pytest
+import numpy as np
+import time
+from unittest.mock import patch
+from botocore.exceptions import ClientError
+from app.core import embed_cohere
+
+
+def test_embed_batches_concurrent_order_and_retry():
+    """並列バッチの入力順再構成とバッチ単位リトライを確認"""
+    attempts = {}
+    throttle = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+
+    def fake_embed_batch(embedder, batch, input_type):
+        key = batch[0]
+        attempts[key] = attempts.get(key, 0) + 1
+        # 2番目のバッチは1回目だけ失敗させる
+        if key == "t2" and attempts[key] == 1:
+            raise throttle
+        # 後ろのバッチほど早く返るようにして順序入れ替わりを誘発
+        time.sleep(0.01 * (10 - int(key[1:])) / 10)
+        return np.array([[float(t[1:]), 1.0] for t in batch], dtype=np.float32)
+
+    texts = [f"t{i}" for i in range(10)]
+    with patch.object(embed_cohere.settings, "BATCH_SIZE", 2), \
+         patch.object(embed_cohere.settings, "EMBED_CONCURRENCY", 4), \
+         patch.object(embed_cohere.settings, "EMBED_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere, "get_embedder", return_value=None), \
+         patch.object(embed_cohere, "_embed_batch", side_effect=fake_embed_batch):
+        result = embed_cohere._embed_batches(texts, "search_document", None)
+
+    np.testing.assert_allclose(result[:, 0], np.arange(10, dtype=np.float32))
+    assert attempts["t2"] == 2
+    assert attempts["t0"] == 1
+
+
+def test_embed_batch_retries_single_layer():
+    """入力不正は再送せず、再試行を持つ Bedrock ではバッチ単位の再試行を重ねないことを確認"""
+    throttle = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+    validation = ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+
+    with patch.object(embed_cohere.settings, "EMBED_BATCH_RETRIES", 2), \
+         patch.object(embed_cohere.settings, "EMBED_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere.settings, "USE_BEDROCK", False), \
+         patch.object(embed_cohere, "_embed_batch", side_effect=validation) as mock_batch:
+        with pytest.raises(ClientError):
+            embed_cohere._embed_batch_with_retry(None, 1, ["t0"], "search_document")
+        assert mock_batch.call_count == 1
+
+    with patch.object(embed_cohere.settings, "EMBED_BATCH_RETRIES", 2), \
+         patch.object(embed_cohere.settings, "EMBED_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere.settings, "USE_BEDROCK", True), \
+         patch.object(embed_cohere, "_embed_batch", side_effect=throttle) as mock_batch:
+        with pytest.raises(ClientError):
+            embed_cohere._embed_batch_with_retry(embed_cohere.RemoteEmbedder(), 1, ["t0"], "search_document")
+        assert mock_batch.call_count == 1
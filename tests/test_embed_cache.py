@@ -0,0 +1,113 @@
+"""
+埋め込みキャッシュテスト
+"""
+import numpy as np
+import tempfile
+import os
+from unittest.mock import patch
+from app.core.embed_cache import EmbeddingCache
+from app.core import embed_cohere
+
+
+def test_embedding_cache_hit_miss():
+    """ヒット/ミス統計テスト"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = EmbeddingCache(os.path.join(temp_dir, "cache.sqlite3"), max_bytes=1024 * 1024)
+
+        key_a = EmbeddingCache.make_key("テキストA", "model", "search_document", None)
+        key_b = EmbeddingCache.make_key("テキストB", "model", "search_document", None)
+        cache.put_many({key_a: np.array([0.1, 0.2, 0.3], dtype=np.float32)})
+
+        found = cache.get_many([key_a, key_b])
+        assert key_a in found
+        assert key_b not in found
+        np.testing.assert_allclose(found[key_a], [0.1, 0.2, 0.3], rtol=1e-6)
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["entries"] == 1
+
+        # input_type / dimension が違えば別キー
+        assert key_a != EmbeddingCache.make_key("テキストA", "model", "search_query", None)
+        assert key_a != EmbeddingCache.make_key("テキストA", "model", "search_document", 256)
+        cache.close()
+
+
+def test_embedding_cache_lru_eviction():
+    """サイズ予算超過時のLRU削除テスト"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        # 1ベクトル = 4次元 * 4バイト = 16バイト、予算は3件分
+        cache = EmbeddingCache(os.path.join(temp_dir, "cache.sqlite3"), max_bytes=48)
+        vec = np.ones(4, dtype=np.float32)
+
+        cache.put_many({"k1": vec})
+        cache.put_many({"k2": vec})
+        cache.put_many({"k3": vec})
+        # k1 にアクセスして最近使用済みにする
+        cache.get_many(["k1"])
+        cache.put_many({"k4": vec})
+
+        found = cache.get_many(["k1", "k2", "k3", "k4"])
+        assert "k1" in found
+        assert "k4" in found
+        assert "k2" not in found
+        assert cache.stats()["bytes"] <= 48
+        cache.close()
+
+
+def test_embedding_cache_tracks_entries_in_memory():
+    """件数は SQLite を数え直さずに追跡され、置き換え・削除・再オープン後も実際の件数と一致することを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cache.sqlite3")
+        cache = EmbeddingCache(path, max_bytes=48)
+        vec = np.ones(4, dtype=np.float32)
+
+        cache.put_many({"k1": vec, "k2": vec})
+        cache.put_many({"k2": vec, "k3": vec})  # k2 は置き換え
+        assert cache.stats()["entries"] == 3
+        cache.put_many({"k4": vec})  # 予算超過で削除
+        count = cache._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        assert cache.stats()["entries"] == count < 4
+        cache.close()
+
+        reopened = EmbeddingCache(path, max_bytes=48)
+        assert reopened.stats()["entries"] == count
+        reopened.clear()
+        assert reopened.stats()["entries"] == 0
+        reopened.close()
+
+
+def test_embedding_stats_does_not_open_cache():
+    """/health 用の統計はディスクキャッシュを作成しないことを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "cache", "cache.sqlite3")
+        with patch.object(embed_cohere, "_embedding_cache", None), \
+             patch.object(embed_cohere.settings, "EMBED_CACHE_ENABLED", True), \
+             patch.object(embed_cohere.settings, "EMBED_CACHE_PATH", path):
+            stats = embed_cohere.embedding_stats()
+            assert stats["disk_cache"] is None
+            assert embed_cohere._embedding_cache is None
+        assert not os.path.exists(path)
+
+
+def test_embed_texts_only_embeds_misses():
+    """キャッシュミス分のみリモート埋め込みされることを確認"""
+    calls = []
+
+    def fake_embed_batches(texts, input_type, model):
+        calls.append(list(texts))
+        return np.array([[len(t), 1.0, 0.0] for t in texts], dtype=np.float32)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        cache = EmbeddingCache(os.path.join(temp_dir, "cache.sqlite3"), max_bytes=1024 * 1024)
+        with patch.object(embed_cohere, "_embedding_cache", cache), \
+             patch.object(embed_cohere, "_embed_batches", side_effect=fake_embed_batches):
+            first = embed_cohere.embed_texts(["a", "bb", "a"])
+            second = embed_cohere.embed_texts(["a", "bb", "ccc"])
+
+        assert calls == [["a", "bb"], ["ccc"]]
+        assert first.shape == (3, 3)
+        np.testing.assert_allclose(first[0], second[0], rtol=1e-6)
+        np.testing.assert_allclose(np.linalg.norm(second, axis=1), 1.0, rtol=1e-6)
+        cache.close()
@@ -5,9 +5,13 @@ import pytest
 import numpy as np
 import tempfile
 import os
+import json
+import threading
 from unittest.mock import Mock, patch
 from app.core.embed_cohere import embed_texts, embed_query, l2_normalize
-from app.core.faiss_store import FAISSStore
+from app.core.faiss_store import FAISSStore, MappedMetadata
+from app.utils.mmr import apply_mmr_filtering
+from app.config import settings
 
 
 def test_l2_normalize():
@@ -121,3 +125,408 @@ def test_faiss_store():
         assert len(meta_results) == 2
         assert meta_results[0]["vendor_id"] == "V-1"  # 最高スコアのアイテム
 
+
+
+def test_parse_embeddings_known_layouts():
+    """Cohere v3/v4 レスポンス形式の高速パーステスト"""
+    from app.core.embed_cohere import _parse_embeddings
+
+    # v4: embeddings_by_type
+    arr = _parse_embeddings({"embeddings": {"float": [[0.1, 0.2], [0.3, 0.4]]}, "id": "x"})
+    assert arr.dtype == np.float32
+    assert arr.shape == (2, 2)
+
+    # v3: embeddings_floats
+    arr = _parse_embeddings({"embeddings": [[1, 2, 3]], "texts": ["a"]})
+    assert arr.shape == (1, 3)
+
+    # int8 のみ返却された場合は float32 に変換
+    arr = _parse_embeddings({"embeddings": {"int8": [[-128, 0, 127]]}})
+    np.testing.assert_allclose(arr, [[-128.0, 0.0, 127.0]])
+
+    # ubinary はビット展開して ±1
+    arr = _parse_embeddings({"embeddings": {"ubinary": [[0b10000001]]}})
+    np.testing.assert_allclose(arr, [[1, -1, -1, -1, -1, -1, -1, 1]])
+
+    # ubinary を要求した場合はパック済みのまま返す
+    packed = _parse_embeddings({"embeddings": {"ubinary": [[129]]}}, embedding_type="ubinary")
+    assert packed.dtype == np.uint8
+    assert packed.tolist() == [[129]]
+
+    # langchain_aws 形式（list[float]）
+    arr = _parse_embeddings([0.5, 0.5])
+    assert arr.shape == (1, 2)
+
+    # 不正な戻り値
+    assert _parse_embeddings(["float"]) is None
+
+    # 未知のネスト構造は再帰探索にフォールバック
+    arr = _parse_embeddings({"result": {"data": [{"vector": [0.1, 0.2]}]}})
+    assert arr.shape == (1, 2)
+
+
+def test_local_hash_embedder():
+    """ローカル埋め込みが決定的で、文字n-gramを共有するテキストほど近いことを確認"""
+    from app.core.embedders import Embedder, LocalHashEmbedder
+
+    embedder = LocalHashEmbedder(dimension=256)
+    assert isinstance(embedder, Embedder)
+    assert embedder.model_id == "local-hash-256"
+
+    docs = embedder.embed_documents(["LLM導入支援", "製造業の最適化", "LLM導入支援"])
+    assert docs.shape == (3, 256)
+    np.testing.assert_array_equal(docs[0], docs[2])
+
+    docs = l2_normalize(docs)
+    query = l2_normalize(embedder.embed_query("ＬＬＭ導入").reshape(1, -1))[0]
+    assert np.dot(docs[0], query) > np.dot(docs[1], query)
+
+
+def test_embed_texts_with_local_backend():
+    """EMBEDDER_BACKEND=local でネットワークなしに埋め込み＋検索できることを確認"""
+    from app.core import embed_cohere
+    from app.core.embedders import LocalHashEmbedder
+
+    with patch.object(embed_cohere, "_embedder", LocalHashEmbedder(dimension=128)), \
+         patch.object(embed_cohere, "_embedding_cache", None), \
+         patch.object(embed_cohere.settings, "EMBED_CACHE_ENABLED", False):
+        embeddings = embed_cohere.embed_texts(["RAG応用のSaaS", "製造最適化", "LLM導入支援"])
+        query = embed_cohere._embed_query_remote("RAG応用")
+
+    assert embeddings.shape == (3, 128)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+    assert int(np.argmax(embeddings @ query)) == 0
+
+
+def test_faiss_store_binary_two_stage():
+    """バイナリインデックス（Hamming一次検索＋float再スコア）テスト"""
+    rng = np.random.default_rng(0)
+    embeddings = l2_normalize(rng.standard_normal((200, 64)).astype('float32'))
+    metadata = [{"vendor_id": f"V-{i}", "name": f"Company {i}"} for i in range(200)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.faiss")
+        meta_path = os.path.join(temp_dir, "meta.json")
+
+        store = FAISSStore(index_path, meta_path)
+        store.build_index(embeddings, index_type="binary")
+        store.add_metadata(metadata)
+        store.save()
+        assert os.path.join(temp_dir, "index_info.json") in store.companion_paths()
+        assert os.path.join(temp_dir, "vectors.npy") in store.companion_paths()
+
+        # 構築直後も再スコア用ベクトルはヒープに持たない
+        assert isinstance(store.rescore_vectors, np.memmap)
+
+        new_store = FAISSStore(index_path, meta_path)
+        # FAISS_MMAP=false 相当でも再スコア用の float は常にメモリマップ
+        new_store.load(mmap_mode=False)
+        assert new_store.index_type == "binary"
+        # 1ベクトル8バイト（float32の1/32）
+        assert new_store.index.code_size == 8
+        assert isinstance(new_store.rescore_vectors, np.memmap)
+
+        query = l2_normalize((embeddings[42] + 0.05 * rng.standard_normal(64).astype('float32')).reshape(1, -1))[0]
+        scores, indices = new_store.search(query, k=5)
+
+        assert len(indices) == 5
+        assert indices[0] == 42
+        assert np.all(np.diff(scores) <= 0)
+        # 再スコアは元の float ベクトルによる厳密なコサイン類似度
+        np.testing.assert_allclose(scores, embeddings[indices] @ query, rtol=1e-5)
+
+        # 差分更新・コンパクション後も float ベクトルが位置と対応する
+        # （ヒープに全体をコピーせず、新しいファイルのメモリマップに置き換わる）
+        with patch.object(settings, "INDEX_COMPACT_RATIO", 1.0):
+            new_store.upsert(["V-500"], embeddings[7:8] * -1)
+            assert isinstance(new_store.rescore_vectors, np.memmap)
+            np.testing.assert_allclose(new_store.rescore_vectors[-1], -embeddings[7])
+            new_store.delete([f"V-{i}" for i in range(100)])
+            assert new_store.compact() == 100
+        assert isinstance(new_store.rescore_vectors, np.memmap)
+        assert new_store.rescore_vectors.shape == (new_store.index.ntotal, 64)
+        position = [m["vendor_id"] for m in new_store.metadata].index("V-150")
+        np.testing.assert_allclose(new_store.rescore_vectors[position], embeddings[150])
+        scores, indices = new_store.search(query, k=3)
+        np.testing.assert_allclose(scores, new_store.rescore_vectors[indices] @ query, rtol=1e-5)
+        # 書き出し用の一時ファイルは残らない
+        assert not [f for f in os.listdir(temp_dir) if f.startswith(".vectors-")]
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "ivf_pq", "sq8", "fp16"])
+def test_faiss_store_index_types(index_type):
+    """各インデックス種別の構築・保存・読み込み・検索テスト"""
+    rng = np.random.default_rng(1)
+    embeddings = l2_normalize(rng.standard_normal((2000, 32)).astype('float32'))
+    metadata = [{"vendor_id": f"V-{i}"} for i in range(2000)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.faiss")
+        meta_path = os.path.join(temp_dir, "meta.json")
+
+        store = FAISSStore(index_path, meta_path)
+        store.build_index(embeddings, index_type=index_type)
+        store.add_metadata(metadata)
+        store.save()
+
+        new_store = FAISSStore(index_path, meta_path)
+        new_store.load()
+        assert new_store.index_type == index_type
+        assert new_store.info["ntotal"] == 2000
+
+        # 保存済みパラメータのリクエスト単位の上書き
+        overrides = {"nprobe": 64, "efSearch": 128}
+        hits = 0
+        for i in range(0, 2000, 100):
+            _, indices = new_store.search(embeddings[i], k=5, search_params=overrides)
+            hits += int(i in indices)
+        assert hits >= 18
+
+
+def test_faiss_store_rejects_unknown_index_type():
+    """未知のインデックス種別はValueError"""
+    store = FAISSStore("/tmp/unused/index.faiss", "/tmp/unused/meta.json")
+    with pytest.raises(ValueError):
+        store.build_index(np.zeros((10, 8), dtype='float32'), index_type="lsh")
+
+
+def test_faiss_store_search_batch():
+    """一括検索がクエリごとのk・閾値を反映し、単発検索と一致することを確認"""
+    rng = np.random.default_rng(2)
+    embeddings = l2_normalize(rng.standard_normal((200, 16)).astype('float32'))
+
+    store = FAISSStore("/tmp/unused/index.faiss", "/tmp/unused/meta.json")
+    store.build_index(embeddings)
+
+    queries = embeddings[[3, 7, 11]]
+    results = store.search_batch(queries, k=[5, 3, 8], thresholds=[None, None, 0.99])
+
+    assert len(results) == 3
+    for q, k, (scores, indices) in zip(queries[:2], [5, 3], results[:2]):
+        single_scores, single_indices = store.search(q, k=k)
+        np.testing.assert_array_equal(indices, single_indices)
+        np.testing.assert_allclose(scores, single_scores, rtol=1e-6)
+    assert len(results[1][1]) == 3
+    # 閾値0.99では自分自身のみ残る
+    assert list(results[2][1]) == [11]
+
+
+def test_faiss_store_mmap_load():
+    """メモリマップ読み込みが通常読み込みと同じ結果を返し、メタデータを遅延デコードすることを確認"""
+    rng = np.random.default_rng(3)
+    embeddings = l2_normalize(rng.standard_normal((100, 16)).astype('float32'))
+    metadata = [{"vendor_id": f"V-{i}", "name": f"ベンダー{i}"} for i in range(100)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.faiss")
+        meta_path = os.path.join(temp_dir, "meta.json")
+
+        store = FAISSStore(index_path, meta_path)
+        store.build_index(embeddings)
+        store.add_metadata(metadata)
+        store.save()
+
+        # 1行1レコードでも従来どおりJSON配列として読める
+        with open(meta_path) as f:
+            assert json.load(f) == metadata
+
+        mapped = FAISSStore(index_path, meta_path)
+        mapped.load(mmap_mode=True)
+        regular = FAISSStore(index_path, meta_path)
+        regular.load(mmap_mode=False)
+
+        assert mapped.mmapped and not regular.mmapped
+        assert isinstance(mapped.metadata, MappedMetadata)
+        assert len(mapped.metadata) == 100
+        assert mapped.metadata[42] == metadata[42]
+
+        scores_m, indices_m = mapped.search(embeddings[42], k=5)
+        scores_r, indices_r = regular.search(embeddings[42], k=5)
+        np.testing.assert_array_equal(indices_m, indices_r)
+        assert mapped.get_metadata_by_indices(indices_m) == regular.get_metadata_by_indices(indices_r)
+
+        # 位置情報と食い違う meta.json は全体パースにフォールバック
+        with open(meta_path, 'wb') as f:
+            f.write(json.dumps(metadata).encode())
+        fallback = FAISSStore(index_path, meta_path)
+        fallback.load(mmap_mode=True)
+        assert fallback.metadata == metadata
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "binary"])
+def test_faiss_store_upsert_delete(index_type):
+    """vendor_id 単位の追加・更新・削除とコンパクションのテスト"""
+    rng = np.random.default_rng(4)
+    embeddings = l2_normalize(rng.standard_normal((500, 32)).astype('float32'))
+    metadata = [{"vendor_id": f"V-{i}", "name": f"ベンダー{i}"} for i in range(500)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.faiss")
+        meta_path = os.path.join(temp_dir, "meta.json")
+
+        store = FAISSStore(index_path, meta_path)
+        store.build_index(embeddings, index_type=index_type)
+        store.add_metadata(metadata)
+        store.save()
+
+        # mmap 読み込み後でも更新できる
+        store = FAISSStore(index_path, meta_path)
+        store.load(mmap_mode=True)
+        with patch.object(settings, "INDEX_COMPACT_RATIO", 1.0):
+            # V-3 を別ベクトルに更新、V-new を追加
+            new_vectors = l2_normalize(rng.standard_normal((2, 32)).astype('float32'))
+            counts = store.upsert(["V-3", "V-new"], new_vectors, [{"vendor_id": "V-3", "name": "更新"}, {"vendor_id": "V-new", "name": "新規"}])
+            assert counts == {"inserted": 1, "updated": 1}
+
+            _, indices = store.search(new_vectors[0], k=3)
+            top = store.get_metadata_by_indices(indices)[0]
+            assert top["vendor_id"] == "V-3" and top["name"] == "更新"
+
+            # 旧ベクトルでは V-3 の旧エントリは返らない
+            _, indices = store.search(embeddings[3], k=10)
+            assert all(m["vendor_id"] != "V-3" or m["name"] == "更新" for m in store.get_metadata_by_indices(indices))
+
+            assert store.delete(["V-5", "V-unknown"]) == 1
+            _, indices = store.search(embeddings[5], k=10)
+            assert "V-5" not in [m["vendor_id"] for m in store.get_metadata_by_indices(indices)]
+            assert store.tombstones == 2
+
+        # 保存・再読み込みで削除状態が保たれる
+        store.save()
+        reloaded = FAISSStore(index_path, meta_path)
+        reloaded.load()
+        _, indices = reloaded.search(embeddings[5], k=10)
+        assert "V-5" not in [m["vendor_id"] for m in reloaded.get_metadata_by_indices(indices)]
+
+        # コンパクションで物理削除しても検索結果は変わらない
+        assert store.compact() == 2
+        assert store.tombstones == 0
+        assert store.index.ntotal == 500
+        _, indices = store.search(new_vectors[1], k=1)
+        assert store.get_metadata_by_indices(indices)[0]["vendor_id"] == "V-new"
+        _, indices = store.search(embeddings[100], k=1)
+        assert store.get_metadata_by_indices(indices)[0]["vendor_id"] == "V-100"
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "binary"])
+def test_faiss_store_filter_pushdown(index_type):
+    """フィルタを検索に押し下げ、選択的なフィルタでも k 件を返すことを確認"""
+    rng = np.random.default_rng(5)
+    embeddings = l2_normalize(rng.standard_normal((3000, 32)).astype('float32'))
+    # type=rare は30件のみ、listed=上場 は約半数
+    metadata = [
+        {"vendor_id": f"V-{i}", "type": "rare" if i % 100 == 0 else "common", "listed": "上場" if i % 2 else "非上場"}
+        for i in range(3000)
+    ]
+
+    store = FAISSStore("/tmp/unused/index.faiss", "/tmp/unused/meta.json")
+    store.build_index(embeddings, index_type=index_type)
+    store.add_metadata(metadata)
+
+    query = embeddings[7]
+    with patch.object(settings, "FILTER_EXHAUSTIVE_MAX", 100):
+        # 許可集合が小さい → 全件内積（厳密）
+        scores, indices = store.search(query, k=10, filters={"type": "rare"})
+        assert len(indices) == 10
+        assert all(metadata[i]["type"] == "rare" for i in indices)
+        rare = np.arange(0, 3000, 100)
+        expected = rare[np.argsort(-(embeddings[rare] @ query))[:10]]
+        if index_type != "binary":
+            np.testing.assert_array_equal(indices, expected)
+        assert store.filter_plans["exhaustive"] == 1
+
+        # 許可集合が大きい → IDSelector 付き ANN
+        _, indices = store.search(query, k=10, filters={"listed": "上場", "type": "common"}, search_params={"nprobe": 64})
+        assert len(indices) == 10
+        assert all(metadata[i]["listed"] == "上場" and metadata[i]["type"] == "common" for i in indices)
+        assert 7 in indices
+        assert store.filter_plans["selector"] == 1
+
+        # 該当なし・未知のキーは従来どおり（未知キーは無視）
+        assert len(store.search(query, k=10, filters={"type": "none"})[1]) == 0
+        assert len(store.search(query, k=10, filters={"unknown": "x"})[1]) == 10
+
+        # 削除済みは許可集合から除外
+        store.delete(["V-7"])
+        _, indices = store.search(query, k=10, filters={"listed": "上場"}, search_params={"nprobe": 64})
+        assert 7 not in indices
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "sq8", "binary"])
+def test_faiss_store_range_search(index_type):
+    """閾値以上の全件をスコア降順・上限付きで返すことを確認"""
+    rng = np.random.default_rng(7)
+    base = l2_normalize(rng.standard_normal((1, 32)).astype('float32'))
+    # 基準ベクトル近傍に50件、残りはランダム
+    near = l2_normalize(base + 0.3 * rng.standard_normal((50, 32)).astype('float32'))
+    embeddings = np.vstack([near, l2_normalize(rng.standard_normal((950, 32)).astype('float32'))])
+    metadata = [{"vendor_id": f"V-{i}", "type": "near" if i < 50 else "far"} for i in range(1000)]
+
+    store = FAISSStore("/tmp/unused/index.faiss", "/tmp/unused/meta.json")
+    store.build_index(embeddings, index_type=index_type)
+    store.add_metadata(metadata)
+
+    query = base[0]
+    threshold = 0.5
+    scores, indices = store.range_search(query, threshold=threshold, search_params={"nprobe": 64, "efSearch": 256})
+    assert np.all(scores >= threshold)
+    assert np.all(np.diff(scores) <= 0)
+    expected = set(np.flatnonzero(embeddings @ query >= threshold))
+    if index_type in ("flat", "ivf_flat"):
+        assert set(indices) == expected
+        assert len(expected) > 10  # k=10 の top-k では取りこぼす件数
+    if index_type == "binary":
+        # 再スコアは厳密なコサインなので閾値の意味は flat と同じ（Hamming で絞った分だけ取りこぼしうる）
+        assert set(indices) <= expected
+        np.testing.assert_allclose(scores, embeddings[indices] @ query, rtol=1e-5)
+
+    # 上限件数とフィルタ
+    scores, indices = store.range_search(query, threshold=threshold, max_results=5)
+    assert len(indices) == 5
+    _, indices = store.range_search(query, threshold=threshold, filters={"type": "far"})
+    assert all(i >= 50 for i in indices)
+
+
+@pytest.mark.parametrize("index_type", ["flat", "hnsw", "ivf_flat", "sq8", "binary"])
+def test_faiss_store_return_vectors(index_type):
+    """検索結果と同じ順序で候補の格納ベクトルが返り、MMR が重複文書を避けることを確認"""
+    rng = np.random.default_rng(8)
+    eye = np.eye(32, dtype='float32')
+    base = eye[:1]
+    # 同一内容の文書3件（クエリとの類似度 0.9）＋互いに異なる方向の近傍文書5件（0.85）＋ランダム
+    duplicates = np.tile(0.9 * eye[0] + np.sqrt(1 - 0.81) * eye[1], (3, 1))
+    others = 0.85 * eye[0] + np.sqrt(1 - 0.85 ** 2) * eye[2:7]
+    embeddings = np.vstack([duplicates, others, l2_normalize(rng.standard_normal((400, 32)).astype('float32'))]).astype('float32')
+    metadata = [{"vendor_id": f"V-{i}"} for i in range(len(embeddings))]
+
+    store = FAISSStore("/tmp/unused/index.faiss", "/tmp/unused/meta.json")
+    store.build_index(embeddings, index_type=index_type)
+    store.add_metadata(metadata)
+
+    params = {"nprobe": 64, "efSearch": 256}
+    scores, indices, vectors = store.search(base[0], k=8, search_params=params, return_vectors=True)
+    assert vectors.shape == (len(indices), store.index.d)
+    np.testing.assert_allclose(vectors, embeddings[indices], atol=0.05)
+    _, range_indices, range_vectors = store.range_search(base[0], threshold=0.2, search_params=params, return_vectors=True)
+    assert len(range_vectors) == len(range_indices)
+
+    # 格納ベクトルの取り出しは検索と同じロック区間内（別スレッドからはロックを取れない）
+    held = []
+    original_vectors = store.vectors
+
+    def vectors_under_lock(indices):
+        thread = threading.Thread(target=lambda: held.append(not store.lock.acquire(blocking=False)))
+        thread.start()
+        thread.join()
+        return original_vectors(indices)
+
+    with patch.object(store, "vectors", side_effect=vectors_under_lock):
+        store.search(base[0], k=8, search_params=params, return_vectors=True)
+        store.range_search(base[0], threshold=0.2, search_params=params, return_vectors=True)
+    assert held == [True, True]
+
+    if index_type == "flat":
+        _, reranked = apply_mmr_filtering(base[0], vectors, scores, np.arange(len(indices)), 0.5, 3)
+        chosen = set(indices[reranked])
+        # 重複3件のうち選ばれるのは1件のみ
+        assert len(chosen & {0, 1, 2}) == 1
@@ -0,0 +1,214 @@
+"""
+バージョン付きインデックスの公開・ホットスワップテスト
+"""
+import pytest
+import os
+import tempfile
+import numpy as np
+from unittest.mock import patch
+from app.core.faiss_store import FAISSStore, create_store_paths
+from app.core.embed_cohere import l2_normalize
+from app.core import index_manager
+from app.core.index_manager import (
+    IndexManager, IndexRegistry, publish_store, read_current_version, LEGACY_VERSION, VERSIONS_DIRNAME
+)
+
+
+def _build_store(index_dir: str, n: int, seed: int) -> FAISSStore:
+    rng = np.random.default_rng(seed)
+    embeddings = l2_normalize(rng.standard_normal((n, 16)).astype('float32'))
+    store = FAISSStore(os.path.join(index_dir, "index.faiss"), os.path.join(index_dir, "meta.json"))
+    store.build_index(embeddings)
+    store.add_metadata([{"vendor_id": f"V-{seed}-{i}"} for i in range(n)])
+    return store
+
+
+def test_publish_and_hot_swap():
+    """公開した版への切り替えと、実行中ハンドルの旧版保持を確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_dir = os.path.join(temp_dir, "vendors")
+        first = publish_store(_build_store(index_dir, 10, seed=1), index_dir)
+        assert read_current_version(index_dir) == first
+        assert not any(v.startswith(".") for v in os.listdir(os.path.join(index_dir, VERSIONS_DIRNAME)))
+
+        manager = IndexManager(temp_dir, "vendors")
+        handle = manager.acquire()
+        with handle as old_store:
+            assert manager.version == first
+
+            # 別プロセス相当の公開 → reload で切り替え
+            second = publish_store(_build_store(index_dir, 20, seed=2), index_dir)
+            assert manager.reload() is True
+            assert manager.reload() is False
+            assert manager.version == second
+
+            # 実行中のリクエストは旧版のまま
+            assert old_store.index.ntotal == 10
+            assert manager.status()["retired_in_flight"] == 1
+            with manager.acquire() as new_store:
+                assert new_store.index.ntotal == 20
+
+        status = manager.status()
+        assert status["retired_in_flight"] == 0
+        assert status["in_flight"] == 0
+        assert status["ntotal"] == 20
+
+
+def test_adopt_and_prune_versions():
+    """メモリ上のストアの公開と古い版の削除を確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_dir = os.path.join(temp_dir, "vendors")
+        manager = IndexManager(temp_dir, "vendors")
+        with patch.object(index_manager.settings, "INDEX_KEEP_VERSIONS", 2):
+            versions = [manager.adopt(_build_store(index_dir, 5 + i, seed=i)) for i in range(4)]
+
+        remaining = sorted(os.listdir(os.path.join(index_dir, VERSIONS_DIRNAME)))
+        assert remaining == versions[-2:]
+        assert manager.version == versions[-1]
+        assert manager.current_store().index.ntotal == 8
+
+        # 公開後のストアは版ディレクトリから読み直せる
+        reloaded = IndexManager(temp_dir, "vendors")
+        assert reloaded.current_store().index.ntotal == 8
+
+
+def test_legacy_layout_fallback():
+    """CURRENT の無い旧形式のインデックスを読み込めることを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path, _ = create_store_paths(temp_dir, "vendors")
+        store = _build_store(os.path.dirname(index_path), 7, seed=3)
+        store.save()
+
+        manager = IndexManager(temp_dir, "vendors")
+        with manager.acquire() as loaded:
+            assert loaded.index.ntotal == 7
+        assert manager.version == LEGACY_VERSION
+
+        with pytest.raises(FileNotFoundError):
+            IndexManager(temp_dir, "missing").acquire()
+
+
+def test_registry_lru_eviction_under_budget():
+    """メモリ予算を超えたら最も長く使われていないインデックスが解放されることを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i, name in enumerate(["client_a", "client_b", "client_c"]):
+            index_dir = os.path.join(temp_dir, name)
+            publish_store(_build_store(index_dir, 50, seed=i), index_dir)
+
+        one_index = IndexManager(temp_dir, "client_a").current_store().nbytes
+        registry = IndexRegistry(temp_dir, memory_budget_bytes=int(one_index * 2.5))
+
+        with registry.acquire("client_a") as store_a:
+            assert store_a.metadata[0]["vendor_id"] == "V-0-0"
+        with registry.acquire("client_b"):
+            pass
+        # a を使い直してから c を読み込む → 最も古い b が解放される
+        with registry.acquire("client_a"):
+            pass
+        with registry.acquire("client_c"):
+            pass
+
+        status = registry.status()
+        assert status["indexes"]["client_a"]["loaded"]
+        assert not status["indexes"]["client_b"]["loaded"]
+        assert status["indexes"]["client_b"]["evictions"] == 1
+        assert status["resident_bytes"] <= registry.memory_budget_bytes
+
+        # 解放済みのインデックスは次の検索で再読み込み。実行中のリクエストがあるものは解放しない
+        with registry.acquire("client_c"):
+            with registry.acquire("client_b") as store_b:
+                assert store_b.index.ntotal == 50
+            status = registry.status()
+            assert status["indexes"]["client_c"]["loaded"]
+            assert status["indexes"]["client_b"]["loads"] == 2
+
+        with pytest.raises(ValueError):
+            registry.acquire("../etc")
+        with pytest.raises(FileNotFoundError):
+            registry.acquire("unknown")
+        assert "unknown" not in registry.status()["indexes"]
+
+
+def test_registry_lazy_load_from_s3():
+    """ローカルに無いインデックスを S3 から取得して公開することを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source_dir = os.path.join(temp_dir, "source")
+        source = _build_store(source_dir, 12, seed=4)
+        source.save()
+
+        def fake_download(index_name, local_index_path, local_meta_path, extra_filenames=None):
+            local_dir = os.path.dirname(local_index_path)
+            for path in [source.index_path, source.meta_path] + source.companion_paths():
+                with open(path, 'rb') as src, open(os.path.join(local_dir, os.path.basename(path)), 'wb') as dst:
+                    dst.write(src.read())
+            return True
+
+        with patch.object(index_manager.settings, "S3_BUCKET_NAME", "bucket"), \
+             patch.object(index_manager.S3Store, "download_index", side_effect=fake_download) as mock_download:
+            registry = IndexRegistry(os.path.join(temp_dir, "vectors"))
+            with registry.acquire("experiment_1") as store:
+                assert store.index.ntotal == 12
+            with registry.acquire("experiment_1"):
+                pass
+
+        assert mock_download.call_count == 1
+        assert read_current_version(os.path.join(temp_dir, "vectors", "experiment_1")) is not None
+        assert sorted(os.listdir(os.path.join(temp_dir, "vectors"))) == ["experiment_1"]
+
+
+def test_registry_unknown_s3_index_leaves_no_dirs():
+    """S3 に無いインデックス名ではローカルに空のディレクトリを作らないことを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        base_dir = os.path.join(temp_dir, "vectors")
+        with patch.object(index_manager.settings, "S3_BUCKET_NAME", "bucket"), \
+             patch.object(index_manager.S3Store, "download_index", return_value=False):
+            registry = IndexRegistry(base_dir)
+            with pytest.raises(FileNotFoundError):
+                registry.acquire("unknown_index")
+
+        assert os.listdir(base_dir) == []
+
+
+def test_registry_caches_not_found_names():
+    """存在しない名前は TTL の間 S3 を探し直さず、公開されれば即座に取得できることを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        with patch.object(index_manager.settings, "S3_BUCKET_NAME", "bucket"), \
+             patch.object(index_manager.S3Store, "download_index", return_value=False) as mock_download:
+            registry = IndexRegistry(temp_dir, not_found_ttl=30)
+            for _ in range(3):
+                with pytest.raises(FileNotFoundError):
+                    registry.acquire("nope")
+            assert mock_download.call_count == 1
+            assert registry.status()["not_found_hits"] == 2
+
+            # TTL を過ぎたら探し直す
+            now = index_manager.time.monotonic()
+            with patch.object(index_manager.time, "monotonic", return_value=now + 31):
+                with pytest.raises(FileNotFoundError):
+                    registry.acquire("nope")
+            assert mock_download.call_count == 2
+
+            # 公開されれば TTL 内でも取得できる
+            registry.adopt("nope", _build_store(os.path.join(temp_dir, "staging"), 5, seed=6))
+            with registry.acquire("nope") as store:
+                assert store.index.ntotal == 5
+
+
+def test_status_reports_live_vectors():
+    """status の ntotal は削除済み（未コンパクション）を除いた件数で、再読み込み後も同じ値になることを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        registry = IndexRegistry(temp_dir)
+        store = _build_store(os.path.join(temp_dir, "staging"), 14, seed=7)
+        registry.adopt("vendors", store)
+        with patch.object(index_manager.settings, "INDEX_COMPACT_RATIO", 1.0):
+            assert store.delete(["V-7-0"]) == 1
+        registry.adopt("vendors", store)
+
+        manager = registry.manager("vendors")
+        assert store.live_count == 13
+        assert manager.status()["ntotal"] == 13
+        assert manager.status()["tombstones"] == 1
+
+        # 公開したファイルから読み直しても同じ件数
+        manager.reload(force=True)
+        assert manager.status()["ntotal"] == 13
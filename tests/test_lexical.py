@@ -0,0 +1,85 @@
+"""
+語彙一致検索（BM25）テスト
+"""
+import os
+import tempfile
+import numpy as np
+from app.core.faiss_store import FAISSStore
+from app.core.embed_cohere import l2_normalize
+from app.core.lexical import BM25Index, tokenize, reciprocal_rank_fusion
+
+TEXTS = [
+    "Dify 導入支援 ローコード LLM アプリ開発",
+    "RAG 構築 コンサルティング 生成AI",
+    "Difyを使った社内チャットボット開発支援",
+    "データ分析 BI ダッシュボード",
+]
+
+
+def test_tokenize_ngrams():
+    """NFKC 正規化・小文字化した上で文字 bi-gram / tri-gram に分割することを確認"""
+    assert tokenize("ＤＩＦＹ") == ["di", "if", "fy", "dif", "ify"]
+    assert tokenize("支援") == ["支援"]
+    # 空白をまたぐ n-gram は作らず、1文字の語はそのまま
+    assert tokenize("A 支援") == ["a", "支援"]
+    assert tokenize("") == []
+
+
+def test_bm25_search_ranking():
+    """語彙一致の多い文書が上位になり、一致しない文書や除外位置は返さないことを確認"""
+    index = BM25Index.from_texts(TEXTS)
+    scores, indices = index.search("Dify支援", k=10)
+    assert sorted(indices[:2]) == [0, 2]
+    assert 3 not in indices
+    assert np.all(np.diff(scores) <= 0)
+
+    scores, indices = index.search("Dify支援", k=10, allowed=np.array([1, 2, 3]))
+    assert list(indices) == [2]
+    assert len(index.search("存在しない語彙", k=10)[0]) == 0
+
+    # 追加・詰め直し後も同じ文書を引ける
+    index.append(["Dify 支援"])
+    assert index.search("dify", k=1)[1][0] == 4
+    compacted = index.take(np.array([1, 4]))
+    assert compacted.size == 2
+    assert list(compacted.search("dify", k=10)[1]) == [1]
+
+
+def test_reciprocal_rank_fusion():
+    """両方の順位リストで上位の候補が先頭に来ることを確認"""
+    scores, indices = reciprocal_rank_fusion([np.array([3, 1, 2]), np.array([1, 5, -1])], limit=3, rrf_k=60)
+    assert list(indices) == [1, 3, 5]
+    assert scores[0] == np.float32(1 / 62 + 1 / 61)
+    assert len(reciprocal_rank_fusion([np.array([], dtype=np.int64)], limit=3)[0]) == 0
+
+
+def test_faiss_store_lexical_persistence():
+    """転置索引が FAISS インデックスと一緒に保存・更新・コンパクションされることを確認"""
+    rng = np.random.default_rng(0)
+    embeddings = l2_normalize(rng.standard_normal((len(TEXTS), 8)).astype('float32'))
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = FAISSStore(os.path.join(temp_dir, "index.faiss"), os.path.join(temp_dir, "meta.json"))
+        store.build_index(embeddings)
+        store.add_metadata([{"vendor_id": f"V-{i}", "type": "SaaS" if i % 2 else "コンサル"} for i in range(len(TEXTS))])
+        store.build_lexical(TEXTS)
+        store.save()
+        assert os.path.join(temp_dir, "lexical.npz") in store.companion_paths()
+
+        loaded = FAISSStore(store.index_path, store.meta_path)
+        loaded.load(mmap_mode=False)
+        assert sorted(loaded.lexical_search("Dify支援", k=5)[1]) == [0, 2]
+        # フィルタ・削除済みは除外
+        assert list(loaded.lexical_search("Dify支援", k=5, filters={"type": ["コンサル"]})[1]) == [0, 2]
+        loaded.delete(["V-0"])
+        assert list(loaded.lexical_search("Dify支援", k=5)[1]) == [2]
+
+        loaded.upsert(["V-9"], embeddings[:1], [{"vendor_id": "V-9"}], texts=["Dify 支援 パートナー"])
+        assert 4 in loaded.lexical_search("Dify支援", k=5)[1]
+        loaded.compact()
+        assert loaded.lexical.size == loaded.index.ntotal == 4
+        assert sorted(loaded.metadata[i]["vendor_id"] for i in loaded.lexical_search("Dify支援", k=5)[1]) == ["V-2", "V-9"]
+
+        # 転置索引なしで保存し直すと古いファイルは残らない
+        store.build_index(embeddings)
+        store.save()
+        assert not os.path.exists(os.path.join(temp_dir, "lexical.npz"))
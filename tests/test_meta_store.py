@@ -0,0 +1,89 @@
+"""
+列指向メタデータストアテスト
+"""
+import pytest
+import numpy as np
+import tempfile
+import os
+from app.core.meta_store import MetaStore, filter_conditions, parse_man_month_jpy, parse_employees_band, MISSING
+from app.core.faiss_store import FAISSStore
+from app.core.embed_cohere import l2_normalize
+
+
+def test_parse_man_month_jpy():
+    """人月単価の表記解析テスト（円単位）"""
+    assert parse_man_month_jpy("200-300") == (2_000_000, 3_000_000)
+    assert parse_man_month_jpy("300程度") == (3_000_000, 3_000_000)
+    assert parse_man_month_jpy("500近辺") == (5_000_000, 5_000_000)
+    assert parse_man_month_jpy("１５０万円～２００万円") == (1_500_000, 2_000_000)
+    assert parse_man_month_jpy("1,200,000円") == (1_200_000, 1_200_000)
+    assert parse_man_month_jpy("100以上") == (1_000_000, MISSING)
+    assert parse_man_month_jpy("要相談") == (MISSING, MISSING)
+
+
+def test_parse_employees_band():
+    """従業員数帯の解析テスト"""
+    assert parse_employees_band("51-200") == (51, 200)
+    assert parse_employees_band("1000名以上") == (1000, MISSING)
+    assert parse_employees_band("〜50名") == (MISSING, 50)
+
+
+def test_meta_store_predicates():
+    """等価・IN・範囲条件の評価テスト"""
+    records = [
+        {"vendor_id": "V-0", "type": "SaaS", "listed": "上場", "man_month_jpy": "200-300"},
+        {"vendor_id": "V-1", "type": "スクラッチ", "listed": "未上場", "man_month_jpy": "500近辺"},
+        {"vendor_id": "V-2", "type": "SaaS", "listed": "未上場"},
+        {"vendor_id": "V-3", "type": "コンサル", "listed": "上場", "man_month_jpy": "100以上"},
+    ]
+    store = MetaStore.from_records(records)
+
+    def allowed(filters):
+        return list(store.allowed(filter_conditions(filters)))
+
+    assert allowed({"type": "SaaS"}) == [0, 2]
+    assert allowed({"type": ["SaaS", "コンサル"], "listed": "上場"}) == [0, 3]
+    assert allowed({"man_month_jpy": {"min": 2_500_000, "max": 4_000_000}}) == [0, 3]
+    assert allowed({"man_month_jpy": {"max": 1_500_000}}) == [3]
+    assert allowed({"type": "なし"}) == []
+    # 偽値・未知キーは無視
+    assert allowed({"type": "", "unknown": "x"}) == [0, 1, 2, 3]
+    with pytest.raises(ValueError):
+        filter_conditions({"type": {"min": 1}})
+
+    # 追加・位置の詰め直し・保存/読み込み
+    store.append([{"vendor_id": "V-4", "type": "SaaS", "man_month_jpy": "250"}])
+    assert allowed({"type": "SaaS", "man_month_jpy": {"min": 2_000_000}}) == [0, 4]
+    compacted = store.take(np.array([1, 4]))
+    assert list(compacted.allowed(filter_conditions({"type": "SaaS"}))) == [1]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "meta_columns.npz")
+        store.save(path)
+        loaded = MetaStore.load(path)
+    assert loaded.size == 5
+    assert list(loaded.allowed(filter_conditions({"listed": "未上場"}))) == [1, 2]
+    assert list(loaded.allowed(filter_conditions({"man_month_jpy": {"min": 4_000_000}}))) == [1, 3]
+
+
+def test_faiss_store_range_filter():
+    """FAISSStore の検索に範囲フィルタが押し下げられることを確認"""
+    rng = np.random.default_rng(6)
+    embeddings = l2_normalize(rng.standard_normal((200, 16)).astype('float32'))
+    metadata = [{"vendor_id": f"V-{i}", "man_month_jpy": f"{100 + i}程度"} for i in range(200)]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        index_path = os.path.join(temp_dir, "index.faiss")
+        meta_path = os.path.join(temp_dir, "meta.json")
+        store = FAISSStore(index_path, meta_path)
+        store.build_index(embeddings)
+        store.add_metadata(metadata)
+        store.save()
+
+        loaded = FAISSStore(index_path, meta_path)
+        loaded.load()
+        assert loaded.columns is not None and loaded.columns.size == 200
+
+        _, indices = loaded.search(embeddings[0], k=5, filters={"man_month_jpy": {"min": 1_500_000, "max": 1_600_000}})
+        assert len(indices) == 5
+        assert all(50 <= i <= 60 for i in indices)
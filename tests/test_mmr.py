@@ -0,0 +1,63 @@
+"""
+MMR再ランクテスト
+"""
+import numpy as np
+from app.utils.mmr import mmr_rerank, mmr_rerank_batch, apply_mmr_filtering
+
+
+def _reference_mmr(embeddings, scores, lambda_param, k):
+    """逐次計算による MMR の選択順（比較用）"""
+    selected = [int(np.argmax(scores))]
+    remaining = [i for i in range(len(scores)) if i != selected[0]]
+    while len(selected) < min(k, len(scores)):
+        best = max(
+            remaining,
+            key=lambda i: (lambda_param * scores[i] - (1 - lambda_param) * max(embeddings[i] @ embeddings[j] for j in selected), -i)
+        )
+        selected.append(best)
+        remaining.remove(best)
+    return selected
+
+
+def _random_candidates(rng, n, d=16):
+    embeddings = rng.standard_normal((n, d)).astype('float32')
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings, rng.random(n).astype('float32')
+
+
+def test_mmr_rerank_matches_reference():
+    """ベクトル化した MMR が逐次計算と同じ順序で選択することを確認"""
+    rng = np.random.default_rng(0)
+    for n, k, lambda_param in [(2, 1, 0.5), (30, 10, 0.3), (80, 100, 0.7), (200, 50, 0.9)]:
+        embeddings, scores = _random_candidates(rng, n)
+        indices = np.arange(n) + 1000
+        reranked_scores, reranked_indices = mmr_rerank(None, embeddings, scores, indices, lambda_param, k)
+
+        expected = _reference_mmr(embeddings, scores, lambda_param, k)
+        assert list(reranked_indices) == [1000 + i for i in expected]
+        np.testing.assert_allclose(reranked_scores, scores[expected])
+
+    # lambda 未指定は元の順序のまま
+    scores, indices = apply_mmr_filtering(None, embeddings, scores, indices, None, 3)
+    assert list(indices) == [1000, 1001, 1002]
+
+
+def test_mmr_rerank_batch():
+    """バッチ版がクエリごとの結果と一致し、候補不足の行を -1 で埋めることを確認"""
+    rng = np.random.default_rng(1)
+    m, n, k = 4, 40, 8
+    batch = [_random_candidates(rng, n) for _ in range(m)]
+    embeddings = np.stack([e for e, _ in batch])
+    scores = np.stack([s for _, s in batch])
+    indices = np.tile(np.arange(n), (m, 1))
+    # 最後のクエリは候補が3件のみ
+    scores[-1, 3:] = -np.inf
+
+    reranked_scores, reranked_indices = mmr_rerank_batch(embeddings, scores, indices, 0.6, k)
+    assert reranked_indices.shape == (m, k)
+    for row in range(m - 1):
+        _, expected = mmr_rerank(None, embeddings[row], scores[row], indices[row], 0.6, k)
+        assert list(reranked_indices[row]) == list(expected)
+    assert sorted(reranked_indices[-1, :3]) == [0, 1, 2]
+    assert list(reranked_indices[-1, 3:]) == [-1] * (k - 3)
+    assert np.all(np.isneginf(reranked_scores[-1, 3:]))
@@ -0,0 +1,199 @@
+"""
+検索エンドポイントテスト
+"""
+import os
+import asyncio
+import threading
+import tempfile
+import numpy as np
+from unittest.mock import patch
+from app.core.faiss_store import FAISSStore
+from app.core.embed_cohere import l2_normalize
+from app.core.index_manager import IndexRegistry
+from app.routers import query
+from app.schemas import QueryRequest
+from app.utils.cache import LRUCache
+
+
+def _build_store(index_dir: str, n: int = 30) -> FAISSStore:
+    rng = np.random.default_rng(0)
+    embeddings = l2_normalize(rng.standard_normal((n, 8)).astype('float32'))
+    store = FAISSStore(os.path.join(index_dir, "index.faiss"), os.path.join(index_dir, "meta.json"))
+    store.build_index(embeddings)
+    store.add_metadata([{"vendor_id": f"V-{i}", "name": f"ベンダー{i}", "type": "SaaS" if i % 2 else "コンサル"} for i in range(n)])
+    return store
+
+
+def test_response_cache_hits_and_invalidation():
+    """同一条件の検索がキャッシュされ、インデックス更新で無効化されることを確認"""
+    calls = []
+
+    async def fake_embed(q):
+        calls.append(q)
+        return l2_normalize(np.ones((1, 8), dtype='float32'))[0]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", _build_store(os.path.join(temp_dir, "vendors")))
+        cache = LRUCache(max_entries=10)
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", cache), \
+             patch.object(query, "embed_query_async", side_effect=fake_embed):
+
+            def search(**kwargs):
+                return asyncio.run(query.search_vendors(QueryRequest(index_name="vendors", **kwargs)))
+
+            first = search(q="ＲＡＧ　支援", k=5, filters={"type": ["SaaS"], "listed": ""})
+            # 表記揺れ・フィルタの書き方が違っても同じキー
+            second = search(q="RAG 支援", k=5, filters={"type": ["SaaS"]})
+            assert second is first
+            assert len(calls) == 1
+            assert cache.stats()["hits"] == 1
+
+            # 条件が違えば別キー
+            search(q="RAG 支援", k=3, filters={"type": ["SaaS"]})
+            assert len(calls) == 2
+
+            # 差分更新（store.version が進む）後は再検索
+            registry.manager("vendors").current_store().delete(["V-1"])
+            third = search(q="RAG 支援", k=5, filters={"type": ["SaaS"]})
+            assert len(calls) == 3
+            assert "V-1" not in [r.vendor_id for r in third.results]
+
+            # 新しい版の公開後も再検索
+            registry.adopt("vendors", _build_store(os.path.join(temp_dir, "vendors")))
+            search(q="RAG 支援", k=5, filters={"type": ["SaaS"]})
+            assert len(calls) == 4
+
+
+def test_lexical_and_hybrid_modes():
+    """lexical は埋め込みなしで検索し、hybrid は埋め込み失敗時に語彙一致のみで応答することを確認"""
+
+    async def failing_embed(q):
+        raise RuntimeError("embedding backend unavailable")
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = _build_store(os.path.join(temp_dir, "vendors"))
+        store.build_lexical([f"ベンダー{i} {'Dify 導入支援' if i == 7 else 'データ分析'}" for i in range(30)])
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", store)
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", None), \
+             patch.object(query.settings, "RESPONSE_CACHE_ENABLED", False), \
+             patch.object(query, "embed_query_async", side_effect=failing_embed) as embed:
+
+            def search(**kwargs):
+                return asyncio.run(query.search_vendors(QueryRequest(index_name="vendors", **kwargs)))
+
+            lexical = search(q="Dify支援", k=3, mode="lexical")
+            assert [r.vendor_id for r in lexical.results] == ["V-7"]
+            assert embed.call_count == 0
+
+            hybrid = search(q="Dify支援", k=3, mode="hybrid", mmr_lambda=0.5)
+            assert [r.vendor_id for r in hybrid.results] == ["V-7"]
+            assert embed.call_count == 1
+
+
+def test_hybrid_fallback_not_cached():
+    """埋め込み失敗時の語彙一致のみの応答はキャッシュせず、復旧後はハイブリッドで検索し直すことを確認"""
+    calls = []
+
+    async def flaky_embed(q):
+        calls.append(q)
+        if len(calls) == 1:
+            raise RuntimeError("embedding backend unavailable")
+        return l2_normalize(np.ones((1, 8), dtype='float32'))[0]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = _build_store(os.path.join(temp_dir, "vendors"))
+        store.build_lexical([f"ベンダー{i} {'Dify 導入支援' if i == 7 else 'データ分析'}" for i in range(30)])
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", store)
+        cache = LRUCache(max_entries=10)
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", cache), \
+             patch.object(query, "embed_query_async", side_effect=flaky_embed):
+
+            def search():
+                return asyncio.run(query.search_vendors(QueryRequest(index_name="vendors", q="Dify支援", k=3, mode="hybrid")))
+
+            fallback = search()
+            assert [r.vendor_id for r in fallback.results] == ["V-7"]
+
+            # 復旧後はキャッシュされた縮退結果ではなく、ベクトル検索と統合した結果を返す
+            recovered = search()
+            assert len(calls) == 2
+            assert recovered is not fallback
+            assert len(recovered.results) == 3
+
+            # 通常の hybrid の結果はキャッシュされる
+            assert search() is recovered
+            assert len(calls) == 2
+
+
+def test_mmr_rescales_only_lexical_scores():
+    """MMR 前の最大値1への正規化は BM25 / RRF スコアのときだけ行い、コサインはそのまま使うことを確認"""
+
+    async def fake_embed(q):
+        return l2_normalize(np.ones((1, 8), dtype='float32'))[0]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = _build_store(os.path.join(temp_dir, "vendors"))
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", store)
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", None), \
+             patch.object(query.settings, "RESPONSE_CACHE_ENABLED", False), \
+             patch.object(query, "embed_query_async", side_effect=fake_embed), \
+             patch.object(query, "apply_mmr_filtering", wraps=query.apply_mmr_filtering) as mmr:
+
+            def search(mode):
+                asyncio.run(query.search_vendors(QueryRequest(index_name="vendors", q="Dify支援", k=3, mode=mode, mmr_lambda=0.5)))
+                return mmr.call_args[0][2]
+
+            # 転置索引が無い hybrid はベクトル検索のみ: コサインのまま
+            vector_scores = search("vector")
+            hybrid_scores = search("hybrid")
+            np.testing.assert_array_equal(hybrid_scores, vector_scores)
+            assert hybrid_scores.max() < 1.0
+
+            # 転置索引があれば RRF スコアを最大値1に揃える
+            store.build_lexical([f"ベンダー{i} {'Dify 導入支援' if i % 3 == 0 else 'データ分析'}" for i in range(30)])
+            assert search("hybrid").max() == 1.0
+
+
+def test_cold_load_runs_off_event_loop():
+    """未読み込みのインデックスはスレッドで読み込み、常駐後はスレッドを経由せずに取得することを確認"""
+    threads = []
+
+    async def fake_embed(q):
+        return l2_normalize(np.ones((1, 8), dtype='float32'))[0]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        IndexRegistry(temp_dir).adopt("vendors", _build_store(os.path.join(temp_dir, "vendors")))
+        # 別プロセスが公開した版を新しいレジストリが初めて読む状況
+        registry = IndexRegistry(temp_dir)
+        original_acquire = registry.acquire
+
+        def recording_acquire(name):
+            threads.append(threading.current_thread())
+            return original_acquire(name)
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", None), \
+             patch.object(query.settings, "RESPONSE_CACHE_ENABLED", False), \
+             patch.object(query, "embed_query_async", side_effect=fake_embed), \
+             patch.object(registry, "acquire", side_effect=recording_acquire):
+
+            def search():
+                return asyncio.run(query.search_vendors(QueryRequest(index_name="vendors", q="RAG 支援", k=3)))
+
+            assert len(search().results) == 3
+            assert len(threads) == 1 and threads[0] is not threading.main_thread()
+
+            assert len(search().results) == 3
+            assert len(threads) == 1
@@ -0,0 +1,42 @@
+"""
+クエリ埋め込みのマイクロバッチ化テスト
+"""
+import numpy as np
+import asyncio
+from app.core.query_batcher import QueryBatcher
+
+
+def test_query_batcher_coalesces_requests():
+    """同時到着クエリが1回の埋め込み呼び出しにまとめられることを確認"""
+    calls = []
+
+    def fake_embed(texts):
+        calls.append(list(texts))
+        return np.array([[float(len(t)), 1.0] for t in texts], dtype=np.float32)
+
+    async def run():
+        batcher = QueryBatcher(fake_embed, window_ms=5, max_batch_size=100)
+        queries = ["a", "bb", "a", "ccc"]
+        results = await asyncio.gather(*[batcher.submit(q) for q in queries])
+        return batcher, results
+
+    batcher, results = asyncio.run(run())
+
+    assert calls == [["a", "bb", "ccc"]]
+    assert [r[0] for r in results] == [1.0, 2.0, 1.0, 3.0]
+    assert batcher.stats()["batches"] == 1
+    assert batcher.stats()["requests"] == 4
+
+
+def test_query_batcher_propagates_errors():
+    """バッチ失敗時は待機中の全リクエストに例外が伝播することを確認"""
+
+    def failing_embed(texts):
+        raise RuntimeError("ThrottlingException")
+
+    async def run():
+        batcher = QueryBatcher(failing_embed, window_ms=1, max_batch_size=2)
+        return await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
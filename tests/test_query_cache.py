@@ -0,0 +1,52 @@
+"""
+クエリ正規化・クエリ埋め込みキャッシュテスト
+"""
+import numpy as np
+import time
+from unittest.mock import patch
+from app.core import embed_cohere
+from app.utils.cache import LRUCache
+from app.utils.text import normalize_query_text
+
+
+def test_normalize_query_text():
+    """クエリ正規化テスト（全角/半角・空白）"""
+    assert normalize_query_text("ＬＬＭ　導入  支援") == "LLM 導入 支援"
+    assert normalize_query_text("ｶﾀｶﾅ ") == "カタカナ"
+    assert normalize_query_text("  RAG\t応用\n") == "RAG 応用"
+
+
+def test_lru_cache_ttl_and_eviction():
+    """LRU/TTLキャッシュテスト"""
+    cache = LRUCache(max_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)  # 最も古い b が削除される
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert cache.stats()["evictions"] == 1
+
+    expired = LRUCache(max_entries=10, ttl_seconds=0.01)
+    expired.put("a", 1)
+    time.sleep(0.02)
+    assert expired.get("a") is None
+
+
+def test_embed_query_uses_normalized_cache():
+    """表記揺れのあるクエリが同じキャッシュエントリを使うことを確認"""
+    calls = []
+
+    def fake_remote(query, model=None):
+        calls.append(query)
+        return np.array([0.6, 0.8], dtype=np.float32)
+
+    cache = LRUCache(max_entries=10)
+    with patch.object(embed_cohere, "_query_cache", cache), \
+         patch.object(embed_cohere, "_embed_query_remote", side_effect=fake_remote):
+        first = embed_cohere.embed_query("ＲＡＧ　支援")
+        second = embed_cohere.embed_query("RAG 支援")
+
+    assert calls == ["RAG 支援"]
+    np.testing.assert_allclose(first, second)
+    assert cache.stats()["hits"] == 1
@@ -0,0 +1,71 @@
+"""
+レート制限・Bedrock 再試行テスト
+"""
+import pytest
+import time
+from unittest.mock import Mock, patch
+from botocore.exceptions import ClientError
+from app.core.backend_selector import BackendSelector
+from app.core.rate_limit import TokenBucket, is_retryable_error
+from app.core import embed_cohere
+
+
+def test_token_bucket_rate_limits():
+    """トークンバケットが補充レートを超えた取得を待たせることを確認"""
+    bucket = TokenBucket(rate=100.0, capacity=1.0)
+    start = time.perf_counter()
+    for _ in range(5):
+        bucket.acquire(1)
+    # 1件目は即時、残り4件は 1/100 秒ずつ待つ
+    assert time.perf_counter() - start >= 0.03
+
+
+def test_invoke_bedrock_retries_throttling():
+    """ThrottlingException はバックオフ付きで再試行され、カウンタに記録されることを確認"""
+    throttle = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+    validation = ClientError({"Error": {"Code": "ValidationException", "Message": "bad"}}, "InvokeModel")
+    assert is_retryable_error(throttle)
+    assert not is_retryable_error(validation)
+
+    payload = {"embeddings": {"float": [[0.1, 0.2]]}}
+    before = dict(embed_cohere._bedrock_stats)
+    with patch.object(embed_cohere.settings, "BEDROCK_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere, "_invoke_bedrock_embed_once", side_effect=[throttle, throttle, payload]) as mock_once:
+        result = embed_cohere._invoke_bedrock_embed(["テキスト"])
+
+    assert result == payload
+    assert mock_once.call_count == 3
+    assert embed_cohere._bedrock_stats["throttles"] - before["throttles"] == 2
+    assert embed_cohere._bedrock_stats["retries"] - before["retries"] == 2
+
+    # リトライ対象外のエラーは即座に送出
+    with patch.object(embed_cohere, "_invoke_bedrock_embed_once", side_effect=validation) as mock_once:
+        with pytest.raises(ClientError):
+            embed_cohere._invoke_bedrock_embed(["テキスト"])
+    assert mock_once.call_count == 1
+
+
+def test_bedrock_retry_budget_under_persistent_throttling():
+    """スロットリングが続いても1バッチの送信回数とレート制限の消費が BEDROCK_MAX_RETRIES + 1 回で止まることを確認"""
+    throttle = ClientError({"Error": {"Code": "ThrottlingException", "Message": "slow down"}}, "InvokeModel")
+    mock_client = Mock()
+    mock_client.embed_documents.side_effect = throttle
+    limiter = Mock()
+
+    with patch.object(embed_cohere.settings, "USE_BEDROCK", True), \
+         patch.object(embed_cohere.settings, "BEDROCK_MAX_RETRIES", 3), \
+         patch.object(embed_cohere.settings, "BEDROCK_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere.settings, "EMBED_BATCH_RETRIES", 2), \
+         patch.object(embed_cohere.settings, "EMBED_RETRY_BASE_DELAY", 0.0), \
+         patch.object(embed_cohere, "_embedder", embed_cohere.RemoteEmbedder()), \
+         patch.object(embed_cohere, "_backend_selector", BackendSelector(failure_threshold=1, reprobe_seconds=60)), \
+         patch.object(embed_cohere, "_rate_limiter", limiter), \
+         patch.object(embed_cohere, "get_embeddings_client", return_value=mock_client), \
+         patch.object(embed_cohere, "_invoke_bedrock_embed_once", side_effect=throttle) as mock_once:
+        with pytest.raises(ClientError):
+            embed_cohere._embed_batches(["テキスト"], "search_document", None)
+
+    # langchain_aws の1回 + boto3 の残り3回
+    assert mock_client.embed_documents.call_count == 1
+    assert mock_once.call_count == 3
+    assert limiter.acquire.call_count == 4
@@ -0,0 +1,99 @@
+"""
+段階別レイテンシ計測テスト
+"""
+import os
+import tempfile
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+from app import main
+from app.core import embed_cohere
+from app.core.embedders import LocalHashEmbedder
+from app.core.index_manager import IndexRegistry
+from app.routers import query
+from app.utils import telemetry
+from app.utils.telemetry import Histogram, render_stats, server_timing, stage, start_request
+from tests.test_query import _build_store
+
+
+def test_histogram_render():
+    """累積バケット・合計・件数を Prometheus テキスト形式で出力することを確認"""
+    histogram = Histogram("test_seconds", "Test latency", ("stage",), buckets=(0.01, 0.1))
+    for value in (0.005, 0.05, 0.05, 3.0):
+        histogram.observe(value, "embed")
+    lines = histogram.render()
+    assert 'test_seconds_bucket{stage="embed",le="0.01"} 1' in lines
+    assert 'test_seconds_bucket{stage="embed",le="0.1"} 3' in lines
+    assert 'test_seconds_bucket{stage="embed",le="+Inf"} 4' in lines
+    assert 'test_seconds_count{stage="embed"} 4' in lines
+    assert histogram.count("embed") == 4
+
+    stats = render_stats("rag_admission", {"search": {"active": 2, "lane": "x"}, "admin": {"active": 0}}, label="lane")
+    assert 'rag_admission_active{lane="search"} 2' in stats
+    assert "lane_lane" not in stats
+
+
+def test_stage_records_request_breakdown():
+    """同じリクエスト内の段階は合算され、例外時はエラーも数えることを確認"""
+    timings = start_request()
+    errors = telemetry.STAGE_ERRORS.value("test_stage")
+    with stage("test_stage"):
+        pass
+    try:
+        with stage("test_stage"):
+            raise RuntimeError("boom")
+    except RuntimeError:
+        pass
+    assert list(timings) == ["test_stage"]
+    assert telemetry.STAGE_ERRORS.value("test_stage") == errors + 1
+    assert server_timing({"embed": 0.0123}, 0.02) == "embed;dur=12.300, total;dur=20.000"
+
+
+def test_server_timing_header_and_metrics_endpoint():
+    """検索レスポンスに段階別の Server-Timing が付き、/metrics に同じ段階のヒストグラムが出ることを確認"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = _build_store(os.path.join(temp_dir, "vendors"))
+        store.build_lexical([f"ベンダー{i} Dify 導入支援" for i in range(30)])
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", store)
+
+        with patch.object(query, "get_index_registry", return_value=registry):
+            client = TestClient(main.app)
+            response = client.post(
+                "/api/v1/query",
+                json={"q": "Dify支援", "k": 3, "mode": "lexical", "mmr_lambda": 0.5, "index_name": "vendors"}
+            )
+            assert response.status_code == 200
+            stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+            for name in ("queue", "lexical_search", "metadata", "mmr", "serialize", "total"):
+                assert name in stages
+
+            metrics = client.get("/metrics")
+            assert metrics.status_code == 200
+            assert metrics.headers["content-type"].startswith("text/plain")
+            assert 'rag_stage_duration_seconds_bucket{stage="lexical_search",le="+Inf"}' in metrics.text
+            assert 'rag_http_requests_total{method="POST",path="/api/v1/query",status="200"}' in metrics.text
+            assert 'rag_admission_active{lane="search"}' in metrics.text
+
+
+@pytest.mark.parametrize("batch_window_ms", [0, 1])
+def test_server_timing_includes_executor_stages(batch_window_ms):
+    """スレッドプールで実行した埋め込み（embed_remote）もリクエストの Server-Timing に入ることを確認（マイクロバッチ時も）"""
+    with tempfile.TemporaryDirectory() as temp_dir:
+        registry = IndexRegistry(temp_dir)
+        registry.adopt("vendors", _build_store(os.path.join(temp_dir, "vendors")))
+
+        with patch.object(query, "get_index_registry", return_value=registry), \
+             patch.object(query, "_response_cache", None), \
+             patch.object(query.settings, "RESPONSE_CACHE_ENABLED", False), \
+             patch.object(embed_cohere, "_query_cache", None), \
+             patch.object(embed_cohere.settings, "QUERY_CACHE_ENABLED", False), \
+             patch.object(embed_cohere.settings, "QUERY_BATCH_WINDOW_MS", batch_window_ms), \
+             patch.object(embed_cohere, "_query_batcher", None), \
+             patch.object(embed_cohere, "get_embedder", return_value=LocalHashEmbedder(dimension=8)):
+            client = TestClient(main.app)
+            response = client.post("/api/v1/query", json={"q": "Dify支援", "k": 3, "index_name": "vendors"})
+            assert response.status_code == 200
+            stages = [entry.split(";")[0] for entry in response.headers["Server-Timing"].split(", ")]
+            assert "embed" in stages
+            assert "embed_remote" in stages